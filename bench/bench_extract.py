@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark cho extract_image_urls: so bản parse 1 lượt (html.parser, có thể chạy ở tiến trình con với trang lớn)
+với bản BeautifulSoup cũ (giữ nguyên ở đây làm mốc). Kiểm tra 2 bản cho ra cùng tập URL và cùng chiều rộng gợi ý
+từ mô tả `w` của srcset, rồi in thời gian trung bình mỗi trang.
+
+Ví dụ:
+    python bench/bench_extract.py                      # HTML tổng hợp: 200 / 2000 / 20000 ảnh
+    python bench/bench_extract.py --file trang.html --base-url https://example.com/gallery/
+    python bench/bench_extract.py --sizes 50000 --repeat 3
+"""
+
+from __future__ import annotations
+
+import os, re, sys, time, argparse
+from urllib.parse import urljoin
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE); sys.path.insert(0, os.path.dirname(HERE))
+
+import image_downloader_engine as engine
+from bench_server import GalleryConfig
+
+
+def extract_image_urls_bs4(html, base_url, hints):
+    """Bản cũ dựa trên BeautifulSoup (trước khi chuyển sang parser 1 lượt) — chỉ dùng để đối chiếu.
+    Chỉ giữ gợi ý từ mô tả `w`; mô tả `x` bản cũ nhân 1000 thành chiều rộng giả nên đã bỏ."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser"); urls = set()
+    for img in soup.find_all("img"):
+        for key in ("src","data-src","data-original","data-lazy"):
+            v = img.get(key)
+            if v:
+                full = v if v.startswith("data:") else urljoin(base_url, v)
+                urls.add(full)
+        srcset = img.get("srcset")
+        if srcset:
+            for part in srcset.split(","):
+                part = part.strip();
+                if not part: continue
+                tokens = part.split(); u = tokens[0]; full = urljoin(base_url, u); urls.add(full)
+                if len(tokens) >= 2:
+                    d = tokens[1].lower()
+                    if d.endswith("w"):
+                        try: w = int(d[:-1]); hints[full] = (w, w)
+                        except: pass
+    for tag in soup.find_all(style=True):
+        for m in re.finditer(r"url\((['\"]?)(.+?)\1\)", tag["style"]):
+            u = m.group(2);
+            if u:
+                full = u if u.startswith("data:") else urljoin(base_url, u); urls.add(full)
+    for a in soup.find_all("a", href=True):
+        href = a["href"]
+        if href.startswith("data:"): urls.add(href)
+        elif re.search(r"\.(png|jpe?g|gif|webp|avif|svg|bmp|tiff?)(\?|#|$)", href, re.I):
+            urls.add(urljoin(base_url, href))
+    return list(urls)
+
+
+def synthetic_html(n_images: int) -> str:
+    """Trang gallery giống bench_server + ảnh nền style=, data-src lazy, srcset kiểu x, link không phải ảnh."""
+    cfg = GalleryConfig(pages=1, images_per_page=n_images); body = cfg.page_html(0).decode("utf-8")
+    extra = []
+    for i in range(0, n_images, 4):
+        extra.append(f'<div class="hero" style="background-image: url(\'/bg/{i}.webp\'); color: red">'
+                     f'<img data-src="/lazy/{i}.png" srcset="/lazy/{i}.png 1x, /lazy/{i}@2x.png 2x" alt="a &amp; b">'
+                     f'<a href="/post/{i}?p=1">bài {i}</a><a href="/dl/{i}.JPEG#full">tải</a></div>')
+    return body.replace("</body>", "\n".join(extra) + "</body>")
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t)
+    return best
+
+
+def bench_one(label: str, html: str, base_url: str, repeat: int) -> bool:
+    old_hints = {}; old = extract_image_urls_bs4(html, base_url, old_hints)
+    new, new_hints = engine.extract_image_sources(html, base_url)
+    bad_hints = [u for u, wh in old_hints.items() if (new_hints.get(u) or (0,))[0] != wh[0]]
+    same = set(old) == set(new) and not bad_hints
+    if not same:
+        print(f"  [{label}] KHÁC KẾT QUẢ: thiếu {sorted(set(old) - set(new))[:5]}, thừa {sorted(set(new) - set(old))[:5]}, "
+              f"gợi ý khác {bad_hints[:5]}")
+    t_old = timed(lambda: extract_image_urls_bs4(html, base_url, {}), repeat)
+    t_new = timed(lambda: engine.extract_image_sources(html, base_url), repeat)
+    line = (f"{label:>12} {len(html) / 1e6:>8.2f} {len(new):>7} {t_old * 1000:>10.1f} {t_new * 1000:>10.1f} "
+            f"{t_old / t_new if t_new else 0:>7.2f}x")
+    if len(html) >= engine.PROCESS_PARSE_MIN_CHARS:
+        engine.extract_image_urls(html, base_url)  # khởi động pool trước, không tính vào thời gian
+        t_proc = timed(lambda: engine.extract_image_urls(html, base_url), repeat)
+        line += f"  (tiến trình con: {t_proc * 1000:.1f} ms)"
+    print(line + ("" if same else "  !"), flush=True)
+    return same
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="So sánh tốc độ/kết quả extract_image_urls cũ (bs4) và mới.")
+    ap.add_argument("--file", default=None, help="file HTML thật để đo (mặc định dùng HTML tổng hợp)")
+    ap.add_argument("--base-url", default="https://example.com/gallery/", help="URL gốc để ghép đường dẫn tương đối")
+    ap.add_argument("--sizes", default="200,2000,20000", help="số ảnh mỗi trang tổng hợp, cách nhau bởi dấu phẩy")
+    ap.add_argument("--repeat", type=int, default=5, help="số lần đo, lấy lần nhanh nhất")
+    args = ap.parse_args(argv)
+
+    print(f"{'trang':>12} {'MB':>8} {'URL':>7} {'bs4 ms':>10} {'mới ms':>10} {'nhanh':>8}")
+    if args.file:
+        with open(args.file, "r", encoding="utf-8", errors="replace") as f: cases = [(os.path.basename(args.file), f.read())]
+    else:
+        cases = [(f"{n} ảnh", synthetic_html(n)) for n in (int(x) for x in args.sizes.split(",") if x.strip())]
+    try:
+        ok = all([bench_one(label, html, args.base_url, max(1, args.repeat)) for label, html in cases])
+    finally:
+        engine.shutdown_parse_pool()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Server HTTP giả lập gallery ảnh cho benchmark (chạy hoàn toàn offline, kết quả lặp lại được theo `seed`).
+
+- /page/<n>            : trang HTML chứa `images_per_page` ảnh, mỗi ảnh có <img src> thumbnail + srcset (w) + <a href> bản gốc
+- /img/<id>-<W>x<H>.jpg: biến thể theo hậu tố kích thước (WordPress-style), dung lượng tỉ lệ theo số pixel
+- /img/<id>.jpg        : bản gốc
+Tùy chọn: độ trễ mỗi request, giới hạn băng thông mỗi kết nối, tỉ lệ lỗi 429/5xx chèn ngẫu nhiên.
+Hỗ trợ HEAD, keep-alive, Range (dùng cho dò kích thước / tải tiếp) và If-None-Match -> 304 (cache trang, chỉ mục ảnh).
+
+Chạy riêng:
+    python bench/bench_server.py --pages 20 --images-per-page 50 --port 8765
+"""
+
+from __future__ import annotations
+
+import re, sys, time, random, hashlib, argparse, threading
+from dataclasses import dataclass, asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+IMG_RE = re.compile(r"^/img/(\d+)(?:-(\d+)x(\d+))?\.jpg$")
+
+
+@dataclass
+class GalleryConfig:
+    pages: int = 10
+    images_per_page: int = 40
+    image_bytes: int = 200_000        # dung lượng bản gốc (bytes)
+    size_jitter: float = 0.5          # dung lượng thật = image_bytes * (1 ± jitter)
+    variants: bool = True             # thêm thumbnail -WxH + srcset
+    orig_size: tuple = (1600, 1200)
+    latency_ms: float = 0.0           # chờ trước mỗi phản hồi
+    bandwidth_kbps: float = 0.0       # KB/s mỗi kết nối, 0 = không giới hạn
+    error_rate: float = 0.0           # tỉ lệ request ảnh trả 429/500/503
+    seed: int = 1234
+
+    def image_id(self, page: int, i: int) -> int:
+        return page * self.images_per_page + i
+
+    def image_len(self, img_id: int, w: int | None = None, h: int | None = None) -> int:
+        rnd = random.Random(self.seed * 1_000_003 + img_id)
+        n = int(self.image_bytes * (1 + self.size_jitter * (2 * rnd.random() - 1)))
+        if w and h: n = int(n * (w * h) / (self.orig_size[0] * self.orig_size[1]))
+        return max(len(JPEG_HEADER) + 16, n)
+
+    def image_body(self, img_id: int, w: int | None = None, h: int | None = None) -> bytes:
+        n = self.image_len(img_id, w, h)
+        # hash() của tuple có None đổi theo mỗi tiến trình (Python < 3.12): dùng sha1 để nội dung ảnh giống nhau giữa các lần chạy
+        rnd = random.Random(int.from_bytes(hashlib.sha1(f"{self.seed}-{img_id}-{w}x{h}".encode()).digest()[:8], "big"))
+        return JPEG_HEADER + rnd.randbytes(n - len(JPEG_HEADER))
+
+    def page_html(self, page: int) -> bytes:
+        W, H = self.orig_size; parts = ["<html><body>"]
+        for i in range(self.images_per_page):
+            img = self.image_id(page, i)
+            if self.variants:
+                tw, th = W // 4, H // 4; mw, mh = W // 2, H // 2
+                parts.append(f'<a href="/img/{img}.jpg"><img src="/img/{img}-{tw}x{th}.jpg" '
+                             f'srcset="/img/{img}-{tw}x{th}.jpg {tw}w, /img/{img}-{mw}x{mh}.jpg {mw}w"></a>')
+            else:
+                parts.append(f'<img src="/img/{img}.jpg">')
+        parts.append("</body></html>")
+        return "\n".join(parts).encode("utf-8")
+
+    @property
+    def total_images(self) -> int:
+        return self.pages * self.images_per_page
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "GalleryServer"
+
+    def log_message(self, *args): pass
+
+    def do_HEAD(self): self._serve(body=False)
+    def do_GET(self): self._serve(body=True)
+
+    def _serve(self, body: bool):
+        cfg = self.server.cfg; self.server.count("requests")
+        if cfg.latency_ms: time.sleep(cfg.latency_ms / 1000)
+        path = self.path.split("?")[0]
+        if path.startswith("/page/"):
+            try: page = int(path[6:])
+            except ValueError: page = -1
+            if not 0 <= page < cfg.pages: return self._empty(404)
+            return self._send(cfg.page_html(page), "text/html; charset=utf-8", body, etag=f'"{cfg.seed}-page-{page}"')
+        m = IMG_RE.match(path)
+        if not m: return self._empty(404)
+        if cfg.error_rate and self.server.roll() < cfg.error_rate:
+            status = self.server.choice((429, 429, 500, 503)); self.server.count(f"injected_{status}")
+            return self._empty(status, {"Retry-After": "1"} if status in (429, 503) else None)
+        img = int(m.group(1)); w = int(m.group(2)) if m.group(2) else None; h = int(m.group(3)) if m.group(3) else None
+        if img >= cfg.total_images: return self._empty(404)
+        data = cfg.image_body(img, w, h); self.server.count("images")
+        return self._send(data, "image/jpeg", body, etag=f'"{cfg.seed}-{img}-{w}x{h}"')
+
+    def _empty(self, status: int, headers: dict | None = None):
+        self.send_response(status)
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.send_header("Content-Length", "0"); self.end_headers()
+
+    def _send(self, data: bytes, ctype: str, body: bool, etag: str | None = None):
+        if etag and etag in (t.strip() for t in self.headers.get("If-None-Match", "").split(",")):
+            self.server.count("not_modified"); self.send_response(304); self.send_header("ETag", etag); self.end_headers(); return
+        start, end = 0, len(data) - 1; rng = self.headers.get("Range", "")
+        m = re.match(r"bytes=(\d+)-(\d*)$", rng)
+        if m and (not self.headers.get("If-Range") or self.headers.get("If-Range") == etag):
+            start = int(m.group(1)); end = min(end, int(m.group(2))) if m.group(2) else end
+            if start > end: return self._empty(416, {"Content-Range": f"bytes */{len(data)}"})
+            self.send_response(206); self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(end - start + 1))
+        if etag: self.send_header("ETag", etag)
+        self.end_headers()
+        if not body: return
+        rate = self.server.cfg.bandwidth_kbps * 1024; chunk = 16 * 1024; t0 = time.monotonic(); sent = 0
+        try:
+            for i in range(start, end + 1, chunk):
+                piece = data[i:min(i + chunk, end + 1)]; self.wfile.write(piece); sent += len(piece)
+                if rate:
+                    ahead = sent / rate - (time.monotonic() - t0)
+                    if ahead > 0: time.sleep(ahead)
+            self.server.count("bytes", sent)
+        except OSError:
+            pass  # client đóng kết nối giữa chừng (Hủy / dò vài KB đầu)
+
+
+class GalleryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 2048
+
+    def __init__(self, cfg: GalleryConfig, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.cfg = cfg; self._lock = threading.Lock(); self._rnd = random.Random(cfg.seed); self.counters = {}
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError): return  # client reset kết nối (Hủy, bỏ ảnh bị lọc giữa chừng)
+        super().handle_error(request, client_address)
+
+    def roll(self) -> float:
+        with self._lock: return self._rnd.random()
+
+    def choice(self, seq):
+        with self._lock: return self._rnd.choice(seq)
+
+    def count(self, key: str, n: int = 1):
+        with self._lock: self.counters[key] = self.counters.get(key, 0) + n
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def page_urls(self) -> list[str]:
+        return [f"{self.base_url}/page/{i}" for i in range(self.cfg.pages)]
+
+    def start(self) -> "GalleryServer":
+        threading.Thread(target=self.serve_forever, name="bench-server", daemon=True).start(); return self
+
+
+def add_config_args(ap: argparse.ArgumentParser):
+    d = GalleryConfig()
+    ap.add_argument("--pages", type=int, default=d.pages)
+    ap.add_argument("--images-per-page", type=int, default=d.images_per_page)
+    ap.add_argument("--image-bytes", type=int, default=d.image_bytes)
+    ap.add_argument("--no-variants", action="store_true", help="chỉ có bản gốc, không srcset/-WxH")
+    ap.add_argument("--latency-ms", type=float, default=d.latency_ms)
+    ap.add_argument("--bandwidth-kbps", type=float, default=d.bandwidth_kbps)
+    ap.add_argument("--error-rate", type=float, default=d.error_rate)
+    ap.add_argument("--seed", type=int, default=d.seed)
+
+
+def config_from_args(args) -> GalleryConfig:
+    return GalleryConfig(pages=args.pages, images_per_page=args.images_per_page, image_bytes=args.image_bytes,
+                         variants=not args.no_variants, latency_ms=args.latency_ms, bandwidth_kbps=args.bandwidth_kbps,
+                         error_rate=args.error_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Server gallery giả lập cho benchmark.")
+    add_config_args(ap); ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args(); srv = GalleryServer(config_from_args(args), args.port)
+    print(f"Đang phục vụ {srv.cfg.pages} trang tại {srv.base_url}/page/0 ... (Ctrl+C để dừng) — {asdict(srv.cfg)}", flush=True)
+    try: srv.serve_forever()
+    except KeyboardInterrupt: sys.exit(0)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark offline cho engine tải ảnh: dựng server gallery giả lập (bench_server.py), chạy DownloadJob với nhiều
+số luồng khác nhau và đo ảnh/s, MB/s, độ trễ p50/p99 mỗi ảnh, peak RSS và thời gian bận của từng giai đoạn
+(tải trang, extract_image_urls, pick_largest_variants, tải ảnh). Mỗi cấu hình chạy trong 1 tiến trình con riêng
+để peak RSS không bị cộng dồn. Kết quả lưu JSON để so sánh giữa các phiên bản.
+
+Ví dụ:
+    python bench/run_bench.py --workers 4,8,16,32 --pages 10 --images-per-page 50 --latency-ms 20
+    python bench/run_bench.py --workers 8,32 --error-rate 0.05 --compare bench_results/truoc.json
+    python bench/run_bench.py --engine threads,async --workers 32,256,1024 --latency-ms 200 --pages 8 --images-per-page 200
+"""
+
+from __future__ import annotations
+
+import os, sys, json, time, shutil, argparse, platform, tempfile, threading, subprocess
+from dataclasses import asdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE); sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_server import GalleryServer, add_config_args, config_from_args
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+        except Exception:
+            return None
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values: return None
+    values = sorted(values); k = (len(values) - 1) * p / 100; lo = int(k); hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_child(spec: dict) -> dict:
+    """Chạy 1 cấu hình trong tiến trình hiện tại (được gọi bởi tiến trình con)."""
+    import image_downloader_engine as engine
+
+    stages = {"page_fetch": 0.0, "extract": 0.0, "variants": 0.0, "download": 0.0}; lock = threading.Lock(); latencies = []
+    def timed(stage, fn):
+        def wrapper(*a, **kw):
+            t = time.perf_counter()
+            try: return fn(*a, **kw)
+            finally:
+                with lock: stages[stage] += time.perf_counter() - t
+        return wrapper
+    # _run gọi các hàm này qua biến toàn cục của module nên bọc tại đây là đủ
+    engine.extract_image_urls = timed("extract", engine.extract_image_urls)
+    engine.pick_largest_variants = timed("variants", engine.pick_largest_variants)
+    orig_get = engine.SessionPool.get
+    def get(self, url, **kw):
+        if kw.get("stream"): return orig_get(self, url, **kw)
+        return timed("page_fetch", orig_get)(self, url, **kw)
+    engine.SessionPool.get = get
+
+    def record(t):
+        dt = time.perf_counter() - t
+        with lock: latencies.append(dt); stages["download"] += dt
+    if spec.get("engine") == "async":
+        from image_downloader_async import AsyncDownloadJob
+        class TimedJob(AsyncDownloadJob):
+            async def _download_one_async(self, session, img_url, referer):
+                t = time.perf_counter()
+                try: return await super()._download_one_async(session, img_url, referer)
+                finally: record(t)
+    else:
+        class TimedJob(engine.DownloadJob):
+            def _download_one(self, img_url, referer):
+                t = time.perf_counter()
+                try: return super()._download_one(img_url, referer)
+                finally: record(t)
+
+    out_dir = tempfile.mkdtemp(prefix="tas_bench_")
+    try:
+        job = TimedJob(spec["pages"], out_dir, {"jpg"}, spec["min_bytes"], False, True, "", spec["workers"], spec.get("probe_pixels", False))
+        t0 = time.perf_counter(); ok, total = job.run(); elapsed = time.perf_counter() - t0
+        st = job.stats.snapshot(); pipeline = job.metrics.snapshot()["stages"]
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return {
+        "engine": spec.get("engine", "threads"), "workers": spec["workers"], "saved": ok, "urls": total, "seconds": round(elapsed, 3),
+        "images_per_s": round(ok / elapsed, 2), "mb_per_s": round(st["bytes"] / elapsed / 1e6, 2),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "peak_rss_mb": peak_rss_mb(), "errors": st["errors"], "skipped": st["skipped"],
+        "stage_busy_s": {k: round(v, 3) for k, v in stages.items()}, "hosts": job.host_limits(),
+        "pipeline_s": {k: round(v["s"], 3) for k, v in pipeline.items()},  # Metrics của job: dns_tcp, headers, transfer, hash, write...
+    }
+
+
+def print_table(results: list[dict], baseline: dict | None = None):
+    base = {(r.get("engine", "threads"), r["workers"]): r for r in (baseline or {}).get("results", [])}
+    print(f"{'engine':>8} {'luồng':>6} {'ảnh/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8} {'lỗi':>5}  so với mốc")
+    for r in results:
+        cmp = ""
+        b = base.get((r["engine"], r["workers"]))
+        if b and b["images_per_s"]:
+            cmp = f"{r['images_per_s'] / b['images_per_s']:.2f}x ảnh/s"
+        print(f"{r['engine']:>8} {r['workers']:>6} {r['images_per_s']:>9} {r['mb_per_s']:>8} {r['latency_p50_ms'] or '-':>8} "
+              f"{r['latency_p99_ms'] or '-':>8} {r['peak_rss_mb'] or '-':>8} {r['errors']:>5}  {cmp}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark offline cho engine tải ảnh.")
+    add_config_args(ap)
+    ap.add_argument("--workers", default="4,8,16,32", help="danh sách số luồng (hoặc số lượt tải đồng thời với async), cách nhau bởi dấu phẩy")
+    ap.add_argument("--engine", default="threads", help="danh sách engine cần đo: threads, async (cách nhau bởi dấu phẩy)")
+    ap.add_argument("--min-bytes", type=int, default=0)
+    ap.add_argument("--probe-pixels", action="store_true")
+    ap.add_argument("--out", default=None, help="file JSON kết quả (mặc định bench_results/<thời điểm>.json)")
+    ap.add_argument("--compare", default=None, help="file JSON kết quả cũ để so sánh")
+    ap.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child:
+        print(json.dumps(run_child(json.loads(args.child)))); return 0
+
+    cfg = config_from_args(args); srv = GalleryServer(cfg).start(); results = []
+    try:
+        for eng, w in [(e.strip(), int(x)) for e in args.engine.split(",") if e.strip() for x in args.workers.split(",") if x.strip()]:
+            spec = {"pages": srv.page_urls(), "workers": w, "min_bytes": args.min_bytes, "probe_pixels": args.probe_pixels, "engine": eng}
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec)],
+                                  capture_output=True, text=True, encoding="utf-8")
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr); return proc.returncode
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            print(f"  {eng} {w}: {results[-1]['images_per_s']} ảnh/s, {results[-1]['seconds']} s", flush=True)
+    finally:
+        srv.shutdown(); srv.server_close()
+
+    import image_downloader_engine
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(),
+              "engine": os.path.basename(image_downloader_engine.__file__), "config": asdict(cfg), "server": srv.counters,
+              "results": results}
+    out = args.out or os.path.join("bench_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f: baseline = json.load(f)
+    print_table(results, baseline); print(f"Đã lưu kết quả: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark khởi động GUI: mỗi lượt chạy 1 tiến trình Python mới (cold start của trình thông dịch, không dùng lại
+module đã nạp) và đo
+  - thời gian import image_downloader_app theo `python -X importtime` (tổng + các module nặng nhất),
+  - thời gian tới lần vẽ cửa sổ đầu tiên (time-to-first-paint, tính từ lúc tạo tiến trình),
+  - các module lẽ ra chỉ nạp khi bắt đầu tải (requests, engine...) mà đã bị import lúc khởi động.
+Lấy trung vị qua nhiều lượt; kết quả lưu JSON để so sánh giữa các phiên bản.
+
+Ví dụ:
+    python bench/startup_bench.py --runs 10
+    python bench/startup_bench.py --compare bench_results/startup_truoc.json
+(Linux không có màn hình: tự dùng QT_QPA_PLATFORM=offscreen.)
+"""
+
+from __future__ import annotations
+
+import os, sys, json, time, argparse, platform, statistics, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__)); ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+# chỉ nên nạp khi bắt đầu job / kiểm tra cập nhật, không phải lúc mở cửa sổ
+LAZY_MODULES = ("requests", "urllib3", "aiohttp", "bs4", "PIL", "sqlite3",
+                "image_downloader_engine", "image_downloader_update", "image_downloader_metrics")
+
+
+def parse_importtime(stderr: str, root: str) -> tuple[dict[str, int], dict[str, int]]:
+    """Từ output của -X importtime: ({module: cumulative µs} của mọi module, {module con trực tiếp của `root`: cumulative µs})."""
+    mods, children, pending = {}, {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line: continue
+        _, cum_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2; name = name.strip(); mods.setdefault(name, int(cum_us))
+        # module con được in trước module cha: gom các dòng độ sâu 1 cho tới khi gặp dòng độ sâu 0
+        if depth == 1: pending[name] = int(cum_us)
+        elif depth == 0:
+            if name == root: children = pending
+            pending = {}
+    return mods, children
+
+
+def measure_import(top: int) -> dict:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import image_downloader_app"], cwd=ROOT,
+                          capture_output=True, text=True, encoding="utf-8")
+    if proc.returncode != 0: raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import lỗi")
+    mods, children = parse_importtime(proc.stderr, "image_downloader_app")
+    heavy = sorted(children.items(), key=lambda kv: -kv[1])[:top]
+    return {"import_ms": mods["image_downloader_app"] / 1000, "heaviest_ms": {n: round(c / 1000, 1) for n, c in heavy},
+            "eager": [m for m in LAZY_MODULES if m in mods]}
+
+
+def child_paint() -> int:
+    """Chạy trong tiến trình con: dựng cửa sổ như khi mở app, in thời điểm vẽ lần đầu rồi thoát ngay."""
+    t_import = time.time()
+    import image_downloader_app as app_mod
+    from PySide6 import QtCore
+    from PySide6.QtWidgets import QApplication
+    t_imported = time.time()
+    app_mod.MainWindow.auto_check_updates = lambda self: None  # không gọi mạng khi đo
+    class FirstPaint(QtCore.QObject):
+        def eventFilter(self, obj, ev):
+            if ev.type() == QtCore.QEvent.Paint:
+                t0 = float(os.environ["TAS_BENCH_T0"]); now = time.time()
+                print(json.dumps({"first_paint_ms": (now - t0) * 1000, "interpreter_ms": (t_import - t0) * 1000,
+                                  "import_app_ms": (t_imported - t_import) * 1000, "window_ms": (now - t_imported) * 1000}), flush=True)
+                os._exit(0)  # không cần dọn dẹp Qt, chỉ đo tới lần vẽ đầu
+            return False
+    app = QApplication(sys.argv); w = app_mod.MainWindow(app); f = FirstPaint(); w.installEventFilter(f); w.show()
+    QtCore.QTimer.singleShot(15000, lambda: os._exit(3))  # không có sự kiện vẽ (thiếu màn hình?)
+    return app.exec()
+
+
+def measure_paint() -> dict:
+    env = dict(os.environ)
+    if sys.platform.startswith("linux") and not (env.get("DISPLAY") or env.get("WAYLAND_DISPLAY")): env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["TAS_BENCH_T0"] = repr(time.time())
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child-paint"], cwd=ROOT, env=env,
+                          capture_output=True, text=True, encoding="utf-8")
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines: raise RuntimeError(f"Không đo được first paint (mã {proc.returncode}): {proc.stderr.strip()[-300:]}")
+    return json.loads(lines[-1])
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark thời gian khởi động GUI (import + first paint).")
+    ap.add_argument("--runs", type=int, default=7, help="số lượt đo, lấy trung vị (mặc định 7)")
+    ap.add_argument("--top", type=int, default=8, help="số module nặng nhất cần in (mặc định 8)")
+    ap.add_argument("--out", default=None, help="file JSON kết quả (mặc định bench_results/startup-<thời điểm>.json)")
+    ap.add_argument("--compare", default=None, help="file JSON kết quả cũ để so sánh")
+    ap.add_argument("--child-paint", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child_paint: return child_paint()
+
+    imports, paints = [], []
+    try:
+        for i in range(max(1, args.runs)):
+            imports.append(measure_import(args.top)); paints.append(measure_paint())
+            print(f"  lượt {i + 1}: import {imports[-1]['import_ms']:.0f} ms, first paint {paints[-1]['first_paint_ms']:.0f} ms", flush=True)
+    except RuntimeError as e:
+        print(e, file=sys.stderr); return 1
+    med = lambda key, rows: round(statistics.median(r[key] for r in rows), 1)
+    result = {"import_ms": med("import_ms", imports), "first_paint_ms": med("first_paint_ms", paints),
+              "interpreter_ms": med("interpreter_ms", paints), "import_app_ms": med("import_app_ms", paints), "window_ms": med("window_ms", paints),
+              "heaviest_ms": {n: round(statistics.median(r["heaviest_ms"].get(n, 0) for r in imports), 1) for n in imports[-1]["heaviest_ms"]},
+              "eager": imports[-1]["eager"]}
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(),
+              "runs": len(paints), "result": result}
+    out = args.out or os.path.join("bench_results", "startup-" + time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+
+    base = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f: base = json.load(f).get("result", {})
+    for key, label in (("first_paint_ms", "first paint"), ("interpreter_ms", "  khởi động Python"), ("import_app_ms", "  import app"),
+                       ("window_ms", "  dựng + vẽ cửa sổ"), ("import_ms", "import (-X importtime)")):
+        cmp = f"  (mốc {base[key]} ms, {result[key] / base[key]:.2f}x)" if base.get(key) else ""
+        print(f"{label:<24} {result[key]:>8} ms{cmp}")
+    print("Module nặng nhất lúc import:", ", ".join(f"{n} {ms} ms" for n, ms in result["heaviest_ms"].items()))
+    if result["eager"]: print("⚠️ Nạp sớm (lẽ ra chỉ nạp khi bắt đầu tải):", ", ".join(result["eager"]))
+    print(f"Đã lưu kết quả: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
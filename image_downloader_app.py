@@ -9,61 +9,62 @@ Build gợi ý (Windows):
     pyinstaller --onefile --windowed --collect-all PySide6 --name "TaiAnhSieuToc" --icon app.ico image_downloader_app.py
     (nếu không có app.ico có thể bỏ --icon)
 
+Chạy từ source cần cài sẵn thư viện (app không tự gọi pip):
+    pip install -r requirements.txt      (tối thiểu: pip install requests PySide6)
+
+Chạy không giao diện (server/cron, không cần PySide6):
+    python image_downloader_cli.py URL -o images --workers 16
+
 Lưu ý: MANIFEST_URL cần trỏ tới JSON public trong repo GitHub của bạn.
 """
 
+from __future__ import annotations
+
 import sys, subprocess
+from typing import TYPE_CHECKING
 
 __version__ = "1.0.3"
 # Đặt mặc định theo repo đã dùng trước đó; đổi nếu khác.
 MANIFEST_URL = "https://raw.githubusercontent.com/bacsyda/tai-anh-sieu-toc/main/public/tai_anh_sieu_toc.json"
 
 
-def _install_if_missing(pkg: str):
-    try:
-        __import__(pkg)
-    except Exception:
-        print(f"[Setup] Chưa có '{pkg}', đang cài...", flush=True)
-        subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
+def _missing_deps() -> list[str]:
+    """Thư viện bắt buộc chưa cài — chỉ tra đường dẫn (find_spec), không import, không gọi pip."""
+    from importlib.util import find_spec
+    return [pkg for pkg in ("requests", "PySide6") if find_spec(pkg) is None]
 
-for _pkg in ("requests", "bs4", "PySide6"):
-    try:
-        _install_if_missing(_pkg)
-    except Exception as e:
-        print(f"[Setup] Lỗi cài {_pkg}: {e}")
-
-import os, re, hashlib, base64, threading, concurrent.futures, tempfile, json
-from threading import Lock
-from urllib.parse import urljoin, urlparse, unquote, parse_qs
-import requests
-from requests.adapters import HTTPAdapter, Retry
-from bs4 import BeautifulSoup
+# Bản .exe đã đóng gói đủ thư viện nên bỏ qua; chạy từ source thiếu thư viện thì báo lệnh cài rồi thoát.
+if __name__ == "__main__" and not getattr(sys, "frozen", False):
+    _missing = _missing_deps()
+    if _missing: sys.exit(f"[Setup] Thiếu thư viện: {', '.join(_missing)}\nCài bằng: {sys.executable} -m pip install {' '.join(_missing)}")
+
+import os, re, base64, tempfile, json, threading, collections, multiprocessing
 from PySide6 import QtCore, QtWidgets
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QGridLayout, QLineEdit, QPushButton,
-    QFileDialog, QLabel, QCheckBox, QSpinBox, QTextEdit, QProgressBar, QHBoxLayout,
-    QVBoxLayout, QMessageBox, QMenuBar, QMenu
+    QFileDialog, QLabel, QCheckBox, QSpinBox, QComboBox, QPlainTextEdit, QProgressBar, QHBoxLayout,
+    QVBoxLayout, QMessageBox, QMenuBar, QMenu, QDockWidget
 )
-from PySide6.QtGui import QIcon, QPixmap, QPalette, QColor, QAction
-
-# ====== Constants & Regex ======
-INVALID_RE = re.compile(r'[<>:"/\\|?*]')
-MIME_TO_EXT = {
-    "image/jpeg": ".jpg", "image/jpg": ".jpg", "image/png": ".png",
-    "image/gif": ".gif", "image/webp": ".webp", "image/avif": ".avif",
-    "image/svg+xml": ".svg", "image/bmp": ".bmp", "image/tiff": ".tif",
-}
-SIZE_SUFFIX_RE = re.compile(r"-(\d{2,5})x(\d{2,5})(?=\.(jpe?g|png|webp|gif|avif|bmp|tiff?)$)", re.I)
-PIN_DIR_RE = re.compile(r"/(\d{2,5})x/")
-DATA_URL_RE = re.compile(r"^data:([^;,]+)?((?:;[^,]+)*)?,(.*)$", re.I)
-HINT_SIZES = {}
+from PySide6.QtGui import QIcon, QPixmap, QPalette, QColor, QAction, QFontDatabase
+# Engine (requests, urllib3, sqlite3...) chiếm hơn nửa thời gian import: chỉ nạp khi bắt đầu tải / kiểm tra cập nhật,
+# để cửa sổ hiện ra trước. Đo lại bằng: python bench/startup_bench.py
+if TYPE_CHECKING:
+    from image_downloader_engine import CrawlOptions, HostProfiles, ImageLimits
 
 # ====== App Icon (fallback nhúng) ======
 _APP_ICON_B64 = (
     b"iVBORw0KGgoAAAANSUhEUgAAAIAAAACACAYAAADDPmHLAAAACXBIWXMAAAsSAAALEgHS3X78AAABr0lEQVR4nO3aMW7CQBBF0a2vB1w2tHkqg3Cw6j3mB4qAM5J5Hk3c0xqgqF0KXj2ZyQ5i+3xwW0QmH0z7o0I1a6d2i8k1H7wM9o+qO5p3tJf7S6Y8n3FQkAAAAAAAAAAAAAAAAAAACw3m1m1zVQW1X0mJQeJjQp8fJg8m+e3g3Q4wq7m1v1m7o0f4b9m3m4X3l1g0E0bB3IY5q3X3+Y1mAgm2tH7n1c5mU1u7Gx5yr2VxJ9eXG1bS7lCj0v5i5cb7b7j7m7qkq3k8qfUz0l0bqvX4HcNQ2d8H1z3k2o8tG3d7tV2Y2Wv3mU8qj9n8h2Jm2d8x4xk3rq9U6i1hU8bq8gqS3d4aX2pQ0oM2kX0b7W3p8fS7o9m0C3n8m3g8mGv0b9V6q7cQ9m7kWLq3rXx3g2h+Q6N0l2p1o0W1m4m8k4o9l8m8ZKp2a8c7m4ZpE2r8g6n5V4r8f5u4GxV7r9G6t9X+f7m8AAAAAAAAAAAAAAAAAAAAAPw5v8s5m6m2jDqAAAAAElFTkSuQmCC"
 )
 
+_app_icon: QIcon | None = None
+
 def load_app_icon() -> QIcon:
+    """Icon ứng dụng, chỉ dò file / giải mã lần đầu rồi dùng lại (cửa sổ, hộp thoại...)."""
+    global _app_icon
+    if _app_icon is None: _app_icon = _find_app_icon()
+    return _app_icon
+
+def _find_app_icon() -> QIcon:
     # Ưu tiên icon runtime (app.ico / app.png) bên cạnh exe/py
     for name in ("app.ico", "app.png"):
         p = os.path.join(os.path.dirname(getattr(sys, 'executable', sys.argv[0])), name)
@@ -99,206 +100,6 @@ def apply_dark_mode(app: QApplication, enabled: bool):
     palette.setColor(QPalette.HighlightedText, QColor(0, 0, 0))
     app.setStyle("Fusion"); app.setPalette(palette)
 
-# ====== Networking ======
-
-def build_session():
-    s = requests.Session()
-    retries = Retry(total=3, backoff_factor=0.5,
-                    status_forcelist=[429, 500, 502, 503, 504],
-                    allowed_methods=["HEAD", "GET", "OPTIONS"])
-    s.mount("http://", HTTPAdapter(max_retries=retries))
-    s.mount("https://", HTTPAdapter(max_retries=retries))
-    s.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119 Safari/537.36"
-    })
-    return s
-
-# ====== Utils ======
-
-def sanitize_filename(name: str) -> str:
-    name = name.split("?")[0].split("#")[0]
-    name = INVALID_RE.sub("_", name).strip(". ")
-    return name or "image"
-
-def ensure_unique(path: str) -> str:
-    if not os.path.exists(path): return path
-    root, ext = os.path.splitext(path)
-    i = 1
-    while True:
-        p = f"{root}_{i}{ext}"
-        if not os.path.exists(p): return p
-        i += 1
-
-def is_image_content_type(ct: str) -> bool:
-    return ct and ct.split(";")[0].strip().startswith("image/")
-
-def choose_extension(filename: str, content_type: str) -> str:
-    _, ext = os.path.splitext(filename); ext = ext.lower()
-    guessed = MIME_TO_EXT.get((content_type or "").split(";")[0].strip(), "")
-    if not ext: return guessed or ".bin"
-    if guessed and ext != guessed: return guessed
-    return ext
-
-# ====== data: URL ======
-
-def decode_data_url(data_url: str):
-    m = DATA_URL_RE.match(data_url)
-    if not m: return None, None
-    mime = (m.group(1) or "").lower().strip(); params = (m.group(2) or "").lower(); data_part = m.group(3) or ""
-    is_base64 = ";base64" in params
-    if is_base64: raw = base64.b64decode(data_part, validate=True)
-    else: raw = unquote(data_part).encode("utf-8")
-    ext = MIME_TO_EXT.get(mime, ".bin")
-    return raw, ext
-
-# ====== Size helpers ======
-
-def extract_named_size(url_path: str):
-    fname = os.path.basename(url_path); m = SIZE_SUFFIX_RE.search(fname)
-    if m: return int(m.group(1)), int(m.group(2))
-    m2 = PIN_DIR_RE.search(url_path)
-    if m2: n = int(m2.group(1)); return n, n
-    return None
-
-def extract_query_size(full_url: str):
-    try: q = parse_qs(urlparse(full_url).query)
-    except Exception: return None
-    def first_int(key):
-        if key in q and q[key]:
-            try: return int(str(q[key][0]).split(",")[0].split("x")[0])
-            except: return None
-        return None
-    def pair_from(key):
-        if key in q and q[key]:
-            raw = str(q[key][0]).replace("%2C", ",").lower()
-            m = re.search(r"(\d{2,5})[x,](\d{2,5})", raw)
-            if m: return int(m.group(1)), int(m.group(2))
-        return None
-    for k in ("fit","resize","size","dim","dimensions"):
-        p = pair_from(k)
-        if p: return p
-    w = None
-    for k in ("w","width","maxwidth","maxw"):
-        w = first_int(k)
-        if w: break
-    h = None
-    for k in ("h","height","maxheight","maxh"):
-        h = first_int(k)
-    if w and h: return w, h
-    if w: return w, w
-    if h: return h, h
-    return None
-
-def canonical_basename(url_path: str):
-    path = PIN_DIR_RE.sub("/originals/", url_path)
-    fname = os.path.basename(path)
-    base = SIZE_SUFFIX_RE.sub("", fname)
-    return base.lower()
-
-def prefer_original_path(url_path: str):
-    return PIN_DIR_RE.sub("/originals/", url_path)
-
-def head_content_length(session, url):
-    try:
-        r = session.head(url, timeout=10, allow_redirects=True)
-        cl = r.headers.get("Content-Length"); return int(cl) if cl and cl.isdigit() else -1
-    except Exception: return -1
-
-def pick_largest_variants(session, urls: list[str]) -> list[str]:
-    buckets = {}
-    for u in urls:
-        if u.startswith("data:"):
-            key = f"DATA::{hash(u)}"; buckets.setdefault(key, []).append((u, None, None)); continue
-        parsed = urlparse(u)
-        rew_path = prefer_original_path(parsed.path)
-        rew_url = parsed._replace(path=rew_path).geturl() if rew_path != parsed.path else u
-        size = (extract_named_size(rew_path) or extract_query_size(rew_url) or HINT_SIZES.get(rew_url))
-        key = canonical_basename(rew_path)
-        buckets.setdefault(key, []).append((rew_url, rew_path, size))
-    picked = []
-    for key, cands in buckets.items():
-        origs = [c for c in cands if "/originals/" in (c[1] or "")]
-        pool = origs if origs else cands
-        with_sizes = [c for c in pool if c[2]]
-        if with_sizes:
-            best = max(with_sizes, key=lambda c: (c[2][0] * c[2][1])); picked.append(best[0]); continue
-        best_url, best_len = None, -1
-        for c in pool:
-            ln = head_content_length(session, c[0])
-            if ln > best_len: best_len, best_url = ln, c[0]
-        picked.append(best_url if best_url else pool[0][0])
-    return picked
-
-# ====== HTML extraction ======
-
-def extract_image_urls(html, base_url):
-    soup = BeautifulSoup(html, "html.parser"); urls = set()
-    for img in soup.find_all("img"):
-        for key in ("src","data-src","data-original","data-lazy"):
-            v = img.get(key)
-            if v:
-                full = v if v.startswith("data:") else urljoin(base_url, v)
-                urls.add(full)
-        srcset = img.get("srcset")
-        if srcset:
-            for part in srcset.split(","):
-                part = part.strip();
-                if not part: continue
-                tokens = part.split(); u = tokens[0]; full = urljoin(base_url, u); urls.add(full)
-                if len(tokens) >= 2:
-                    d = tokens[1].lower()
-                    if d.endswith("w"):
-                        try: w = int(d[:-1]); HINT_SIZES[full] = (w, w)
-                        except: pass
-                    elif d.endswith("x"):
-                        try: mul = float(d[:-1]); w = int(mul * 1000); HINT_SIZES[full] = (w, w)
-                        except: pass
-    for tag in soup.find_all(style=True):
-        for m in re.finditer(r"url\((['\"]?)(.+?)\1\)", tag["style"]):
-            u = m.group(2);
-            if u:
-                full = u if u.startswith("data:") else urljoin(base_url, u); urls.add(full)
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if href.startswith("data:"): urls.add(href)
-        elif re.search(r"\.(png|jpe?g|gif|webp|avif|svg|bmp|tiff?)(\?|#|$)", href, re.I):
-            urls.add(urljoin(base_url, href))
-    return list(urls)
-
-# ====== Save/Download ======
-
-def save_bytes(raw: bytes, out_dir: str, filename: str, min_bytes: int, allow_exts: set, seen_hashes: set, lock: Lock | None = None):
-    if min_bytes and len(raw) < min_bytes: return False, f"Bỏ qua (nhỏ hơn {min_bytes}B): {filename}"
-    ext = os.path.splitext(filename)[1].lower()
-    if allow_exts and ext and ext[1:] not in allow_exts: return False, f"Bỏ qua (không nằm trong allow): {filename}"
-    h = hashlib.sha1(raw).hexdigest()
-    if lock:
-        with lock:
-            if h in seen_hashes: return False, f"Bỏ qua (trùng nội dung): {filename}"
-            seen_hashes.add(h)
-    else:
-        if h in seen_hashes: return False, f"Bỏ qua (trùng nội dung): {filename}"
-        seen_hashes.add(h)
-    out_path = ensure_unique(os.path.join(out_dir, filename))
-    with open(out_path, "wb") as f: f.write(raw)
-    return True, f"Đã lưu: {out_path}"
-
-def download_http_image(session, img_url, out_dir, referer, min_bytes, allow_exts, seen_hashes, lock: Lock | None = None):
-    parsed = urlparse(img_url); filename = sanitize_filename(os.path.basename(parsed.path) or "image")
-    headers = {"Referer": referer} if referer else {}
-    try: r = session.get(img_url, stream=True, timeout=20, headers=headers, allow_redirects=True)
-    except requests.RequestException as e: return False, f"Lỗi tải {img_url} -> {e}"
-    ct = r.headers.get("Content-Type", "").lower()
-    if not is_image_content_type(ct) and not re.search(r"\.(png|jpe?g|gif|webp|avif|svg|bmp|tiff?)$", filename, re.I):
-        r.close(); return False, f"Bỏ qua (không phải ảnh): {img_url} ({ct or 'no content-type'})"
-    ext = choose_extension(filename, ct)
-    filename = os.path.splitext(filename)[0] + ext
-    raw = bytearray()
-    for chunk in r.iter_content(8192):
-        if chunk: raw.extend(chunk)
-    r.close()
-    return save_bytes(bytes(raw), out_dir, filename, min_bytes, allow_exts, seen_hashes, lock)
-
 # ====== Update helpers ======
 
 def parse_version_tuple(s: str):
@@ -310,28 +111,6 @@ def get_current_exe_path() -> str | None:
     if getattr(sys, 'frozen', False): return sys.executable
     return None
 
-def download_with_progress(url: str, dest: str, log_cb):
-    session = build_session()
-    try:
-        with session.get(url, stream=True, timeout=60) as r:
-            r.raise_for_status()
-            total = int(r.headers.get('Content-Length', '0'))
-            done = 0
-            with open(dest, 'wb') as f:
-                for chunk in r.iter_content(1024 * 64):
-                    if chunk:
-                        f.write(chunk); done += len(chunk)
-                        if total: log_cb(f"Tải gói cập nhật: {int(done * 100 / total)}%")
-        return True, None
-    except Exception as e:
-        return False, str(e)
-
-def sha256sum(path: str) -> str:
-    h = hashlib.sha256()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b''): h.update(chunk)
-    return h.hexdigest()
-
 def write_windows_updater(old_exe: str, new_exe: str) -> str:
     bat = f"""@echo off
 setlocal enabledelayedexpansion
@@ -351,70 +130,43 @@ del "{new_exe}" >nul 2>&1
 
 # ====== Workers ======
 class DownloaderWorker(QtCore.QThread):
-    log_msg = QtCore.Signal(str); progress = QtCore.Signal(int); finished = QtCore.Signal(int, int)
+    """Log/tiến độ không bắn signal cho từng ảnh: các luồng tải ghi vào bộ đệm, GUI gọi `drain()` theo timer (~10 Hz)."""
+    finished = QtCore.Signal(int, int)
+    MAX_PENDING_LINES = 2000
     def __init__(self, pages: list[str], out_dir: str, allow_exts: set, min_bytes: int,
-                 accept_data: bool, auto_referer: bool, explicit_referer: str, max_workers: int):
+                 accept_data: bool, auto_referer: bool, explicit_referer: str, max_workers: int, probe_pixels: bool = False,
+                 replay_cache: bool = False, limits: ImageLimits | None = None, engine: str = "threads", layout: str = "flat",
+                 near_dups: int | None = None, host_profiles: HostProfiles | None = None, crawl: CrawlOptions | None = None):
         super().__init__()
-        self.pages = pages; self.out_dir = out_dir; self.allow_exts = allow_exts; self.min_bytes = min_bytes
-        self.accept_data = accept_data; self.auto_referer = auto_referer; self.explicit_referer = explicit_referer
-        self.max_workers = max(1, int(max_workers)); self._stop = threading.Event(); self.hash_lock = Lock(); self.seen_hashes = set()
-    def stop(self): self._stop.set()
-    def _derive_referer(self, page_url: str) -> str:
-        if self.explicit_referer: return self.explicit_referer
-        if not self.auto_referer: return ""
-        try:
-            p = urlparse(page_url)
-            if p.scheme and p.netloc: return f"{p.scheme}://{p.netloc}/"
-        except Exception: return ""
-        return ""
-    def _download_one(self, img_url: str, referer: str) -> bool:
-        if self._stop.is_set(): return False
-        if img_url.startswith("data:"):
-            if not self.accept_data: return False
-            try:
-                raw, ext = decode_data_url(img_url)
-                if raw is None: return False
-                fname = f"inline_{hashlib.sha1(raw).hexdigest()[:12]}{ext}"
-                success, msg = save_bytes(raw, self.out_dir, fname, self.min_bytes, self.allow_exts, self.seen_hashes, self.hash_lock)
-                self.log_msg.emit(msg); return success
-            except Exception as e:
-                self.log_msg.emit(f"Lỗi data URL -> {e}"); return False
-        session = build_session()
-        success, msg = download_http_image(session, img_url, self.out_dir, referer or img_url, self.min_bytes, self.allow_exts, self.seen_hashes, self.hash_lock)
-        self.log_msg.emit(msg); return success
+        from image_downloader_engine import create_job, default_cache_dir
+        self._buf_lock = threading.Lock(); self._lines = collections.deque(maxlen=self.MAX_PENDING_LINES); self._dropped = 0; self._pct = None
+        self.job = create_job(pages, out_dir, allow_exts, min_bytes, accept_data, auto_referer, explicit_referer, max_workers, probe_pixels,
+                              cache_dir=default_cache_dir(), replay_cache=replay_cache, limits=limits, engine=engine, layout=layout,
+                              near_dups=near_dups, host_profiles=host_profiles, crawl=crawl, on_log=self._on_log, on_progress=self._on_progress)
+    def _on_log(self, msg: str):
+        with self._buf_lock:
+            if len(self._lines) == self._lines.maxlen: self._dropped += 1
+            self._lines.append(msg)
+    def _on_progress(self, pct: int):
+        with self._buf_lock: self._pct = pct
+    def drain(self):
+        """Lấy (các dòng log mới, % tiến độ mới nhất hoặc None) kể từ lần drain trước."""
+        with self._buf_lock:
+            lines = list(self._lines); self._lines.clear(); pct = self._pct; self._pct = None
+            if self._dropped: lines.insert(0, f"… (bỏ bớt {self._dropped} dòng log)"); self._dropped = 0
+        return lines, pct
+    def stop(self): self.job.stop()
     def run(self):
-        os.makedirs(self.out_dir, exist_ok=True); session = build_session(); collected = []
-        for page_url in self.pages:
-            if self._stop.is_set(): break
-            try:
-                page = session.get(page_url, timeout=25); page.raise_for_status()
-            except requests.RequestException as e:
-                self.log_msg.emit(f"Lỗi tải trang {page_url}: {e}"); continue
-            urls = extract_image_urls(page.text, page_url);
-            if not urls: self.log_msg.emit(f"Không tìm thấy ảnh ở: {page_url}"); continue
-            collected.extend(urls)
-        if not collected: self.finished.emit(0, 0); return
-        final_urls = pick_largest_variants(session, list(dict.fromkeys(collected)))
-        total = len(final_urls); self.log_msg.emit(f"Sau khi gom biến thể, còn {total} URL cần tải.")
-        if total == 0: self.finished.emit(0, 0); return
-        ok = 0; done = 0
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as ex:
-            futures = [ex.submit(self._download_one, u, self._derive_referer(self.pages[0])) for u in final_urls]
-            for fut in concurrent.futures.as_completed(futures):
-                try:
-                    if fut.result(): ok += 1
-                except Exception as e:
-                    self.log_msg.emit(f"Lỗi worker: {e}")
-                done += 1; self.progress.emit(int(done * 100 / total))
-                if self._stop.is_set(): break
-        self.finished.emit(ok, total)
+        ok, total = self.job.run(); self.finished.emit(ok, total)
 
 class UpdateCheckWorker(QtCore.QThread):
     result = QtCore.Signal(object, object)  # (manifest or None, error or None)
     def run(self):
         try:
-            s = build_session()
-            r = s.get(MANIFEST_URL, timeout=10)
+            from image_downloader_engine import HttpCache, build_session
+            s = build_session(); cache = HttpCache()
+            try: r = cache.get(s, MANIFEST_URL, timeout=10)  # 304 nếu manifest không đổi từ lần kiểm tra trước
+            finally: cache.close()
             r.raise_for_status()
             # strip BOM nếu có:
             txt = r.content.decode("utf-8-sig", errors="replace")
@@ -423,6 +175,21 @@ class UpdateCheckWorker(QtCore.QThread):
         except Exception as e:
             self.result.emit(None, e)
 
+class UpdateDownloadWorker(QtCore.QThread):
+    """Tải gói cập nhật bằng UpdateDownload (Range song song, tải tiếp được) ngoài luồng GUI.
+    Như DownloaderWorker, tiến độ không bắn signal theo từng chunk: GUI đọc `pct` theo timer; xong thì `finished`
+    được phát và kết quả nằm ở `path` (file mới) hoặc `error`."""
+    def __init__(self, url: str, dest: str, sha: str):
+        super().__init__(); self.sha = sha; self.pct = 0; self.path: str | None = None; self.error: Exception | None = None
+        from image_downloader_update import UpdateDownload
+        self.download = UpdateDownload(url, dest, on_progress=self._on_progress)
+    def _on_progress(self, done: int, total: int | None):
+        if total: self.pct = int(done * 100 / total)
+    def stop(self): self.download.cancel.set()
+    def run(self):
+        try: self.download.run(self.sha); self.path = self.download.dest
+        except Exception as e: self.error = e
+
 
 # ====== Main Window ======
 class MainWindow(QMainWindow):
@@ -433,6 +200,7 @@ class MainWindow(QMainWindow):
 
         # Menu (giữ lại mục trợ giúp)
         menubar = QMenuBar(self); self.setMenuBar(menubar)
+        view_menu = QMenu("Xem", self); menubar.addMenu(view_menu)
         help_menu = QMenu("Trợ giúp", self); menubar.addMenu(help_menu)
         act_about = QAction("Giới thiệu", self); act_about.triggered.connect(self.show_about); help_menu.addAction(act_about)
 
@@ -443,16 +211,45 @@ class MainWindow(QMainWindow):
         self.out_edit = QLineEdit(os.path.join(os.getcwd(), "images")); self.btn_out = QPushButton("Chọn thư mục…")
         self.allow_edit = QLineEdit("jpg,png,webp,gif,avif")
         self.min_spin = QSpinBox(); self.min_spin.setRange(0, 10_000_000); self.min_spin.setValue(30000)
+        self.max_spin = QSpinBox(); self.max_spin.setRange(0, 2_000_000_000); self.max_spin.setSpecialValueText("không giới hạn")
+        self.min_w_spin = QSpinBox(); self.min_w_spin.setRange(0, 20000); self.min_w_spin.setSuffix(" px rộng")
+        self.min_h_spin = QSpinBox(); self.min_h_spin.setRange(0, 20000); self.min_h_spin.setSuffix(" px cao")
         self.cb_no_data = QCheckBox("Bỏ qua data: URL"); self.cb_no_data.setChecked(True)
         self.cb_auto_ref = QCheckBox("Tự suy ra Referer từ domain"); self.cb_auto_ref.setChecked(True)
+        self.cb_probe_px = QCheckBox("Dò kích thước thật (tải vài KB đầu)")
+        self.cb_near = QCheckBox("Lọc ảnh gần trùng")
+        self.cb_near.setToolTip("Cùng 1 ảnh khác cỡ/định dạng/mức nén chỉ giữ bản lớn nhất, xóa bản nhỏ hơn đã lưu (cần Pillow)")
+        self.cb_replay = QCheckBox("Dùng trang đã cache (không tải lại HTML)")
+        self.cb_replay.setToolTip("Lấy HTML từ lần tải trước để thử lại bộ lọc (định dạng, min bytes) ngay lập tức")
         self.ref_edit = QLineEdit(); self.ref_edit.setPlaceholderText("Tùy chọn: Referer cụ thể (nếu site chặn hotlink)")
+        # hồ sơ theo host (header/cookie/timeout/Referer riêng); mặc định host_profiles.json bên cạnh exe/py nếu có
+        default_prof = os.path.join(os.path.dirname(getattr(sys, 'executable', sys.argv[0])), "host_profiles.json")
+        self.prof_edit = QLineEdit(default_prof if os.path.isfile(default_prof) else "")
+        self.prof_edit.setPlaceholderText("(Tùy chọn) File .json hồ sơ theo host: headers, cookies, timeout, referer")
+        self.btn_prof = QPushButton("Chọn file .json…")
+        self.cb_crawl = QCheckBox("Crawl: tự tìm thêm trang")
+        self.cb_crawl.setToolTip("Coi URL là điểm bắt đầu: theo trang kế tiếp (rel=next, ?page=2...), sitemap.xml và RSS/Atom của cùng host")
+        self.crawl_spin = QSpinBox(); self.crawl_spin.setRange(1, 100000); self.crawl_spin.setValue(200); self.crawl_spin.setSuffix(" trang tối đa")
         self.dark_cb = QCheckBox("Dark mode")
         self.workers_spin = QSpinBox(); self.workers_spin.setRange(1, 32); self.workers_spin.setValue(8)
+        self.engine_combo = QComboBox(); self.engine_combo.addItem("Luồng (requests)", "threads"); self.engine_combo.addItem("asyncio (aiohttp)", "async")
+        self.engine_combo.setToolTip("asyncio: hàng trăm/hàng nghìn lượt tải đồng thời trên 1 luồng, hợp với nhiều host chậm (cần aiohttp)")
+        self.workers_label = QLabel("Số luồng tải:")
+        self.layout_combo = QComboBox()
+        for text, mode in (("Chung 1 thư mục", "flat"), ("Theo host", "host"), ("Theo trang", "page"), ("Theo hash (thư mục rất lớn)", "hash")):
+            self.layout_combo.addItem(text, mode)
 
         # Buttons
         self.btn_start = QPushButton("Bắt đầu tải"); self.btn_stop = QPushButton("Hủy"); self.btn_open = QPushButton("Mở thư mục lưu")
         self.progress = QProgressBar(); self.progress.setRange(0, 100); self.progress.setValue(0)
-        self.log = QTextEdit(); self.log.setReadOnly(True)
+        self.log = QPlainTextEdit(); self.log.setReadOnly(True); self.log.setMaximumBlockCount(5000)
+        self.stats_label = QLabel(""); self.stats_label.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse)
+        # Bảng hiệu năng: thời gian từng giai đoạn, mã HTTP theo host, lý do bỏ qua (Metrics của job), ẩn mặc định
+        self.metrics_view = QPlainTextEdit(); self.metrics_view.setReadOnly(True)
+        self.metrics_view.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont)); self.metrics_view.setMinimumWidth(360)
+        self.metrics_dock = QDockWidget("Hiệu năng", self); self.metrics_dock.setWidget(self.metrics_view)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.metrics_dock); self.metrics_dock.hide()
+        view_menu.addAction(self.metrics_dock.toggleViewAction()); self._ticks = 0
 
         grid = QGridLayout()
         grid.addWidget(QLabel("URL:"), 0, 0); grid.addWidget(self.url_edit, 0, 1, 1, 3)
@@ -460,17 +257,27 @@ class MainWindow(QMainWindow):
         grid.addWidget(QLabel("Thư mục lưu:"), 2, 0); grid.addWidget(self.out_edit, 2, 1, 1, 2); grid.addWidget(self.btn_out, 2, 3)
         grid.addWidget(QLabel("Định dạng cho phép:"), 3, 0); grid.addWidget(self.allow_edit, 3, 1)
         grid.addWidget(QLabel("Min bytes (lọc nhỏ):"), 3, 2); grid.addWidget(self.min_spin, 3, 3)
-        grid.addWidget(self.cb_no_data, 4, 1); grid.addWidget(self.cb_auto_ref, 4, 2)
-        grid.addWidget(QLabel("Referer (tùy chọn):"), 5, 0); grid.addWidget(self.ref_edit, 5, 1, 1, 3)
-        grid.addWidget(QLabel("Số luồng tải:"), 6, 0); grid.addWidget(self.workers_spin, 6, 1); grid.addWidget(self.dark_cb, 6, 2)
+        px_row = QHBoxLayout(); px_row.addWidget(self.min_w_spin); px_row.addWidget(self.min_h_spin)
+        grid.addWidget(QLabel("Max bytes (lọc lớn):"), 4, 0); grid.addWidget(self.max_spin, 4, 1)
+        grid.addWidget(QLabel("Kích thước tối thiểu:"), 4, 2); grid.addLayout(px_row, 4, 3)
+        grid.addWidget(self.cb_near, 5, 0); grid.addWidget(self.cb_no_data, 5, 1); grid.addWidget(self.cb_auto_ref, 5, 2); grid.addWidget(self.cb_probe_px, 5, 3)
+        grid.addWidget(QLabel("Referer (tùy chọn):"), 6, 0); grid.addWidget(self.ref_edit, 6, 1, 1, 3)
+        grid.addWidget(QLabel("Engine tải:"), 8, 0); grid.addWidget(self.engine_combo, 8, 1)
+        grid.addWidget(QLabel("Xếp thư mục:"), 8, 2); grid.addWidget(self.layout_combo, 8, 3)
+        grid.addWidget(QLabel("Hồ sơ host (.json):"), 9, 0); grid.addWidget(self.prof_edit, 9, 1, 1, 2); grid.addWidget(self.btn_prof, 9, 3)
+        grid.addWidget(self.cb_crawl, 10, 0); grid.addWidget(self.crawl_spin, 10, 1)
+        grid.addWidget(self.workers_label, 7, 0); grid.addWidget(self.workers_spin, 7, 1); grid.addWidget(self.dark_cb, 7, 2); grid.addWidget(self.cb_replay, 7, 3)
         btn_row = QHBoxLayout(); btn_row.addWidget(self.btn_start); btn_row.addWidget(self.btn_stop); btn_row.addStretch(1); btn_row.addWidget(self.btn_open)
-        vbox = QVBoxLayout(cw); vbox.addLayout(grid); vbox.addWidget(self.progress); vbox.addLayout(btn_row); vbox.addWidget(self.log, 1)
+        vbox = QVBoxLayout(cw); vbox.addLayout(grid); vbox.addWidget(self.progress); vbox.addWidget(self.stats_label); vbox.addLayout(btn_row); vbox.addWidget(self.log, 1)
 
         # Signals
-        self.btn_out.clicked.connect(self.pick_dir); self.btn_txt.clicked.connect(self.pick_txt)
+        self.btn_out.clicked.connect(self.pick_dir); self.btn_txt.clicked.connect(self.pick_txt); self.btn_prof.clicked.connect(self.pick_profiles)
         self.btn_start.clicked.connect(self.start_download); self.btn_stop.clicked.connect(self.stop_download)
         self.btn_open.clicked.connect(self.open_dir); self.dark_cb.toggled.connect(self.toggle_dark)
-        self.worker: DownloaderWorker | None = None
+        self.engine_combo.currentIndexChanged.connect(self.on_engine_changed)
+        self.worker: DownloaderWorker | None = None; self.dl_worker: UpdateDownloadWorker | None = None
+        self.ui_timer = QtCore.QTimer(self); self.ui_timer.setInterval(100); self.ui_timer.timeout.connect(self.flush_worker_output)
+        self.up_timer = QtCore.QTimer(self); self.up_timer.setInterval(100); self.up_timer.timeout.connect(lambda: self.progress.setValue(self.dl_worker.pct))
 
         # Auto-check update sau 1.2s
         QtCore.QTimer.singleShot(1200, self.auto_check_updates)
@@ -480,20 +287,20 @@ class MainWindow(QMainWindow):
         QMessageBox.information(self, "Giới thiệu", f"Tải ảnh siêu tốc\nPhiên bản: {__version__}")
 
     def auto_check_updates(self):
-        self.log.append("Đang kiểm tra cập nhật...")
+        self.log.appendPlainText("Đang kiểm tra cập nhật...")
         self.up_worker = UpdateCheckWorker(); self.up_worker.result.connect(self.on_update_checked); self.up_worker.start()
 
     def on_update_checked(self, manifest, err):
         if err:
-            self.log.append(f"Không kiểm tra được cập nhật: {err}")
+            self.log.appendPlainText(f"Không kiểm tra được cập nhật: {err}")
             return
         latest = str(manifest.get("version", "0.0.0")); cur = parse_version_tuple(__version__); lat = parse_version_tuple(latest)
         if lat <= cur:
-            self.log.append("Bạn đang dùng bản mới nhất.")
+            self.log.appendPlainText("Bạn đang dùng bản mới nhất.")
             return
         win = manifest.get("windows", {}); url = win.get("url"); sha = (win.get("sha256") or "").lower()
         if not url:
-            self.log.append("Manifest thiếu URL tải cho Windows.")
+            self.log.appendPlainText("Manifest thiếu URL tải cho Windows.")
             return
         # Hỏi tải ngay
         ret = QMessageBox.question(self, "Có bản cập nhật", f"Phát hiện phiên bản mới {latest}.\nBạn có muốn tải và cài đặt ngay không?",
@@ -506,20 +313,26 @@ class MainWindow(QMainWindow):
         if not exe_path:
             QMessageBox.information(self, "Cập nhật", f"Bạn đang chạy từ source.\nVui lòng tải file .exe mới tại:\n{url}")
             return
+        if self.dl_worker and self.dl_worker.isRunning(): return
         tmp_dir = tempfile.gettempdir(); new_path = os.path.join(tmp_dir, f"TaiAnhSieuToc_{latest}.exe")
-        ok, err = download_with_progress(url, new_path, self.log.append)
-        if not ok:
-            QMessageBox.warning(self, "Cập nhật", f"Tải thất bại: {err}")
-            try: os.remove(new_path)
-            except: pass
+        self.log.appendPlainText(f"Đang tải bản {latest}..."); self.progress.setValue(0)
+        # lần tải trước bị gián đoạn thì UpdateDownload tự tải tiếp từ file .part còn lại trong thư mục tạm
+        self.dl_worker = UpdateDownloadWorker(url, new_path, sha)
+        self.dl_worker.finished.connect(self.on_update_downloaded)
+        self.dl_worker.start(); self.up_timer.start()
+
+    def on_update_downloaded(self):
+        from image_downloader_update import ChecksumMismatch
+        self.up_timer.stop(); new_path = self.dl_worker.path; err = self.dl_worker.error
+        if not err: self.progress.setValue(100)
+        if isinstance(err, ChecksumMismatch):
+            QMessageBox.warning(self, "Cập nhật", f"Sai checksum!\nManifest: {err.expected}\nTải được: {err.actual}")
             return
-        if sha:
-            calc = sha256sum(new_path).lower()
-            if calc != sha:
-                QMessageBox.warning(self, "Cập nhật", f"Sai checksum!\nManifest: {sha}\nTải được: {calc}")
-                try: os.remove(new_path)
-                except: pass
-                return
+        if err:
+            QMessageBox.warning(self, "Cập nhật", f"Tải thất bại: {err}\nLần cập nhật sau sẽ tải tiếp phần còn thiếu.")
+            return
+        self.log.appendPlainText("Đã tải xong gói cập nhật.")
+        exe_path = get_current_exe_path()
         up_bat = write_windows_updater(exe_path, new_path)
         try:
             if sys.platform.startswith('win'):
@@ -534,40 +347,73 @@ class MainWindow(QMainWindow):
 
     # ===== UI actions =====
     def toggle_dark(self, checked: bool): apply_dark_mode(self.app, checked)
+    def on_engine_changed(self, _index: int):
+        # engine asyncio không tốn 1 luồng cho mỗi lượt tải nên cho phép đồng thời nhiều hơn hẳn
+        is_async = self.engine_combo.currentData() == "async"
+        self.workers_label.setText("Số lượt tải đồng thời:" if is_async else "Số luồng tải:")
+        self.workers_spin.setRange(1, 2048 if is_async else 32)
     def pick_dir(self):
         d = QFileDialog.getExistingDirectory(self, "Chọn thư mục lưu", self.out_edit.text() or os.getcwd())
         if d: self.out_edit.setText(d)
     def pick_txt(self):
         path, _ = QFileDialog.getOpenFileName(self, "Chọn file .txt chứa danh sách URL", os.getcwd(), "Text files (*.txt)")
         if path: self.txt_edit.setText(path)
+    def pick_profiles(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Chọn file hồ sơ theo host", os.getcwd(), "JSON (*.json)")
+        if path: self.prof_edit.setText(path)
     def start_download(self):
+        from image_downloader_engine import CrawlOptions, HostProfiles, ImageLimits, read_url_list
         pages = []
         txt_path = self.txt_edit.text().strip()
         if txt_path and os.path.isfile(txt_path):
-            try:
-                with open(txt_path, "r", encoding="utf-8", errors="ignore") as f:
-                    for line in f:
-                        u = line.strip();
-                        if u: pages.append(u)
+            try: pages = read_url_list(txt_path)
             except Exception as e:
-                self.log.append(f"Không đọc được file .txt: {e}")
+                self.log.appendPlainText(f"Không đọc được file .txt: {e}")
         if not pages:
             url = self.url_edit.text().strip();
             if url: pages = [url]
         if not pages:
-            self.log.append("❗ Vui lòng nhập URL hoặc chọn file .txt danh sách URL."); return
+            self.log.appendPlainText("❗ Vui lòng nhập URL hoặc chọn file .txt danh sách URL."); return
+        profiles = None; prof_path = self.prof_edit.text().strip()
+        if prof_path:
+            try: profiles = HostProfiles.load(prof_path)
+            except (OSError, ValueError) as e:
+                self.log.appendPlainText(f"❗ Không đọc được file hồ sơ host: {e}"); return
         out_dir = self.out_edit.text().strip() or os.path.join(os.getcwd(), "images")
         allow_exts = set([e.strip().lower() for e in self.allow_edit.text().split(",") if e.strip()])
         min_bytes = int(self.min_spin.value()); accept_data = not self.cb_no_data.isChecked()
         auto_ref = self.cb_auto_ref.isChecked(); ref = self.ref_edit.text().strip(); max_workers = int(self.workers_spin.value())
+        probe_px = self.cb_probe_px.isChecked(); replay = self.cb_replay.isChecked()
+        limits = ImageLimits(int(self.max_spin.value()), int(self.min_w_spin.value()), int(self.min_h_spin.value()))
         self.log.clear(); self.progress.setValue(0); self.btn_start.setEnabled(False)
-        self.worker = DownloaderWorker(pages, out_dir, allow_exts, min_bytes, accept_data, auto_ref, ref, max_workers)
-        self.worker.log_msg.connect(self.log.append); self.worker.progress.connect(self.progress.setValue); self.worker.finished.connect(self.on_finished)
-        self.worker.start()
+        engine = self.engine_combo.currentData(); layout = self.layout_combo.currentData(); near = 6 if self.cb_near.isChecked() else None
+        crawl = CrawlOptions(max_pages=int(self.crawl_spin.value())) if self.cb_crawl.isChecked() else None
+        try: self.worker = DownloaderWorker(pages, out_dir, allow_exts, min_bytes, accept_data, auto_ref, ref, max_workers, probe_px, replay, limits, engine,
+                                            layout, near, profiles, crawl)
+        except ImportError:
+            self.log.appendPlainText("⚠️ Chưa cài aiohttp (pip install aiohttp) — dùng engine luồng.")
+            self.worker = DownloaderWorker(pages, out_dir, allow_exts, min_bytes, accept_data, auto_ref, ref, min(max_workers, 32), probe_px, replay, limits,
+                                           layout=layout, near_dups=near, host_profiles=profiles, crawl=crawl)
+        self.worker.finished.connect(self.on_finished)
+        self.worker.start(); self.ui_timer.start()
     def stop_download(self):
         if self.worker and self.worker.isRunning(): self.worker.stop()
+    def flush_worker_output(self):
+        if not self.worker: return
+        lines, pct = self.worker.drain()
+        if lines: self.log.appendPlainText("\n".join(lines))
+        if pct is not None: self.progress.setValue(pct)
+        st = self.worker.job.stats.snapshot()
+        skipped = ", ".join(f"{n} {reason}" for reason, n in sorted(st["skipped"].items(), key=lambda kv: -kv[1]))
+        self.stats_label.setText(f"Đã lưu: {st['saved']} ảnh ({st['bytes'] / 1e6:.1f} MB, {st['bytes_per_s'] / 1e6:.2f} MB/s)"
+                                 f"  ·  Bỏ qua: {sum(st['skipped'].values())}{f' ({skipped})' if skipped else ''}  ·  Lỗi: {st['errors']}")
+        self._ticks += 1
+        if self.metrics_dock.isVisible() and (self._ticks % 5 == 0 or not self.ui_timer.isActive()):  # ~2 lần/giây là đủ đọc
+            from image_downloader_metrics import summary_lines
+            self.metrics_view.setPlainText("\n".join(summary_lines(self.worker.job.metrics.snapshot())))
     def on_finished(self, ok: int, total: int):
-        self.log.append(f"\n✅ Hoàn tất: {ok}/{total} ảnh hợp lệ."); self.btn_start.setEnabled(True); self.progress.setValue(100)
+        self.ui_timer.stop(); self.flush_worker_output()
+        self.log.appendPlainText(f"\n✅ Hoàn tất: {ok}/{total} ảnh hợp lệ."); self.btn_start.setEnabled(True); self.progress.setValue(100)
     def open_dir(self):
         path = self.out_edit.text().strip() or os.path.join(os.getcwd(), "images")
         try:
@@ -576,8 +422,9 @@ class MainWindow(QMainWindow):
                 elif sys.platform == 'darwin': subprocess.Popen(['open', path])
                 else: subprocess.Popen(['xdg-open', path])
         except Exception as e:
-            self.log.append(f"Không mở được thư mục: {e}")
+            self.log.appendPlainText(f"Không mở được thư mục: {e}")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # bản đóng gói .exe: tiến trình con parse HTML khởi động lại chính exe
     app = QApplication(sys.argv); w = MainWindow(app); w.show(); sys.exit(app.exec())
 
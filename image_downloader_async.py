@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Engine tải ảnh bằng asyncio + aiohttp (tùy chọn — cần `pip install aiohttp`), cùng giao diện với DownloadJob.
+Tầng tải ảnh chạy hàng trăm/hàng nghìn request đồng thời trên 1 luồng với 1 connector dùng chung; ghi file
+được đẩy sang vài luồng phụ. Tải trang, parse HTML và gom biến thể vẫn giống engine luồng.
+Chọn bằng `create_job(..., engine="async")` (GUI: ô "Engine", CLI: --engine async).
+"""
+
+from __future__ import annotations
+
+import os, time, queue, asyncio, threading, concurrent.futures
+from urllib.parse import urlparse
+
+import requests
+import aiohttp
+
+from image_downloader_engine import (
+    CHUNK_SIZE, USER_AGENT, DownloadJob, HostLimiter, StreamSaver, choose_extension, discard_part, head_bytes_wanted,
+    image_dimensions, image_filename, image_request_headers, index_recorder, part_path_for, range_resumed,
+    remember_validator, retry_after_seconds, retry_backoff, screen_image_head, screen_image_headers, RETRY_STATUS, RETRY_TOTAL,
+)
+
+
+class AsyncDownloadJob(DownloadJob):
+    """DownloadJob với tầng tải ảnh chạy trên event loop: `max_workers` là số lượt tải đồng thời (có thể hàng nghìn),
+    không phải số luồng. Giới hạn theo host (HostLimiter) dùng chung với phần tải trang."""
+    IO_THREADS = 4
+    DRAIN_MAX = 16 * 1024
+
+    def _download_stage(self, url_q: queue.Queue, finished):
+        asyncio.run(self._download_all(url_q, finished))
+
+    async def _download_all(self, url_q: queue.Queue, finished):
+        loop = asyncio.get_running_loop(); aq = asyncio.Queue(self.max_workers); self._slots = {}
+        self._io = concurrent.futures.ThreadPoolExecutor(self.IO_THREADS, thread_name_prefix="img-io")
+        def feed():
+            # url_q là queue của luồng parser: chuyển sang asyncio.Queue, chờ khi đầy để giữ backpressure
+            while True:
+                u = self._get(url_q)
+                try: asyncio.run_coroutine_threadsafe(aq.put(u), loop).result()
+                except (concurrent.futures.CancelledError, RuntimeError): return  # Hủy: vòng lặp đã dừng / đã đóng
+                if u is None: return
+        async def worker(session):
+            while True:
+                u = await aq.get()
+                if u is None:
+                    aq.put_nowait(None); return  # chuyền tín hiệu dừng cho worker khác
+                try: success, msg = await self._download_one_async(session, u, self._referer_for(u))
+                except asyncio.CancelledError: return  # Hủy: URL đang tải chưa ghi vào nhật ký, lần sau tải tiếp
+                except Exception as e:
+                    success, msg = False, None if self._stop.is_set() else f"Lỗi worker: {e}"
+                    if msg: self._log(msg)
+                finished(u, success, msg)
+        async def cancel_on_stop(tasks):
+            # Hủy: cắt ngang cả request đang chờ header / đang đọc body thay vì đợi hết timeout
+            while not self._stop.is_set(): await asyncio.sleep(0.1)
+            for t in tasks: t.cancel()
+        connector = aiohttp.TCPConnector(limit=self.max_workers, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=20, sock_read=20)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"User-Agent": USER_AGENT},
+                                             trace_configs=[self._connect_timer()]) as session:
+                threading.Thread(target=feed, name="img-feed", daemon=True).start()
+                tasks = [asyncio.create_task(worker(session)) for _ in range(self.max_workers)]
+                watcher = asyncio.create_task(cancel_on_stop(tasks))
+                try: await asyncio.gather(*tasks)
+                finally: watcher.cancel()
+        finally:
+            self._io.shutdown(wait=True)
+
+    def _connect_timer(self) -> aiohttp.TraceConfig:
+        """Bấm giờ mở kết nối mới (DNS + TCP + TLS gộp, aiohttp không tách) -> giai đoạn "connect"."""
+        tc = aiohttp.TraceConfig()
+        async def on_start(session, ctx, params): ctx.host = urlparse(str(params.url)).netloc.lower()
+        async def on_connect_start(session, ctx, params): ctx.t0 = time.perf_counter()
+        async def on_connect_end(session, ctx, params): self.metrics.observe("connect", time.perf_counter() - ctx.t0, ctx.host)
+        tc.on_request_start.append(on_start)
+        tc.on_connection_create_start.append(on_connect_start); tc.on_connection_create_end.append(on_connect_end)
+        return tc
+
+    async def _in_io(self, fn, *args):
+        fut = asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+        try: return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # task bị Hủy: vẫn chờ bước ghi file đang chạy xong để saver.close() không chạy chồng lên nó
+            try: await fut
+            except Exception: pass
+            raise
+
+    async def _acquire(self, host: str):
+        while True:
+            wait = self.pool.limiter.try_acquire(host)
+            if not wait: return
+            cond = self._slots.setdefault(host, asyncio.Condition())
+            async with cond:
+                try: await asyncio.wait_for(cond.wait(), wait)
+                except asyncio.TimeoutError: pass
+
+    async def _release(self, host: str, status: int | None = None, latency: float | None = None, retry_after: float | None = None) -> bool:
+        slowed = self.pool.limiter.release(host, status, latency, retry_after)
+        cond = self._slots.get(host)
+        if cond:
+            async with cond: cond.notify(1)
+        return slowed
+
+    async def _request(self, session, host: str, url: str, headers: dict):
+        """GET qua HostLimiter; 429/503 hạ giới hạn host rồi thử lại như SessionPool, 500/502/504 thử lại tối đa RETRY_TOTAL
+        lần với backoff như urllib3 Retry của engine luồng. Trả về (response, độ trễ).
+        Hồ sơ host (header, cookie, timeout) áp giống SessionPool."""
+        m = self.metrics; kw = {"headers": headers}
+        if self.profiles:
+            kw = self.profiles.request_kw(host, kw)
+            if "timeout" in kw: kw["timeout"] = aiohttp.ClientTimeout(total=None, sock_connect=kw["timeout"], sock_read=kw["timeout"])
+        attempt = errors = 0
+        while True:
+            t0 = time.monotonic(); await self._acquire(host); m.observe("host_wait", time.monotonic() - t0, host); t0 = time.monotonic()
+            try: resp = await session.get(url, **kw)
+            except BaseException as e:
+                await self._release(host)
+                if not isinstance(e, asyncio.CancelledError): m.count("request_errors", host=host, error=type(e).__name__)
+                raise
+            latency = time.monotonic() - t0
+            m.count("responses", host=host, status=resp.status, method="GET"); m.observe("headers", latency, host)
+            if resp.status in HostLimiter.THROTTLE_STATUS and attempt < self.pool.throttle_retries:
+                m.count("retries", kind="throttle", host=host)
+                retry_after = retry_after_seconds(resp.headers.get("Retry-After")); resp.release()
+                if not await self._release(host, resp.status, latency, retry_after):
+                    await asyncio.sleep(self.pool.limiter.throttle_wait(retry_after, attempt))  # 429/503 lẻ tẻ: chỉ request này chờ
+                attempt += 1; continue
+            if resp.status in RETRY_STATUS and errors < RETRY_TOTAL:
+                errors += 1; m.count("retries", kind="urllib3")  # cùng nhãn với engine luồng để metric 2 engine so sánh được
+                resp.release(); await self._release(host, resp.status, latency)
+                await asyncio.sleep(retry_backoff(errors)); continue
+            return resp, latency
+
+    async def _download_one_async(self, session, img_url: str, referer: str) -> tuple[bool, str | None]:
+        """Như DownloadJob._download_one nhưng không chặn event loop."""
+        if self._stop.is_set(): return False, None
+        if img_url.startswith("data:"):
+            success, msg = await self._in_io(self._save_data_url, img_url)
+        else:
+            success, msg = False, self._precheck(img_url)
+            if not msg:
+                with self.metrics.timer("image", urlparse(img_url).netloc.lower(), url=img_url):
+                    success, msg = await self._fetch_image(session, img_url, referer, part_path_for(self.out_dir, img_url))
+        if not success and self._stop.is_set(): return False, None  # bị Hủy giữa chừng: không tính lỗi, lần sau tải tiếp
+        if msg is not None: self._image(img_url, success, msg)
+        return success, msg
+
+    async def _drain(self, resp):
+        # body nhỏ thì đọc nốt để connector giữ kết nối keep-alive (giống _discard_response của engine luồng)
+        cl = resp.headers.get("Content-Length", "")
+        if cl.isdigit() and int(cl) <= self.DRAIN_MAX:
+            try: await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError): pass
+
+    async def _fetch_image(self, session, img_url: str, referer: str, part_path: str) -> tuple[bool, str]:
+        filename = image_filename(img_url)
+        headers, offset, skip = await self._in_io(image_request_headers, img_url, referer, self.index, part_path)
+        if skip: return False, skip
+        host = urlparse(img_url).netloc.lower()
+        try: resp, latency = await self._request(session, host, img_url, headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError, requests.RequestException) as e: return False, f"Lỗi tải {img_url} -> {e}"
+        try: result = await self._read_image(resp, img_url, filename, offset, part_path)
+        finally:
+            resp.release(); await self._release(host, resp.status, latency)
+        if result is None: return await self._fetch_image(session, img_url, referer, part_path)
+        return result
+
+    async def _read_image(self, resp, img_url: str, filename: str, offset: int, part_path: str) -> tuple[bool, str] | None:
+        """Lọc theo header + vài KB đầu rồi ghi phần còn lại; None nếu cần tải lại từ đầu (416 khi tải tiếp .part)."""
+        if resp.status == 304: return False, f"Bỏ qua (không đổi từ lần trước): {filename}"
+        if offset and not range_resumed(resp.status, resp.headers, offset):
+            await self._in_io(discard_part, part_path)
+            if resp.status == 416: return None  # .part hỏng/dài hơn file thật
+            offset = 0
+        reason = screen_image_headers(img_url, filename, resp.status, resp.headers, offset, self.min_bytes, self.allow_exts, self.limits)
+        if reason:
+            await self._drain(resp); return False, reason
+        ct = resp.headers.get("Content-Type", ""); ext = ""; buf = bytearray()
+        try:
+            if not offset:
+                want = head_bytes_wanted(self.limits)
+                while len(buf) < want:
+                    chunk = await resp.content.read(CHUNK_SIZE)
+                    if not chunk: break
+                    buf += chunk
+                    if want > 32 and image_dimensions(bytes(buf)): break
+                ext, reason = screen_image_head(img_url, filename, ct, bytes(buf), self.limits)
+                if reason: return False, reason
+                await self._in_io(remember_validator, part_path, resp.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e: return False, f"Lỗi tải {img_url} -> {e}"
+        filename = os.path.splitext(filename)[0] + (ext or choose_extension(filename, ct.lower()))
+        saver = StreamSaver(self.out_dir, filename, self.min_bytes, self.allow_exts, self.seen_hashes, self.hash_lock,
+                            index_recorder(self.index, img_url, resp.headers), part_path, self.limits, self._place_for(img_url), self.near,
+                            self.metrics, urlparse(img_url).netloc.lower())
+        try:
+            reason = await self._in_io(saver.begin)
+            if reason: return False, reason
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                # gom đủ 1 chunk rồi mới đẩy sang luồng ghi file, tránh 1 lượt chuyển luồng cho mỗi gói TCP nhỏ
+                buf += chunk
+                if len(buf) >= CHUNK_SIZE:
+                    reason = await self._in_io(saver.write, bytes(buf)); buf.clear()
+                    if reason: return False, reason
+                if self._stop.is_set():
+                    saver.keep = True; return False, f"Lỗi tải {img_url} -> Đã hủy"
+            reason = await self._in_io(saver.write, bytes(buf))
+            if reason: return False, reason
+            return await self._in_io(saver.finish)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            saver.keep = True; return False, f"Lỗi tải {img_url} -> {e}"
+        except asyncio.CancelledError:
+            saver.keep = True; raise
+        finally:
+            await self._in_io(saver.close)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Tải ảnh siêu tốc — chế độ dòng lệnh (không cần PySide6), hợp cho cron/container.
+Mỗi sự kiện in ra stdout là 1 dòng JSON:
+    {"event": "log", "msg": ...}
+    {"event": "image", "url": ..., "ok": true, "msg": ...}
+    {"event": "progress", "pct": 42}
+    {"event": "finished", "ok": 12, "total": 30, "seconds": 4.2, "metrics": {...}}
+
+Ví dụ:
+    python image_downloader_cli.py https://example.com/gallery -o images --workers 16
+    python image_downloader_cli.py --list pages.txt -o images --allow jpg,png --min-bytes 50000
+    python image_downloader_cli.py --list pages.txt -o images --min-bytes 100000 --replay-cache
+    python image_downloader_cli.py --list pages.txt -o images --profiles host_profiles.json
+    python image_downloader_cli.py https://example.com/gallery/ -o images --crawl --max-pages 500
+    python image_downloader_cli.py URL -o images --metrics-jsonl trace.jsonl --metrics-port 9464 --profile job.pstats
+"""
+
+from __future__ import annotations
+
+import sys, os, json, time, argparse, threading, multiprocessing
+
+from image_downloader_engine import ENGINES, LAYOUTS, CrawlOptions, HostProfiles, ImageLimits, create_job, read_url_list, default_cache_dir
+from image_downloader_metrics import PROFILERS, JsonlSink, Metrics, PrometheusFile, PrometheusServer, start_profiler
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="image_downloader_cli", description="Tải ảnh siêu tốc (không giao diện).")
+    ap.add_argument("url", nargs="?", help="URL trang web")
+    ap.add_argument("-l", "--list", dest="txt", help="file .txt chứa danh sách URL — mỗi dòng 1 URL (ưu tiên hơn URL)")
+    ap.add_argument("-o", "--out", default=os.path.join(os.getcwd(), "images"), help="thư mục lưu (mặc định ./images)")
+    ap.add_argument("--allow", default="jpg,png,webp,gif,avif", help="định dạng cho phép, cách nhau bởi dấu phẩy")
+    ap.add_argument("--min-bytes", type=int, default=30000, help="bỏ ảnh nhỏ hơn số byte này (mặc định 30000)")
+    ap.add_argument("--max-bytes", type=int, default=0, help="bỏ ảnh lớn hơn số byte này, dừng tải ngay khi vượt (0 = không giới hạn)")
+    ap.add_argument("--min-width", type=int, default=0, help="bỏ ảnh hẹp hơn số pixel này")
+    ap.add_argument("--min-height", type=int, default=0, help="bỏ ảnh thấp hơn số pixel này")
+    ap.add_argument("--max-width", type=int, default=0, help="bỏ ảnh rộng hơn số pixel này (0 = không giới hạn)")
+    ap.add_argument("--max-height", type=int, default=0, help="bỏ ảnh cao hơn số pixel này (0 = không giới hạn)")
+    ap.add_argument("--data-urls", action="store_true", help="lưu cả ảnh data: URL (mặc định bỏ qua)")
+    ap.add_argument("--no-auto-referer", action="store_true", help="không tự suy ra Referer từ domain")
+    ap.add_argument("--referer", default="", help="Referer cụ thể (nếu site chặn hotlink)")
+    ap.add_argument("--profiles", metavar="FILE",
+                    help="file JSON hồ sơ theo host: headers, cookies, timeout, referer (origin/page/none/URL) cho ảnh của host đó")
+    ap.add_argument("-w", "--workers", type=int, default=8, help="số luồng tải / số lượt tải đồng thời với --engine async (mặc định 8)")
+    ap.add_argument("--layout", choices=LAYOUTS, default="flat",
+                    help="xếp file: flat (1 thư mục), host, page (thư mục con theo host/trang), hash (ab/cd/ theo nội dung, cho hàng triệu file)")
+    ap.add_argument("--engine", choices=ENGINES, default="threads", help="threads: requests + luồng; async: asyncio + aiohttp (cần cài aiohttp)")
+    ap.add_argument("--near-dups", type=int, nargs="?", const=6, default=None, metavar="BIT",
+                    help="lọc ảnh gần trùng (khác cỡ/định dạng/mức nén), chỉ giữ bản lớn nhất; BIT = độ khác tối đa của dHash "
+                         "(mặc định 6 nếu không ghi). Cần Pillow")
+    ap.add_argument("--crawl", action="store_true",
+                    help="coi URL là điểm bắt đầu, tự tìm thêm trang: trang kế tiếp (rel=next, ?page=2...), sitemap.xml, RSS/Atom")
+    ap.add_argument("--max-pages", type=int, default=200, help="--crawl: tổng số trang/sitemap/feed tối đa (mặc định 200)")
+    ap.add_argument("--max-depth", type=int, default=20, help="--crawl: số bước tối đa tính từ URL gốc (mặc định 20)")
+    ap.add_argument("--any-host", action="store_true", help="--crawl: nhận cả trang ở host khác URL gốc")
+    ap.add_argument("--no-sitemaps", action="store_true", help="--crawl: không đọc robots.txt / sitemap.xml")
+    ap.add_argument("--no-feeds", action="store_true", help="--crawl: không theo RSS/Atom")
+    ap.add_argument("--probe-pixels", action="store_true", help="dò kích thước thật bằng vài KB đầu của ảnh")
+    ap.add_argument("--cache-dir", default=default_cache_dir(), help="thư mục cache trang HTML (mặc định %(default)s)")
+    ap.add_argument("--no-cache", action="store_true", help="không dùng cache trang, luôn tải lại toàn bộ HTML")
+    ap.add_argument("--replay-cache", action="store_true",
+                    help="chỉ lấy trang từ cache, không hỏi lại server (để thử lại bộ lọc nhanh); ảnh vẫn tải bình thường")
+    ap.add_argument("--metrics-jsonl", metavar="FILE", help="ghi thời gian từng giai đoạn (mỗi lần đo 1 dòng JSON) vào FILE")
+    ap.add_argument("--metrics-prom", metavar="FILE", help="ghi số liệu định dạng Prometheus vào FILE mỗi 5 giây")
+    ap.add_argument("--metrics-port", type=int, metavar="PORT", help="phục vụ số liệu Prometheus tại http://127.0.0.1:PORT/metrics")
+    ap.add_argument("--profile", metavar="FILE", help="chạy kèm profiler, ghi kết quả vào FILE")
+    ap.add_argument("--profile-mode", choices=PROFILERS, default="cprofile",
+                    help="cprofile: .pstats đầy đủ (chậm hơn); sample: lấy mẫu stack mọi luồng, dạng folded cho flamegraph")
+    return ap
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    out_lock = threading.Lock()
+    def emit(event: str, **data):
+        line = json.dumps({"event": event, **data}, ensure_ascii=False)
+        with out_lock: sys.stdout.write(line + "\n"); sys.stdout.flush()
+
+    pages = []
+    if args.txt:
+        try: pages = read_url_list(args.txt)
+        except OSError as e: emit("log", msg=f"Không đọc được file .txt: {e}")
+    if not pages and args.url: pages = [args.url.strip()]
+    if not pages:
+        emit("log", msg="Vui lòng nhập URL hoặc file .txt danh sách URL."); return 2
+
+    allow_exts = {e.strip().lower() for e in args.allow.split(",") if e.strip()}
+    profiles = None
+    if args.profiles:
+        try: profiles = HostProfiles.load(args.profiles)
+        except (OSError, ValueError) as e:
+            emit("log", msg=f"Không đọc được file hồ sơ host: {e}"); return 2
+    metrics = Metrics()
+    try:
+        if args.metrics_jsonl: metrics.add_sink(JsonlSink(args.metrics_jsonl))
+        if args.metrics_prom: metrics.add_sink(PrometheusFile(args.metrics_prom))
+        if args.metrics_port is not None: emit("log", msg=f"Số liệu Prometheus: {metrics.add_sink(PrometheusServer(args.metrics_port)).url}")
+    except OSError as e:
+        metrics.close(); emit("log", msg=f"Không mở được đầu ra số liệu: {e}"); return 2
+    try:
+        job = create_job(pages, args.out, allow_exts, max(0, args.min_bytes), args.data_urls, not args.no_auto_referer,
+                         args.referer.strip(), max(1, args.workers), args.probe_pixels,
+                         cache_dir=None if args.no_cache and not args.replay_cache else args.cache_dir, replay_cache=args.replay_cache,
+                         limits=ImageLimits(max(0, args.max_bytes), args.min_width, args.min_height, args.max_width, args.max_height),
+                         engine=args.engine, layout=args.layout, near_dups=args.near_dups, metrics=metrics, host_profiles=profiles,
+                         crawl=CrawlOptions(args.max_depth, args.max_pages, not args.any_host, not args.no_sitemaps, not args.no_feeds)
+                         if args.crawl else None,
+                         on_log=lambda msg: emit("log", msg=msg),
+                         on_progress=lambda pct: emit("progress", pct=pct),
+                         on_image=lambda url, ok, msg: emit("image", url=url, ok=ok, msg=msg))
+    except ImportError as e:
+        metrics.close(); emit("log", msg=f"Engine {args.engine} cần thư viện chưa cài: {e} (pip install aiohttp)"); return 2
+    profiler = start_profiler(args.profile, args.profile_mode) if args.profile else None
+    result = {}; t0 = time.monotonic()
+    runner = threading.Thread(target=lambda: result.update(zip(("ok", "total"), job.run())), name="job", daemon=True)
+    runner.start()
+    try:
+        while runner.is_alive(): runner.join(0.2)
+    except KeyboardInterrupt:
+        # Ctrl+C: báo job dừng rồi chờ các luồng đang chạy thoát gọn
+        job.stop(); runner.join()
+    if profiler: emit("log", msg=profiler.stop())
+    metrics.close()
+    emit("finished", ok=result.get("ok", 0), total=result.get("total", 0), seconds=round(time.monotonic() - t0, 3),
+         stats=job.stats.snapshot(), hosts=job.host_limits(), metrics=metrics.snapshot())
+    if job.stopped: return 130
+    return 0 if "ok" in result else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
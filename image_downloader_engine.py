@@ -0,0 +1,1873 @@
+# -*- coding: utf-8 -*-
+"""
+Engine tải ảnh của "Tải ảnh siêu tốc" — không phụ thuộc Qt.
+Dùng chung cho GUI (image_downloader_app.py) và CLI chạy nền (image_downloader_cli.py).
+"""
+
+from __future__ import annotations
+
+import os, re, gzip, time, uuid, json, queue, atexit, socket, weakref, itertools, sqlite3, hashlib, base64, threading, collections, concurrent.futures, concurrent.futures.process, email.utils
+import xml.etree.ElementTree as ET
+from threading import Lock
+from urllib.parse import urljoin, urlparse, unquote, parse_qs, parse_qsl, urlencode
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from html.parser import HTMLParser
+from image_downloader_metrics import Metrics
+
+# ====== Constants & Regex ======
+INVALID_RE = re.compile(r'[<>:"/\\|?*]')
+MIME_TO_EXT = {
+    "image/jpeg": ".jpg", "image/jpg": ".jpg", "image/png": ".png",
+    "image/gif": ".gif", "image/webp": ".webp", "image/avif": ".avif",
+    "image/svg+xml": ".svg", "image/bmp": ".bmp", "image/tiff": ".tif",
+}
+SIZE_SUFFIX_RE = re.compile(r"-(\d{2,5})x(\d{2,5})(?=\.(jpe?g|png|webp|gif|avif|bmp|tiff?)$)", re.I)
+PIN_DIR_RE = re.compile(r"/(\d{2,5})x/")
+IMG_NAME_RE = re.compile(r"\.(png|jpe?g|gif|webp|avif|svg|bmp|tiff?)$", re.I)
+DATA_URL_RE = re.compile(r"^data:([^;,]+)?((?:;[^,]+)*)?,(.*)$", re.I)
+
+
+# ====== Networking ======
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119 Safari/537.36"
+
+# Thử lại lỗi server tạm thời (cả 2 engine dùng chung): số lần, hệ số backoff kiểu urllib3, mã HTTP
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (500, 502, 504)
+
+def retry_backoff(n: int) -> float:
+    """Thời gian chờ trước lượt thử lại thứ `n` (1, 2, ...), cùng công thức với urllib3 Retry: lượt đầu thử ngay."""
+    return 0.0 if n <= 1 else RETRY_BACKOFF * 2 ** (n - 1)
+
+def build_session(adapter_factory=None):
+    s = requests.Session()
+    retries = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                    allowed_methods=["HEAD", "GET", "OPTIONS"])
+    make = adapter_factory or (lambda r: HTTPAdapter(max_retries=r))
+    s.mount("http://", make(retries))
+    s.mount("https://", make(retries))
+    s.headers.update({"User-Agent": USER_AGENT})
+    return s
+
+def _time_connect(conn, metrics: Metrics):
+    # connect() của urllib3 mở socket qua conn._new_conn() (DNS + TCP) rồi mới bắt tay TLS: bấm giờ riêng 2 phần
+    from urllib3.connection import HTTPSConnection
+    orig_new, orig_connect = conn._new_conn, conn.connect; tcp = [0.0]; tls = isinstance(conn, HTTPSConnection)
+    host = conn.host.lower() if conn.port in (None, conn.default_port) else f"{conn.host.lower()}:{conn.port}"  # như netloc của URL
+    def new_conn():
+        t = time.perf_counter()
+        try: return orig_new()
+        finally: tcp[0] = time.perf_counter() - t; metrics.observe("dns_tcp", tcp[0], host)
+    def connect():
+        t = time.perf_counter(); orig_connect()
+        if tls: metrics.observe("tls", time.perf_counter() - t - tcp[0], host)
+    conn._new_conn = new_conn; conn.connect = connect
+
+def _counting_pool(base, bump, track=None, cancel: threading.Event | None = None, metrics: Metrics | None = None):
+    # Đếm số lần lấy kết nối và số kết nối mới mở (phần còn lại là keep-alive tái sử dụng).
+    # `track(conn)` nhận mọi kết nối mới để SessionPool.abort() ngắt được; đã Hủy thì không cấp kết nối nữa
+    # (chặn luôn các lượt urllib3 tự thử lại sau khi socket bị ngắt).
+    class _Pool(base):
+        def _get_conn(self, timeout=None):
+            if cancel is not None and cancel.is_set(): raise requests.RequestException("Đã hủy")
+            bump("requests"); return super()._get_conn(timeout)
+        def _new_conn(self):
+            bump("new"); conn = super()._new_conn()
+            if track: track(conn)
+            if metrics: _time_connect(conn, metrics)
+            return conn
+    _Pool.__name__ = "Counting" + base.__name__
+    return _Pool
+
+class _CancellableRetry(Retry):
+    """Retry của urllib3 nhưng lượt chờ backoff giữa các lần thử lại bị cắt ngang khi `cancel` được đặt (Hủy).
+    `on_retry()` được gọi trước mỗi lượt thử lại (để đếm)."""
+    def __init__(self, *args, cancel: threading.Event | None = None, on_retry=None, **kw):
+        super().__init__(*args, **kw); self.cancel = cancel; self.on_retry = on_retry
+    def new(self, **kw):
+        r = super().new(**kw); r.cancel = self.cancel; r.on_retry = self.on_retry; return r
+    def sleep(self, response=None):
+        if self.on_retry: self.on_retry()
+        if self.cancel is None: return super().sleep(response)
+        if self.cancel.wait(self.get_backoff_time()): raise requests.RequestException("Đã hủy")
+
+class _PooledAdapter(HTTPAdapter):
+    def __init__(self, bump, track=None, cancel: threading.Event | None = None, metrics: Metrics | None = None, **kw):
+        self._bump = bump; self._track = track; self._cancel = cancel; self._metrics = metrics; super().__init__(**kw)
+    def init_poolmanager(self, *args, **kw):
+        super().init_poolmanager(*args, **kw)
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._bump, self._track, self._cancel, self._metrics),
+            "https": _counting_pool(HTTPSConnectionPool, self._bump, self._track, self._cancel, self._metrics),
+        }
+
+def retry_after_seconds(value: str | None, cap: float = 120.0) -> float | None:
+    """Retry-After dạng số giây hoặc HTTP-date -> số giây chờ (giới hạn bởi `cap`)."""
+    if not value: return None
+    value = value.strip()
+    if value.isdigit(): return min(cap, float(value))
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, min(cap, when.timestamp() - time.time()))
+    except (TypeError, ValueError, IndexError): return None
+
+class HostLimiter:
+    """Giới hạn số request đang chạy và số request/giây cho từng host, tự điều chỉnh kiểu AIMD:
+    mỗi request thành công tăng dần giới hạn; host quá tải (429/503 chiếm từ OVERLOAD_RATIO số phản hồi kể từ lần giảm
+    trước, xét tối đa WINDOW phản hồi gần nhất) thì giảm một nửa và cả host chờ theo Retry-After. 429/503 lẻ tẻ không
+    làm chậm cả host: `release` trả về False để riêng request đó tự chờ rồi thử lại.
+    Độ trễ tăng vọt so với mức nền (EWMA chậm, không phải độ trễ nhỏ nhất từng gặp: 1 HEAD/304 nhanh không được biến mọi
+    GET bình thường thành "quá tải") chỉ giảm nhẹ và không xuống dưới LATENCY_MIN_LIMIT / LATENCY_MIN_RATE.
+    Giới hạn req/s hồi phục theo cấp số nhân (x RATE_GROWTH mỗi giây sạch) và được bỏ hẳn sau RECOVER_AFTER giây
+    không quá tải, để 1 đợt quá tải ngắn không kéo chậm host suốt phần còn lại của job."""
+    THROTTLE_STATUS = (429, 503)
+    WINDOW = 50             # số phản hồi gần nhất dùng để phân biệt quá tải thật với 429/503 lẻ tẻ
+    OVERLOAD_RATIO = 0.2
+    MIN_SAMPLE = 20         # cửa sổ ít hơn chừng này phản hồi vẫn tính tỉ lệ trên MIN_SAMPLE
+    RATE_GROWTH = 1.1       # hệ số tăng req/s cho mỗi giây sạch
+    RECOVER_AFTER = 10.0    # giây không quá tải -> bỏ giới hạn req/s, trả lại số luồng tối đa
+    MAX_RETRY_AFTER = 30.0  # Retry-After lớn hơn mức này (server cấu hình sai) chỉ chờ tối đa chừng này
+    BASE_ALPHA = 0.01       # hệ số EWMA của độ trễ nền (chậm; 1/n khi chưa đủ 1/BASE_ALPHA mẫu), độ trễ hiện tại dùng 0.2
+    LATENCY_MIN_LIMIT = 0.25  # giảm vì độ trễ không đưa số luồng xuống dưới tỉ lệ này của max_inflight (tối thiểu 2)
+    LATENCY_MIN_RATE = 2.0    # ... và req/s không xuống dưới mức này
+    def __init__(self, max_inflight: int = 8, max_rate: float = 0.0, cancel: threading.Event | None = None):
+        # max_rate = 0: không giới hạn req/s cho tới khi host bắt đầu trả 429/503
+        self.max_inflight = max(1, int(max_inflight)); self.max_rate = max_rate; self.cancel = cancel
+        self._cond = threading.Condition(); self._hosts = {}
+    def _state(self, host: str) -> dict:
+        st = self._hosts.get(host)
+        if st is None:
+            st = self._hosts[host] = {"limit": float(self.max_inflight), "inflight": 0, "rate": self.max_rate, "next": 0.0,
+                                      "blocked_until": 0.0, "lat": None, "base": None, "cut": 0.0, "throttled": 0,
+                                      "grown": 0.0, "recent": collections.deque(maxlen=self.WINDOW), "n": 0}
+        return st
+    def _try_acquire(self, st: dict) -> float:
+        if self.cancel is not None and self.cancel.is_set(): raise requests.RequestException("Đã hủy")
+        now = time.monotonic(); wait = max(st["blocked_until"], st["next"]) - now
+        if wait <= 0 and st["inflight"] < int(st["limit"]):
+            st["inflight"] += 1
+            if st["rate"]: st["next"] = max(now, st["next"]) + 1.0 / st["rate"]
+            return 0.0
+        return min(0.2, wait) if wait > 0 else 0.2
+    def acquire(self, host: str):
+        with self._cond:
+            st = self._state(host)
+            while True:
+                wait = self._try_acquire(st)
+                if not wait: return
+                self._cond.wait(wait)
+    def try_acquire(self, host: str) -> float:
+        """Bản không chặn cho engine asyncio: 0 nếu đã lấy được slot, ngược lại số giây nên chờ rồi thử lại."""
+        with self._cond: return self._try_acquire(self._state(host))
+    def release(self, host: str, status: int | None = None, latency: float | None = None, retry_after: float | None = None) -> bool:
+        """Trả slot; với 429/503 trả về True nếu cả host đã bị hạ tốc/chặn (chỉ cần acquire lại),
+        False nếu chỉ là 429/503 lẻ tẻ (người gọi tự chờ Retry-After rồi thử lại riêng request đó)."""
+        slowed = False
+        with self._cond:
+            st = self._state(host); st["inflight"] = max(0, st["inflight"] - 1); now = time.monotonic()
+            if status is not None: st["recent"].append(status in self.THROTTLE_STATUS)
+            if status in self.THROTTLE_STATUS:
+                st["throttled"] += 1; n = sum(st["recent"])
+                if n >= self.OVERLOAD_RATIO * max(len(st["recent"]), self.MIN_SAMPLE):  # vài 429 đầu cửa sổ chưa phải quá tải
+                    slowed = True
+                    if retry_after: st["blocked_until"] = max(st["blocked_until"], now + min(retry_after, self.MAX_RETRY_AFTER))
+                    if self._decrease(st, now, 0.5):
+                        st["recent"].clear()  # lần giảm tiếp theo phải dựa trên các phản hồi ở mức giới hạn mới
+            elif status is not None and status < 500:
+                if latency is not None:
+                    st["lat"] = latency if st["lat"] is None else 0.8 * st["lat"] + 0.2 * latency
+                    st["n"] += 1; st["base"] = latency if st["base"] is None else st["base"] + max(self.BASE_ALPHA, 1.0 / st["n"]) * (latency - st["base"])
+                slow = st["lat"] is not None and st["lat"] > max(1.0, 4 * st["base"])
+                # độ trễ cao mà không giảm được nữa (vừa giảm / đã ở mức sàn) thì vẫn hồi phục như phản hồi bình thường
+                if not (slow and self._decrease(st, now, 0.75, max(2.0, self.max_inflight * self.LATENCY_MIN_LIMIT), self.LATENCY_MIN_RATE)):
+                    if st["cut"] and now - st["cut"] >= self.RECOVER_AFTER:
+                        # lâu rồi không bị chặn: trở lại cấu hình ban đầu thay vì nhích dần
+                        st["limit"] = float(self.max_inflight); st["rate"] = self.max_rate; st["cut"] = 0.0
+                    else:
+                        st["limit"] = min(self.max_inflight, st["limit"] + 1.0 / st["limit"])
+                        if st["rate"] and now - st["grown"] >= 1.0:
+                            st["grown"] = now; st["rate"] *= self.RATE_GROWTH
+                            if self.max_rate: st["rate"] = min(self.max_rate, st["rate"])
+                            elif st["rate"] >= 50: st["rate"] = 0.0  # đã hồi phục hẳn -> bỏ giới hạn req/s
+            self._cond.notify_all()
+        return slowed
+    def throttle_wait(self, retry_after: float | None, attempt: int) -> float:
+        """Thời gian 1 request tự chờ sau 429/503 lẻ tẻ: Retry-After (tối đa MAX_RETRY_AFTER) hoặc 0.5, 1, 2... giây."""
+        return min(retry_after, self.MAX_RETRY_AFTER) if retry_after else min(self.MAX_RETRY_AFTER, 0.5 * 2 ** attempt)
+    def _decrease(self, st: dict, now: float, factor: float, min_limit: float = 1.0, min_rate: float = 0.2) -> bool:
+        """Giảm limit/rate theo `factor`, không dưới `min_limit`/`min_rate`. False nếu không giảm (vừa giảm < 1 giây
+        trước, hoặc đã ở mức sàn)."""
+        if now - st["cut"] < 1.0: return False  # cả loạt phản hồi của cùng một đợt quá tải chỉ tính là 1 lần giảm
+        # chưa giới hạn req/s thì ước lượng tốc độ hiện tại theo Little's law (đang chạy / độ trễ)
+        cur = st["rate"] or st["limit"] / max(0.05, st["lat"] or 1.0)
+        if st["limit"] <= min_limit and cur <= min_rate: return False
+        # sàn chỉ chặn việc giảm, không nâng mức đang thấp hơn sàn (vd. sau khi bị 429 giảm mạnh)
+        st["cut"] = st["grown"] = now
+        st["limit"] = max(min(min_limit, st["limit"]), st["limit"] * factor); st["rate"] = max(min(min_rate, cur), cur * factor)
+        return True
+    def snapshot(self) -> dict:
+        """Giới hạn hiện tại của từng host: {host: {limit, inflight, rate (None = không giới hạn), throttled}}."""
+        with self._cond:
+            return {h: {"limit": int(st["limit"]), "inflight": st["inflight"], "rate": round(st["rate"], 2) or None,
+                        "throttled": st["throttled"]} for h, st in self._hosts.items()}
+
+REFERER_POLICIES = ("origin", "page", "none")
+
+class HostProfiles:
+    """Hồ sơ request theo host, nạp từ file JSON:
+        {"default": {...}, "hosts": {"i.pximg.net": {...}, "*.cdn.example.com": {...}}}
+    Mỗi hồ sơ có thể có "headers" (dict), "cookies" (dict), "timeout" (giây) và "referer" cho ảnh của host đó:
+    "origin" (gốc của trang chứa ảnh), "page" (URL trang chứa ảnh), "none" (không gửi) hoặc 1 URL cố định.
+    "*.x.com" khớp x.com và mọi host con; hồ sơ cụ thể hơn ghi đè hồ sơ chung hơn, riêng headers/cookies được gộp."""
+    FIELDS = ("headers", "cookies", "timeout", "referer")
+    def __init__(self, hosts: dict | None = None, default: dict | None = None):
+        self.default = self._check("default", default or {})
+        self.hosts = {k.lower(): self._check(k, v) for k, v in (hosts or {}).items()}; self._memo = {}
+    @classmethod
+    def load(cls, path: str) -> "HostProfiles":
+        """Đọc file JSON; OSError nếu không đọc được, ValueError nếu sai định dạng."""
+        with open(path, "r", encoding="utf-8-sig") as f: data = json.load(f)
+        if not isinstance(data, dict): raise ValueError("File hồ sơ host phải là 1 object JSON")
+        if not isinstance(data.get("hosts", {}), dict): raise ValueError("'hosts' phải là object {host: hồ sơ}")
+        return cls(data.get("hosts"), data.get("default"))
+    @classmethod
+    def _check(cls, name: str, prof) -> dict:
+        if not isinstance(prof, dict): raise ValueError(f"Hồ sơ host '{name}' phải là object")
+        for k in ("headers", "cookies"):
+            # giá trị không phải chuỗi chỉ lỗi lúc gửi request (InvalidHeader): báo ngay khi nạp file
+            if not isinstance(prof.get(k, {}), dict) or not all(isinstance(v, str) for v in prof.get(k, {}).values()):
+                raise ValueError(f"Hồ sơ host '{name}': '{k}' phải là object {{tên: chuỗi}}")
+        if "timeout" in prof and not (isinstance(prof["timeout"], (int, float)) and prof["timeout"] > 0):
+            raise ValueError(f"Hồ sơ host '{name}': 'timeout' phải là số giây > 0")
+        ref = prof.get("referer", "origin")
+        if not isinstance(ref, str) or (ref not in REFERER_POLICIES and not ref.startswith(("http://", "https://"))):
+            raise ValueError(f"Hồ sơ host '{name}': 'referer' phải là {', '.join(REFERER_POLICIES)} hoặc 1 URL")
+        unknown = set(prof) - set(cls.FIELDS)
+        if unknown: raise ValueError(f"Hồ sơ host '{name}': không rõ trường {', '.join(sorted(unknown))}")
+        return prof
+    def __bool__(self): return bool(self.default or self.hosts)
+    def for_host(self, netloc: str) -> dict:
+        """Hồ sơ đã gộp cho host (bỏ port); {} nếu không có hồ sơ nào khớp."""
+        host = netloc.lower().rpartition("@")[2].split(":")[0]
+        prof = self._memo.get(host)
+        if prof is None:
+            labels = host.split("."); matches = [self.default]
+            # từ chung tới riêng: *.com, *.example.com, ..., rồi đúng tên host
+            matches += [self.hosts[k] for k in ("*." + ".".join(labels[i:]) for i in range(len(labels) - 1, -1, -1)) if k in self.hosts]
+            if host in self.hosts: matches.append(self.hosts[host])
+            prof = {}
+            for m in matches:
+                for k, v in m.items(): prof[k] = {**prof.get(k, {}), **v} if k in ("headers", "cookies") else v
+            self._memo[host] = prof
+        return prof
+    def request_kw(self, netloc: str, kw: dict) -> dict:
+        """kw cho requests.Session.request đã áp hồ sơ: header/cookie của hồ sơ làm mặc định (header truyền vào thắng),
+        timeout của hồ sơ thay timeout mặc định."""
+        prof = self.for_host(netloc)
+        if not prof: return kw
+        kw = dict(kw)
+        if prof.get("headers"): kw["headers"] = {**prof["headers"], **(kw.get("headers") or {})}
+        if prof.get("cookies"): kw["cookies"] = {**prof["cookies"], **(kw.get("cookies") or {})}
+        if "timeout" in prof: kw["timeout"] = prof["timeout"]
+        return kw
+
+class SessionPool:
+    """Session dùng chung giữa các luồng tải: mỗi host giữ tối đa `max_workers` kết nối keep-alive,
+    host không dùng quá `idle_timeout` giây sẽ bị đóng kết nối. Có `get`/`head` như requests.Session.
+    Mọi request đi qua `limiter` (HostLimiter); 429/503 được thử lại tối đa `throttle_retries` lần (sau khi host hạ giới hạn,
+    hoặc sau khi riêng request đó chờ Retry-After nếu chỉ là 429/503 lẻ tẻ); 500/502/504 do urllib3 thử lại (RETRY_*).
+    `cancel` được đặt thì không mở request mới nữa; `abort()` ngắt cả các request đang chờ phản hồi / đang đọc body.
+    `metrics`: đếm phản hồi theo host/mã HTTP, lượt thử lại, lỗi kết nối và bấm giờ mở kết nối / chờ header.
+    `profiles`: HostProfiles — header, cookie, timeout riêng theo host áp cho mọi request (trang, HEAD, ảnh)."""
+    def __init__(self, max_workers: int = 8, idle_timeout: float = 30.0, max_hosts: int = 64,
+                 cancel: threading.Event | None = None, throttle_retries: int = 3, metrics: Metrics | None = None,
+                 profiles: HostProfiles | None = None):
+        self.max_workers = max(1, int(max_workers)); self.idle_timeout = idle_timeout; self.throttle_retries = throttle_retries
+        self.metrics = metrics; self.profiles = profiles
+        self._lock = Lock(); self._counts = {"requests": 0, "new": 0}; self._last_used = {}; self._last_reap = time.monotonic()
+        self.limiter = HostLimiter(self.max_workers, cancel=cancel); self._conns = weakref.WeakSet()
+        # +2 cho luồng chính (tải trang / HEAD) chạy song song với các luồng tải ảnh.
+        # 429/503 do limiter xử lý (giảm tốc theo host) thay vì để urllib3 ngủ rồi thử lại mù quáng.
+        on_retry = (lambda: metrics.count("retries", kind="urllib3")) if metrics else None
+        self.session = build_session(lambda r: _PooledAdapter(
+            self._bump, self._track, cancel, metrics,
+            max_retries=_CancellableRetry(total=r.total, backoff_factor=r.backoff_factor, allowed_methods=r.allowed_methods,
+                                          status_forcelist=list(RETRY_STATUS), respect_retry_after_header=False, cancel=cancel,
+                                          on_retry=on_retry),
+            pool_connections=max_hosts, pool_maxsize=self.max_workers + 2))
+    def _bump(self, key: str):
+        with self._lock: self._counts[key] += 1
+    def _track(self, conn):
+        with self._lock: self._conns.add(conn)
+    def abort(self) -> int:
+        """Ngắt ngay mọi kết nối đang mở: luồng đang chờ header hay đang đọc body (có thể treo tới hết timeout 20 s)
+        nhận lỗi kết nối và thoát luôn. Gọi sau khi đã đặt `cancel`; trả về số socket đã ngắt."""
+        with self._lock: conns = list(self._conns)
+        n = 0
+        for conn in conns:
+            sock = getattr(conn, "sock", None)
+            if sock is None: continue
+            # socket.shutdown gốc (không qua SSLSocket.shutdown) để không đụng trạng thái TLS mà luồng khác đang đọc
+            try: socket.socket.shutdown(sock, socket.SHUT_RDWR); n += 1
+            except OSError: pass
+        return n
+    def request(self, method: str, url: str, **kw):
+        p = urlparse(url); now = time.monotonic()
+        with self._lock:
+            self._last_used[(p.scheme, (p.hostname or "").lower(), p.port or (443 if p.scheme == "https" else 80))] = now
+            reap = now - self._last_reap >= self.idle_timeout
+            if reap: self._last_reap = now
+        if reap: self.reap_idle()
+        host = p.netloc.lower(); m = self.metrics
+        if self.profiles: kw = self.profiles.request_kw(host, kw)
+        for attempt in range(self.throttle_retries + 1):
+            t = time.perf_counter(); self.limiter.acquire(host)
+            if m: m.observe("host_wait", time.perf_counter() - t, host)
+            try: r = self.session.request(method, url, **kw)
+            except BaseException as e:
+                self.limiter.release(host)
+                if m: m.count("request_errors", host=host, error=type(e).__name__)
+                raise
+            latency = r.elapsed.total_seconds()
+            if m: m.count("responses", host=host, status=r.status_code, method=method); m.observe("headers", latency, host)
+            if r.status_code in HostLimiter.THROTTLE_STATUS and attempt < self.throttle_retries:
+                if m: m.count("retries", kind="throttle", host=host)
+                retry_after = retry_after_seconds(r.headers.get("Retry-After")); r.close()
+                if not self.limiter.release(host, r.status_code, latency, retry_after):
+                    wait = self.limiter.throttle_wait(retry_after, attempt); cancel = self.limiter.cancel
+                    if cancel is None: time.sleep(wait)
+                    elif cancel.wait(wait): raise requests.RequestException("Đã hủy")
+                continue
+            if not kw.get("stream"):
+                self.limiter.release(host, r.status_code, latency); return r
+            # stream=True: host vẫn bận cho tới khi body được đọc xong và response đóng lại
+            r.close = self._release_on_close(r, host, latency)
+            return r
+    def _release_on_close(self, r, host: str, latency: float):
+        orig_close = r.close; released = []
+        def close():
+            try: orig_close()
+            finally:
+                if not released: released.append(True); self.limiter.release(host, r.status_code, latency)
+        return close
+    def get(self, url: str, **kw): return self.request("GET", url, **kw)
+    def head(self, url: str, **kw): return self.request("HEAD", url, **kw)
+    def reap_idle(self) -> int:
+        """Đóng pool của các host rảnh quá `idle_timeout` giây; trả về số pool đã đóng."""
+        now = time.monotonic(); closed = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                with self._lock: last = self._last_used.get((key.key_scheme, key.key_host, key.key_port), 0.0)
+                if now - last >= self.idle_timeout:
+                    try: del pools[key]; closed += 1  # dispose_func -> pool.close()
+                    except KeyError: pass
+        return closed
+    def stats(self) -> dict:
+        with self._lock: c = dict(self._counts)
+        c["reused"] = max(0, c["requests"] - c["new"]); return c
+    def close(self): self.session.close()
+
+# ====== HTTP cache (trang HTML, manifest) ======
+
+def default_cache_dir() -> str:
+    """Thư mục cache dùng chung mọi lần chạy: %LOCALAPPDATA% (Windows) hoặc $XDG_CACHE_HOME / ~/.cache."""
+    base = os.environ.get("LOCALAPPDATA") if os.name == "nt" else os.environ.get("XDG_CACHE_HOME")
+    return os.path.join(base or os.path.join(os.path.expanduser("~"), ".cache"), "tai_anh_sieu_toc", "http")
+
+class CacheMiss(requests.RequestException):
+    """Chế độ phát lại từ cache nhưng URL chưa từng được cache."""
+
+class HttpCache:
+    """Cache HTTP trên đĩa cho các GET nhỏ (trang HTML, manifest): body lưu thành file, chỉ mục SQLite giữ
+    ETag/Last-Modified/header + thời điểm dùng gần nhất. Mỗi lần lấy lại gửi conditional GET, 304 thì dùng bản
+    trong cache; vượt `max_bytes` thì xóa mục lâu không dùng nhất (LRU). `offline=True`: chỉ đọc cache, không hỏi server."""
+    FILENAME = "index.sqlite3"
+    KEEP_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+    def __init__(self, cache_dir: str | None = None, max_bytes: int = 256 * 1024 * 1024, offline: bool = False):
+        self.dir = cache_dir or default_cache_dir(); self.max_bytes = max_bytes; self.offline = offline
+        os.makedirs(self.dir, exist_ok=True); self.lock = Lock()
+        self.counts = {"network": 0, "revalidated": 0, "offline": 0}
+        self.db = sqlite3.connect(os.path.join(self.dir, self.FILENAME), check_same_thread=False, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries(url TEXT PRIMARY KEY, headers TEXT, size INTEGER, atime REAL)")
+        self.db.commit()
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    def _body_path(self, url: str) -> str:
+        return os.path.join(self.dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".body")
+    def _load(self, url: str) -> tuple[dict, bytes] | None:
+        with self.lock: row = self.db.execute("SELECT headers, size FROM entries WHERE url=?", (url,)).fetchone()
+        if not row: return None
+        try:
+            with open(self._body_path(url), "rb") as f: meta, body = json.loads(row[0]), f.read()
+            if len(body) != row[1]: raise ValueError("body cache bị cắt cụt")
+            return meta, body
+        except (OSError, ValueError):
+            self._forget(url); return None  # body mất/hỏng: bỏ mục, tải lại đầy đủ (không gửi validator)
+    def _forget(self, url: str):
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE url=?", (url,)).fetchone()
+            if row: self.db.execute("DELETE FROM entries WHERE url=?", (url,)); self.db.commit(); self.total -= row[0]
+        try: os.remove(self._body_path(url))
+        except OSError: pass
+    def _store(self, url: str, headers: dict, body: bytes):
+        if len(body) > self.max_bytes // 4: return  # file quá lớn so với cache: không giữ
+        path = self._body_path(url); tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp, "wb") as f: f.write(body)
+            os.replace(tmp, path)
+        except OSError:
+            try: os.remove(tmp)
+            except OSError: pass
+            return
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE url=?", (url,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?,?,?,?)", (url, json.dumps(headers), len(body), time.time()))
+            self.db.commit(); self.total += len(body) - (row[0] if row else 0)
+        if self.total > self.max_bytes: self.evict()
+    def _touch(self, url: str, headers: dict | None = None):
+        with self.lock:
+            if headers is None: self.db.execute("UPDATE entries SET atime=? WHERE url=?", (time.time(), url))
+            else: self.db.execute("UPDATE entries SET atime=?, headers=? WHERE url=?", (time.time(), json.dumps(headers), url))
+            self.db.commit()
+    def evict(self, target: int | None = None):
+        """Xóa các mục dùng lâu nhất tới khi tổng dung lượng <= target (mặc định 90% max_bytes)."""
+        target = int(self.max_bytes * 0.9) if target is None else target
+        with self.lock: rows = self.db.execute("SELECT url, size FROM entries ORDER BY atime").fetchall()
+        for url, size in rows:
+            if self.total <= target: break
+            self._forget(url)
+    def _response(self, url: str, headers: dict, body: bytes, status: int = 200) -> requests.Response:
+        r = requests.Response(); r.status_code = status; r.url = url; r._content = body
+        r.headers = requests.structures.CaseInsensitiveDict(headers)
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers); return r
+    def get(self, session, url: str, **kw) -> requests.Response:
+        """Như session.get(url) nhưng qua cache; `response.from_cache` cho biết có dùng bản trong cache không."""
+        cached = self._load(url)
+        if self.offline:
+            if cached is None: raise CacheMiss(f"Chưa có trong cache: {url}")
+            with self.lock: self.counts["offline"] += 1
+            self._touch(url); r = self._response(url, *cached); r.from_cache = True; return r
+        headers = dict(kw.pop("headers", None) or {})
+        if cached:
+            if cached[0].get("ETag"): headers["If-None-Match"] = cached[0]["ETag"]
+            if cached[0].get("Last-Modified"): headers["If-Modified-Since"] = cached[0]["Last-Modified"]
+        r = session.get(url, headers=headers, **kw)
+        if r.status_code == 304 and cached:
+            # 304 có thể mang ETag/Last-Modified mới -> cập nhật để lần sau gửi đúng validator
+            meta = {**cached[0], **{k: r.headers[k] for k in self.KEEP_HEADERS if r.headers.get(k)}}
+            with self.lock: self.counts["revalidated"] += 1
+            self._touch(url, meta); r.close(); r = self._response(url, meta, cached[1]); r.from_cache = True; return r
+        with self.lock: self.counts["network"] += 1
+        r.from_cache = False
+        if r.status_code == 200 and "no-store" not in r.headers.get("Cache-Control", "").lower():
+            self._store(url, {k: r.headers[k] for k in self.KEEP_HEADERS if r.headers.get(k)}, r.content)
+        return r
+    def close(self):
+        with self.lock: self.db.commit(); self.db.close()
+
+# ====== Utils ======
+
+def sanitize_filename(name: str) -> str:
+    name = name.split("?")[0].split("#")[0]
+    name = INVALID_RE.sub("_", name).strip(". ")
+    return name or "image"
+
+class NameAllocator:
+    """Cấp tên file không trùng mà không dò name_1, name_2… từ đầu mỗi lần: giữ bộ đếm trong bộ nhớ cho từng
+    (thư mục, tên, đuôi), giữ chỗ bằng exclusive-create (O_EXCL) nên nhiều luồng/tiến trình không ghi đè nhau.
+    Gặp tên đã có sẵn trên đĩa (lần chạy trước) thì tìm số trống bằng nhảy mũ 2 + chia đôi: O(log N) syscall, 1 lần mỗi tên."""
+    def __init__(self):
+        self._lock = Lock(); self._next = {}; self._dirs = set()
+    @staticmethod
+    def _first_free(d: str, root: str, ext: str, lo: int) -> int:
+        exists = lambda n: os.path.exists(os.path.join(d, f"{root}_{n}{ext}"))
+        if not exists(lo): return lo
+        step = 1
+        while exists(lo + step): step *= 2
+        a, b = lo + step // 2, lo + step  # a đã có, b còn trống
+        while b - a > 1:
+            mid = (a + b) // 2
+            if exists(mid): a = mid
+            else: b = mid
+        return b
+    def claim(self, tmp: str, path: str) -> str:
+        """Đổi tên file tạm `tmp` thành `path` (hoặc path_N nếu đã có); trả về đường dẫn cuối cùng."""
+        d, name = os.path.split(path); root, ext = os.path.splitext(name)
+        key = (os.path.normcase(d), root.lower(), ext.lower())  # Windows/macOS không phân biệt hoa thường
+        with self._lock:
+            n = self._next.get(key, 0); self._next[key] = n + 1; new_dir = d not in self._dirs; self._dirs.add(d)
+        if new_dir: os.makedirs(d, exist_ok=True)
+        while True:
+            cand = path if n == 0 else os.path.join(d, f"{root}_{n}{ext}")
+            try: os.close(os.open(cand, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            except FileExistsError:
+                free = self._first_free(d, root, ext, n + 1)
+                with self._lock: n = max(free, self._next.get(key, 0)); self._next[key] = n + 1
+                continue
+            try: os.replace(tmp, cand)
+            except OSError:
+                try: os.remove(cand)
+                except OSError: pass
+                raise
+            return cand
+
+_names = NameAllocator()
+
+LAYOUTS = ("flat", "host", "page", "hash")
+
+def page_dir_name(page_url: str) -> str:
+    """Tên thư mục con cho 1 trang: host + đường dẫn, cắt ngắn kèm hash để không trùng giữa các trang."""
+    p = urlparse(page_url); slug = sanitize_filename(f"{p.netloc}{p.path}".strip("/").replace("/", "_")) or "page"
+    return slug if len(slug) <= 60 else f"{slug[:50]}_{hashlib.sha1(page_url.encode('utf-8')).hexdigest()[:8]}"
+
+class OutputLayout:
+    """Cách xếp file trong out_dir: "flat" (tất cả 1 thư mục), "host" (out_dir/<host>/), "page" (out_dir/<trang>/),
+    "hash" (out_dir/ab/cd/ theo SHA-1 nội dung — mỗi thư mục chỉ vài chục file kể cả khi có hàng triệu ảnh)."""
+    def __init__(self, out_dir: str, mode: str = "flat", names: NameAllocator | None = None):
+        if mode not in LAYOUTS: raise ValueError(f"Cách xếp thư mục không hợp lệ: {mode}")
+        self.out_dir = out_dir; self.mode = mode; self.names = names or NameAllocator()
+    def subdir(self, digest: str, img_url: str = "", page_url: str = "") -> str:
+        if self.mode == "host":
+            host = urlparse(img_url).netloc  # data: URL không có host -> thư mục "data" (sanitize_filename("") ra "image")
+            return sanitize_filename(host) if host else "data"
+        if self.mode == "page": return page_dir_name(page_url) if page_url else "khac"
+        if self.mode == "hash": return os.path.join(digest[:2], digest[2:4])
+        return ""
+    def placer(self, img_url: str = "", page_url: str = ""):
+        """Hàm place(tmp, filename, sha1) -> đường dẫn đã lưu, truyền cho StreamSaver của 1 ảnh."""
+        def place(tmp: str, filename: str, digest: str) -> str:
+            return self.names.claim(tmp, os.path.join(self.out_dir, self.subdir(digest, img_url, page_url), filename))
+        return place
+
+def is_image_content_type(ct: str) -> bool:
+    return ct and ct.split(";")[0].strip().startswith("image/")
+
+IMAGE_MAGIC = ((b"\xff\xd8\xff", ".jpg"), (b"\x89PNG\r\n\x1a\n", ".png"), (b"GIF87a", ".gif"), (b"GIF89a", ".gif"),
+               (b"BM", ".bmp"), (b"II*\x00", ".tif"), (b"MM\x00*", ".tif"))
+NOT_IMAGE_PREFIXES = (b"<!doctype html", b"<html", b"<head", b"<body", b"<!--", b"{", b"[")
+
+def sniff_image_type(head: bytes) -> str | None:
+    """Đuôi file theo magic bytes của phần đầu nội dung; "" nếu không nhận ra, None nếu rõ ràng là HTML/JSON (trang lỗi)."""
+    for magic, ext in IMAGE_MAGIC:
+        if head.startswith(magic): return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP": return ".webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis"): return ".avif"
+    text = head[:512].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith(b"<svg") or (text.startswith(b"<?xml") and b"<svg" in text): return ".svg"
+    if text.startswith(NOT_IMAGE_PREFIXES) or b"<html" in text: return None
+    return ""
+
+def choose_extension(filename: str, content_type: str) -> str:
+    _, ext = os.path.splitext(filename); ext = ext.lower()
+    guessed = MIME_TO_EXT.get((content_type or "").split(";")[0].strip(), "")
+    if not ext: return guessed or ".bin"
+    if guessed and ext != guessed: return guessed
+    return ext
+
+# ====== data: URL ======
+
+def decode_data_url(data_url: str):
+    m = DATA_URL_RE.match(data_url)
+    if not m: return None, None
+    mime = (m.group(1) or "").lower().strip(); params = (m.group(2) or "").lower(); data_part = m.group(3) or ""
+    is_base64 = ";base64" in params
+    if is_base64: raw = base64.b64decode(data_part, validate=True)
+    else: raw = unquote(data_part).encode("utf-8")
+    ext = MIME_TO_EXT.get(mime, ".bin")
+    return raw, ext
+
+# ====== Size helpers ======
+
+def extract_named_size(url_path: str):
+    fname = os.path.basename(url_path); m = SIZE_SUFFIX_RE.search(fname)
+    if m: return int(m.group(1)), int(m.group(2))
+    m2 = PIN_DIR_RE.search(url_path)
+    if m2: n = int(m2.group(1)); return n, n
+    return None
+
+def extract_query_size(full_url: str):
+    try: q = parse_qs(urlparse(full_url).query)
+    except Exception: return None
+    def first_int(key):
+        if key in q and q[key]:
+            try: return int(str(q[key][0]).split(",")[0].split("x")[0])
+            except: return None
+        return None
+    def pair_from(key):
+        if key in q and q[key]:
+            raw = str(q[key][0]).replace("%2C", ",").lower()
+            m = re.search(r"(\d{2,5})[x,](\d{2,5})", raw)
+            if m: return int(m.group(1)), int(m.group(2))
+        return None
+    for k in ("fit","resize","size","dim","dimensions"):
+        p = pair_from(k)
+        if p: return p
+    w = None
+    for k in ("w","width","maxwidth","maxw"):
+        w = first_int(k)
+        if w: break
+    h = None
+    for k in ("h","height","maxheight","maxh"):
+        h = first_int(k)
+    if w and h: return w, h
+    if w: return w, w
+    if h: return h, h
+    return None
+
+def canonical_basename(url_path: str):
+    path = PIN_DIR_RE.sub("/originals/", url_path)
+    fname = os.path.basename(path)
+    base = SIZE_SUFFIX_RE.sub("", fname)
+    return base.lower()
+
+def prefer_original_path(url_path: str):
+    return PIN_DIR_RE.sub("/originals/", url_path)
+
+def head_content_length(session, url):
+    try:
+        r = session.head(url, timeout=10, allow_redirects=True)
+        cl = r.headers.get("Content-Length"); return int(cl) if cl and cl.isdigit() else -1
+    except Exception: return -1
+
+def image_dimensions(head: bytes):
+    """Đọc (rộng, cao) từ phần đầu file JPEG/PNG/GIF/WebP; None nếu không nhận ra hoặc thiếu byte."""
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and len(head) >= 24:
+        return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+        return int.from_bytes(head[6:8], "little"), int.from_bytes(head[8:10], "little")
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP" and len(head) >= 30:
+        fourcc = head[12:16]
+        if fourcc == b"VP8 ": return int.from_bytes(head[26:28], "little") & 0x3FFF, int.from_bytes(head[28:30], "little") & 0x3FFF
+        if fourcc == b"VP8L":
+            b = int.from_bytes(head[21:25], "little"); return (b & 0x3FFF) + 1, ((b >> 14) & 0x3FFF) + 1
+        if fourcc == b"VP8X": return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+        return None
+    if head[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(head):
+            if head[i] != 0xFF: i += 1; continue
+            marker = head[i + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF: i += 1 if marker == 0xFF else 2; continue
+            seg_len = int.from_bytes(head[i + 2:i + 4], "big")
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                return int.from_bytes(head[i + 7:i + 9], "big"), int.from_bytes(head[i + 5:i + 7], "big")
+            i += 2 + seg_len
+    return None
+
+class ImageLimits:
+    """Giới hạn tùy chọn cho ảnh (0 = không giới hạn): dung lượng tối đa và chiều rộng/cao nhỏ nhất, lớn nhất (pixel)."""
+    def __init__(self, max_bytes: int = 0, min_width: int = 0, min_height: int = 0, max_width: int = 0, max_height: int = 0):
+        self.max_bytes = max_bytes; self.min_width = min_width; self.min_height = min_height
+        self.max_width = max_width; self.max_height = max_height
+    @property
+    def wants_dims(self) -> bool: return bool(self.min_width or self.min_height or self.max_width or self.max_height)
+    def check_size(self, size: int, filename: str) -> str | None:
+        if self.max_bytes and size > self.max_bytes: return f"Bỏ qua (lớn hơn {self.max_bytes}B): {filename}"
+        return None
+    def check_dims(self, dims: tuple[int, int] | None, filename: str) -> str | None:
+        if not dims or not self.wants_dims: return None
+        w, h = dims
+        if w < self.min_width or h < self.min_height or (self.max_width and w > self.max_width) or (self.max_height and h > self.max_height):
+            return f"Bỏ qua (kích thước ngoài giới hạn): {filename} ({w}x{h})"
+        return None
+
+class VariantHints:
+    """Gợi ý kích thước URL -> (rộng, cao) lấy từ srcset / <picture> lúc parse trang; cao = 0 nếu trang không cho biết.
+    Mỗi job giữ 1 store riêng (không còn dict toàn cục dùng chung giữa các lần chạy), khóa khi đọc/ghi vì nhiều luồng
+    parse cùng lúc, và chỉ giữ `max_entries` URL mới nhất để GUI mở lâu / danh sách trang dài không làm phình bộ nhớ."""
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max(1, int(max_entries)); self._d = {}; self._lock = Lock()
+    def update(self, hints: dict):
+        with self._lock:
+            for u, wh in hints.items():
+                self._d.pop(u, None); self._d[u] = wh
+            while len(self._d) > self.max_entries: self._d.pop(next(iter(self._d)))
+    def get(self, url: str) -> tuple[int, int] | None:
+        with self._lock: return self._d.get(url)
+    def __len__(self):
+        with self._lock: return len(self._d)
+
+class SizeProber:
+    """Dò kích thước các biến thể song song (tối đa `max_workers` request) và nhớ kết quả URL -> (pixel, byte) trong 1 lần chạy.
+    `pixels=True`: GET Range vài chục KB đầu để đọc kích thước thật từ header ảnh thay vì chỉ HEAD lấy Content-Length."""
+    HEAD_BYTES = 64 * 1024
+    def __init__(self, session, max_workers: int = 8, pixels: bool = False):
+        self.session = session; self.pixels = pixels; self.max_workers = max(1, int(max_workers))
+        self._memo = {}; self._lock = Lock(); self._ex = None
+    def _probe(self, url: str):
+        if not self.pixels: return 0, head_content_length(self.session, url)
+        try:
+            with self.session.get(url, stream=True, timeout=10, allow_redirects=True,
+                                  headers={"Range": f"bytes=0-{self.HEAD_BYTES - 1}"}) as r:
+                if r.status_code >= 400: return 0, -1
+                head = bytearray()
+                for chunk in r.iter_content(16384):
+                    head.extend(chunk)
+                    if len(head) >= self.HEAD_BYTES: break
+                total = r.headers.get("Content-Range", "").rpartition("/")[2] if r.status_code == 206 else r.headers.get("Content-Length", "")
+        except Exception: return 0, -1
+        dims = image_dimensions(bytes(head))
+        return (dims[0] * dims[1] if dims else 0), (int(total) if total.isdigit() else -1)
+    def probe_many(self, urls) -> dict:
+        with self._lock: todo = [u for u in dict.fromkeys(urls) if u not in self._memo]
+        if todo:
+            if self._ex is None: self._ex = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="probe")
+            for u, res in zip(todo, self._ex.map(self._probe, todo)):
+                with self._lock: self._memo[u] = res
+        with self._lock: return {u: self._memo[u] for u in urls}
+    def known(self, url: str) -> tuple[int, int] | None:
+        """(pixel, byte) đã dò được khi gom biến thể, để lọc trước khi tải; None nếu chưa dò URL này."""
+        with self._lock: return self._memo.get(url)
+    def close(self):
+        if self._ex: self._ex.shutdown(wait=False, cancel_futures=True); self._ex = None
+
+def _is_unsuffixed_original(c) -> bool:
+    # /anh.jpg (không hậu tố -WxH, không tham số cỡ) đi cùng /anh-300x200.jpg: bản gốc mà các biến thể được cắt ra từ đó
+    return not c[2] and bool(c[1]) and not SIZE_SUFFIX_RE.search(os.path.basename(c[1])) and not urlparse(c[0]).query
+
+def _variant_candidate(u: str, hints: VariantHints | None = None) -> tuple[str, str, tuple | None]:
+    """(URL đã đổi sang bản gốc nếu đoán được, path của nó, kích thước biết được từ tên/tham số/srcset hoặc None)."""
+    parsed = urlparse(u)
+    rew_path = prefer_original_path(parsed.path)
+    rew_url = parsed._replace(path=rew_path).geturl() if rew_path != parsed.path else u
+    size = (extract_named_size(rew_path) or extract_query_size(rew_url) or (hints.get(rew_url) if hints is not None else None))
+    return rew_url, rew_path, size
+
+def pick_largest_variants(session, urls: list[str], prober: SizeProber | None = None, hints: VariantHints | None = None) -> list[str]:
+    buckets = {}
+    for u in urls:
+        if u.startswith("data:"):
+            key = f"DATA::{hash(u)}"; buckets.setdefault(key, []).append((u, None, None)); continue
+        cand = _variant_candidate(u, hints)
+        buckets.setdefault(canonical_basename(cand[1]), []).append(cand)
+    picked = {}; unsized = {}
+    for key, cands in buckets.items():
+        origs = [c for c in cands if "/originals/" in (c[1] or "")]
+        pool = origs if origs else cands
+        with_sizes = [c for c in pool if c[2]]
+        if with_sizes:
+            plain = [c for c in pool if _is_unsuffixed_original(c)]
+            if plain and all(extract_named_size(c[1]) for c in with_sizes): picked[key] = plain[0][0]; continue
+            # cùng 1 ảnh nên so theo chiều rộng (luôn có), chiều cao chỉ để phân định khi rộng bằng nhau
+            best = max(with_sizes, key=lambda c: c[2]); picked[key] = best[0]; continue
+        if len(pool) == 1: picked[key] = pool[0][0]; continue
+        unsized[key] = pool; picked[key] = None
+    if unsized:
+        # Gom mọi ứng viên chưa rõ kích thước rồi dò một lượt song song thay vì HEAD tuần tự từng cái
+        own = prober is None; prober = prober or SizeProber(session)
+        try: sizes = prober.probe_many([c[0] for pool in unsized.values() for c in pool])
+        finally:
+            if own: prober.close()
+        for key, pool in unsized.items():
+            picked[key] = max(pool, key=lambda c: sizes.get(c[0], (0, -1)))[0]  # hòa nhau -> giữ ứng viên đầu
+    return list(picked.values())
+
+class JobVariants:
+    """Biến thể đã đưa vào hàng đợi trong cả job, để trang sau không tải lại bản nhỏ hơn của ảnh đã lấy ở trang trước
+    (pick_largest_variants chỉ so trong 1 trang). Khóa chặt hơn pick_largest_variants: cùng host + thư mục + tên gốc
+    (bỏ hậu tố -WxH), vì tên kiểu 01.jpg lặp lại giữa các album. Chỉ so được theo thông tin có sẵn (thư mục /originals/,
+    bản không hậu tố, kích thước trong tên/tham số/srcset), không dò thêm; không rõ bên nào lớn hơn thì tải cả 2.
+    Bản lớn hơn xuất hiện ở trang sau vẫn được tải (bản nhỏ đã tải/đang chờ thì giữ), số lần như vậy nằm ở `upgraded`."""
+    def __init__(self, hints: VariantHints | None = None):
+        self.hints = hints; self._best = {}; self.suppressed = 0; self.upgraded = 0
+    def _rank(self, u: str) -> tuple[str, tuple] | None:
+        if u.startswith("data:"): return None
+        rew_url, rew_path, size = _variant_candidate(u, self.hints)
+        key = f"{urlparse(rew_url).netloc}{rew_path.rpartition('/')[0]}/{canonical_basename(rew_path)}".lower()
+        plain = _is_unsuffixed_original((rew_url, rew_path, size))
+        return key, ("/originals/" in rew_path, plain, size[0] if size else 0)
+    def remember(self, u: str):
+        """URL đã có từ trước (vd. nhật ký job khi tải tiếp): ghi nhận, không lọc."""
+        kr = self._rank(u)
+        if kr and (kr[0] not in self._best or kr[1] > self._best[kr[0]]): self._best[kr[0]] = kr[1]
+    def admit(self, u: str) -> bool:
+        """True nếu nên tải `u`; False nếu job đã có bản cùng ảnh lớn hơn hoặc bằng."""
+        kr = self._rank(u)
+        if kr is None: return True
+        key, rank = kr; old = self._best.get(key)
+        if old is None: self._best[key] = rank; return True
+        # cùng hạng: chỉ coi là trùng khi đều biết kích thước hoặc đều là bản gốc không hậu tố
+        if rank < old or (rank == old and (rank[2] or rank[1])): self.suppressed += 1; return False
+        if rank > old: self._best[key] = rank; self.upgraded += 1
+        return True
+
+# ====== HTML extraction ======
+
+STYLE_URL_RE = re.compile(r"url\((['\"]?)(.+?)\1\)")
+IMG_HREF_RE = re.compile(r"\.(png|jpe?g|gif|webp|avif|svg|bmp|tiff?)(\?|#|$)", re.I)
+IMG_URL_ATTRS = ("src", "data-src", "data-original", "data-lazy", "data-lazy-src")
+# lazy-load (lazysizes, WP Rocket...): srcset thật nằm ở data-*, srcset chính chỉ là ảnh giữ chỗ
+SRCSET_ATTRS = ("srcset", "data-srcset", "data-lazy-srcset")
+# Trang lớn hơn ngưỡng này được parse ở tiến trình riêng để không giữ GIL của các luồng tải
+PROCESS_PARSE_MIN_CHARS = 2_000_000
+# Crawl: số trang trong URL (?page=2, /page/2/, /trang/3, -p4.html...) và chữ trên nút sang trang sau.
+# Không nhận ?p=N: WordPress dùng nó làm permalink bài viết (?p=123), coi là số trang thì crawl theo mọi bài.
+PAGE_NUM_RE = re.compile(r"(?:(?<=[?&])(?:page|paged|pg|trang)=\d+&?|/(?:page|trang|p)/\d+(?=/|$)|[-_](?:page|p)[-_]?\d+(?=\.html?$|/|$))", re.I)
+NEXT_TEXTS = {"next", "next page", "next »", "»", "›", ">", "tiếp", "tiếp »", "trang sau", "trang tiếp", "sau", "older posts"}
+FEED_TYPES = {"application/rss+xml", "application/atom+xml"}
+
+def _html_dim(v) -> int:
+    # width="300" / "300px"; "50%" hay giá trị lạ -> 0 (không dùng được để quy đổi mật độ x)
+    m = re.fullmatch(r"\s*(\d+)(?:px)?\s*", v or ""); return int(m.group(1)) if m else 0
+
+class _ImageSourceParser(HTMLParser):
+    """Một lượt duy nhất qua HTML, không dựng cây DOM: gom URL ảnh từ <img src/data-*/srcset>, <picture><source srcset>,
+    thuộc tính style="url(...)" và <a href> trỏ tới file ảnh, URL tương đối tính theo <base href> nếu trang có;
+    gợi ý kích thước (rộng, cao) ghi vào `hints`:
+    mô tả `w` là chiều rộng thật; mô tả `x` quy đổi theo width/height của thẻ (bỏ qua nếu thẻ không khai báo).
+    `links=True` (chế độ crawl): gom luôn link sang trang khác trong cùng lượt vào `links` {url: "next" | "page" | "feed"}.
+    """
+    def __init__(self, base_url: str, links: bool = False):
+        super().__init__(convert_charrefs=True); self.base_url = base_url; self.urls = {}; self.hints = {}
+        self._pending = None  # trong <picture>: [(url, mật độ x)] chờ width/height của <img> bên trong
+        self.links = {} if links else None; self._anchor = None; self._text = []; self._based = False
+    def _add(self, u: str):
+        self.urls[u if u.startswith("data:") else urljoin(self.base_url, u)] = None
+    def handle_starttag(self, tag, attrs):
+        a = dict(attrs)
+        if tag == "img":
+            for key in IMG_URL_ATTRS:
+                if a.get(key): self._add(a[key])
+            w, h = _html_dim(a.get("width")), _html_dim(a.get("height"))
+            real = next((a[k] for k in IMG_URL_ATTRS[1:] if a.get(k)), a.get("src"))  # ảnh lazy: src chỉ là ảnh giữ chỗ
+            for key in SRCSET_ATTRS:
+                if a.get(key): self._srcset(a[key], w, h, fallback=real)
+            if self._pending is not None:
+                if w:
+                    for full, mul in self._pending: self.hints.setdefault(full, (round(w * mul), round(h * mul)))
+                self._pending = None
+        elif tag == "picture":
+            self._pending = []
+        elif tag == "source":
+            for key in SRCSET_ATTRS:
+                if a.get(key): self._srcset(a[key], _html_dim(a.get("width")), _html_dim(a.get("height")), pending=self._pending)
+        elif tag == "base" and a.get("href") and not self._based:
+            self.base_url = urljoin(self.base_url, a["href"]); self._based = True  # chỉ <base> đầu tiên có hiệu lực
+        elif tag == "a":
+            href = a.get("href")
+            if href and (href.startswith("data:") or IMG_HREF_RE.search(href)): self._add(href)
+            elif href and self.links is not None: self._page_link(href, a.get("rel"))
+        elif tag == "link" and self.links is not None and a.get("href"):
+            rel = (a.get("rel") or "").lower().split()
+            if "next" in rel: self.links[urljoin(self.base_url, a["href"])] = "next"
+            elif "alternate" in rel and (a.get("type") or "").lower() in FEED_TYPES: self.links.setdefault(urljoin(self.base_url, a["href"]), "feed")
+        style = a.get("style")
+        if style:
+            for m in STYLE_URL_RE.finditer(style):
+                if m.group(2): self._add(m.group(2))
+    def handle_endtag(self, tag):
+        if tag == "picture": self._pending = None
+        elif tag == "a" and self._anchor:
+            if " ".join("".join(self._text).split()).lower() in NEXT_TEXTS: self.links[self._anchor] = "next"
+            self._anchor = None
+    def handle_data(self, data):
+        if self._anchor: self._text.append(data)
+    def _page_link(self, href: str, rel):
+        if href.startswith(("#", "javascript:", "mailto:")): return
+        full = urljoin(self.base_url, href).partition("#")[0]
+        if "next" in (rel or "").lower().split(): self.links[full] = "next"
+        elif PAGE_NUM_RE.search(href): self.links.setdefault(full, "page")
+        self._anchor = full; self._text = []  # chữ trong thẻ <a> ("Trang sau", "»"...) xét ở handle_endtag
+    def _srcset(self, srcset: str, width: int, height: int, fallback=None, pending=None):
+        density = False
+        for part in srcset.split(","):
+            tokens = part.split()
+            if not tokens: continue
+            full = urljoin(self.base_url, tokens[0]); self.urls[full] = None
+            d = tokens[1].lower() if len(tokens) >= 2 else "1x"
+            try:
+                if d.endswith("w"):
+                    w = int(d[:-1]); self.hints[full] = (w, round(w * height / width) if width and height else 0)
+                elif d.endswith("x"):
+                    mul = float(d[:-1]); density = True
+                    if width: self.hints[full] = (round(width * mul), round(height * mul))
+                    elif pending is not None: pending.append((full, mul))
+            except ValueError: pass
+        # srcset kiểu x: src là ứng viên 1x
+        if density and fallback and width and not fallback.startswith("data:"):
+            self.hints.setdefault(urljoin(self.base_url, fallback), (width, height))
+
+def extract_image_sources(html: str, base_url: str) -> tuple[list[str], dict]:
+    """Hàm thuần (chạy được ở tiến trình khác): (URL ảnh theo thứ tự xuất hiện, gợi ý (rộng, cao) từ srcset/<picture>)."""
+    p = _ImageSourceParser(base_url); p.feed(html); p.close()
+    return list(p.urls), p.hints
+
+def extract_page_sources(html: str, base_url: str) -> tuple[list[str], dict, dict]:
+    """Như extract_image_sources, thêm link sang trang khác cho chế độ crawl: {url: "next" | "page" | "feed"}."""
+    p = _ImageSourceParser(base_url, links=True); p.feed(html); p.close()
+    return list(p.urls), p.hints, p.links
+
+_parse_pool: concurrent.futures.ProcessPoolExecutor | None = None
+_parse_pool_lock = Lock()
+
+def _get_parse_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = concurrent.futures.ProcessPoolExecutor(max(1, min(4, (os.cpu_count() or 2) - 1)))
+            atexit.register(shutdown_parse_pool)
+        return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool: pool.shutdown(wait=False, cancel_futures=True)
+
+def extract_image_urls(html, base_url, use_processes: bool = True, hints: VariantHints | None = None, links: dict | None = None):
+    """URL ảnh trong trang; `links` (dict) được điền thêm link sang trang khác nếu truyền vào (chế độ crawl)."""
+    result = None; fn = extract_image_sources if links is None else extract_page_sources
+    if use_processes and len(html) >= PROCESS_PARSE_MIN_CHARS and (os.cpu_count() or 1) > 1:
+        try: result = _get_parse_pool().submit(fn, html, base_url).result()
+        except (concurrent.futures.process.BrokenProcessPool, OSError, RuntimeError):
+            shutdown_parse_pool()  # không tạo được tiến trình con -> parse ngay trên luồng này
+    urls, found, *rest = result or fn(html, base_url)
+    if hints is not None: hints.update(found)
+    if links is not None: links.update(rest[0])
+    return urls
+
+# ====== Crawl ======
+
+TRACKING_PARAMS_RE = re.compile(r"^(utm_\w+|fbclid|gclid|mc_cid|mc_eid|ref|ref_src)$", re.I)
+CRAWL_KINDS = ("page", "sitemap", "feed", "robots")
+
+class CrawlOptions:
+    """Chế độ crawl: từ các URL gốc tự tìm thêm trang qua rel=next / nút "Trang sau", phân trang đánh số (?page=2, /page/2/),
+    sitemap (robots.txt + /sitemap.xml của host gốc) và RSS/Atom khai báo trong trang; trang tìm được đi thẳng vào
+    bước lấy ảnh + tải như trang nhập tay.
+    `max_depth`: số bước khám phá tối đa tính từ URL gốc (mỗi trang kế tiếp / mục trong sitemap, feed là +1);
+    `max_pages`: tổng số tài liệu được tải (trang + sitemap + feed, kể cả URL gốc); `same_host`: chỉ nhận host của URL gốc;
+    `sitemaps`/`feeds`: bật đọc sitemap/feed. Trang lấy từ sitemap còn phải nằm dưới thư mục của URL gốc
+    (gốc https://x.com/gallery/cats -> /gallery/...), để sitemap cả site không kéo theo trang ngoài bộ sưu tập."""
+    def __init__(self, max_depth: int = 20, max_pages: int = 200, same_host: bool = True, sitemaps: bool = True, feeds: bool = True):
+        self.max_depth = max(0, int(max_depth)); self.max_pages = max(1, int(max_pages)); self.same_host = same_host
+        self.sitemaps = sitemaps; self.feeds = feeds
+
+def normalize_page_url(url: str) -> str:
+    """Khóa so trùng trang: scheme/host chữ thường, bỏ port mặc định, #fragment và tham số theo dõi (utm_*, fbclid...),
+    tham số xếp theo tên (?a=1&b=2 và ?b=2&a=1 là 1 trang)."""
+    p = urlparse(url.strip()); scheme = p.scheme.lower(); host = (p.hostname or "").lower()
+    if p.port and p.port != {"http": 80, "https": 443}.get(scheme): host += f":{p.port}"
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(p.query, keep_blank_values=True) if not TRACKING_PARAMS_RE.match(k)))
+    return f"{scheme}://{host}{p.path or '/'}" + (f"?{query}" if query else "")
+
+def listing_key(url: str) -> str:
+    """URL bỏ số trang: trang 1, 2, 3... của cùng 1 danh sách cho cùng khóa."""
+    p = urlparse(url); rest = PAGE_NUM_RE.sub("", p.path + ("?" + p.query if p.query else ""))
+    return p.netloc.lower() + rest.rstrip("/?&")
+
+def looks_like_xml(text: str) -> bool:
+    head = text[:512].lstrip("\ufeff \t\r\n").lower()
+    return head.startswith(("<?xml", "<urlset", "<sitemapindex", "<rss", "<feed", "<rdf:rdf"))
+
+def parse_sitemap_or_feed(text: str) -> tuple[str | None, list[str]]:
+    """(loại, link) của sitemap / RSS / Atom: "sitemapindex" -> link là sitemap con, "urlset" / "rss" / "atom" -> link là trang.
+    (None, []) nếu không phải các loại trên (vd. XHTML) hoặc XML hỏng."""
+    try: root = ET.fromstring(text.lstrip("\ufeff \t\r\n"))
+    except ET.ParseError: return None, []
+    tag = lambda el: el.tag.rpartition("}")[2].lower()  # bỏ namespace
+    kind = tag(root); links = []
+    if kind in ("urlset", "sitemapindex"):
+        for entry in root:
+            for child in entry:
+                if tag(child) == "loc" and child.text: links.append(child.text.strip())
+    elif kind in ("rss", "rdf"):
+        kind = "rss"
+        for el in root.iter():
+            if tag(el) == "item":
+                for child in el:
+                    if tag(child) == "link" and child.text: links.append(child.text.strip())
+    elif kind == "feed":
+        kind = "atom"
+        for entry in root:
+            if tag(entry) != "entry": continue
+            hrefs = [(c.get("rel") or "alternate", c.get("href")) for c in entry if tag(c) == "link" and c.get("href")]
+            links += [h for rel, h in hrefs if rel == "alternate"][:1]
+    else:
+        return None, []
+    return kind, links
+
+def robots_sitemaps(text: str) -> list[str]:
+    """Các dòng "Sitemap: URL" trong robots.txt."""
+    return [v.strip() for k, _, v in (line.partition(":") for line in text.splitlines()) if k.strip().lower() == "sitemap" and v.strip()]
+
+def page_text(resp) -> str:
+    """Nội dung trang dạng chữ; sitemap .xml.gz (server không khai báo Content-Encoding) được giải nén."""
+    raw = resp.content
+    if raw[:2] == b"\x1f\x8b":
+        try: return gzip.decompress(raw).decode("utf-8", errors="replace")
+        except (OSError, EOFError): pass
+    return resp.text
+
+class CrawlFrontier:
+    """Hàng đợi trang cần tải (theo chiều rộng) của chế độ crawl, dùng chung cho các luồng tải trang.
+    Mỗi URL chỉ vào hàng đợi 1 lần (so bằng normalize_page_url; set chỉ chứa URL đã nhận nên không vượt max_pages).
+    `next()` chờ khi hàng đợi trống nhưng còn trang đang xử lý (có thể đẻ thêm link); trả None khi đã hết hẳn."""
+    def __init__(self, options: CrawlOptions, seeds: list[str]):
+        self.options = options; self._cond = threading.Condition(); self._q = collections.deque(); self._seen = set()
+        self._meta = {}; self._active = 0; self.accepted = 0; self.dropped = 0; self.counts = dict.fromkeys(CRAWL_KINDS, 0)
+        self.hosts = {urlparse(u).netloc.lower() for u in seeds}
+        self.scopes = {}  # host -> thư mục của các URL gốc (giới hạn trang lấy từ sitemap)
+        for u in seeds:
+            p = urlparse(u); self.scopes.setdefault(p.netloc.lower(), set()).add(p.path.rpartition("/")[0] + "/")
+    def add(self, url: str, depth: int, kind: str = "page", from_sitemap: bool = False) -> bool:
+        """Nhận `url` vào hàng đợi nếu chưa gặp và còn trong giới hạn; False nếu bị bỏ."""
+        p = urlparse(url); host = p.netloc.lower()
+        if p.scheme not in ("http", "https") or not host: return False
+        key = normalize_page_url(url)
+        ok = depth <= self.options.max_depth and (host in self.hosts or not self.options.same_host) and \
+            not (from_sitemap and kind == "page" and not any(p.path.startswith(sc) for sc in self.scopes.get(host, ("/",))))
+        with self._cond:
+            if key in self._seen: return False
+            if not ok or self.accepted >= self.options.max_pages: self.dropped += 1; return False
+            self._seen.add(key); self.accepted += 1; self.counts[kind] += 1
+            self._meta[url] = (depth, kind); self._q.append(url); self._cond.notify()
+        return True
+    def meta(self, url: str) -> tuple[int, str]:
+        """(độ sâu, loại) của URL đã nhận."""
+        with self._cond: return self._meta.get(url, (0, "page"))
+    def next(self, stop: threading.Event) -> str | None:
+        with self._cond:
+            while not self._q:
+                if not self._active or stop.is_set(): return None
+                self._cond.wait(0.2)
+            self._active += 1; return self._q.popleft()
+    def done(self):
+        """Gọi sau khi xử lý xong 1 URL lấy từ next() (kể cả khi lỗi), sau khi đã add() các link tìm được."""
+        with self._cond: self._active -= 1; self._cond.notify_all()
+    @property
+    def full(self) -> bool: return self.accepted >= self.options.max_pages
+
+# ====== Near-duplicate ======
+
+def image_fingerprint(path: str) -> tuple[int, int] | None:
+    """(dHash 64 bit, số pixel) của ảnh; None nếu Pillow không đọc được (SVG, file hỏng...).
+    JPEG được giải mã thẳng ở cỡ nhỏ (draft) nên chỉ tốn vài ms kể cả với ảnh rất lớn."""
+    from PIL import Image
+    try:
+        with Image.open(path) as im:
+            w, h = im.size; im.draft("L", (64, 64))
+            px = im.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    except Exception: return None
+    bits = 0
+    for y in range(8):
+        row = px[y * 9:(y + 1) * 9]
+        for x in range(8): bits = (bits << 1) | (row[x] < row[x + 1])
+    return bits, w * h
+
+class HammingIndex:
+    """Tra hash 64 bit theo khoảng cách Hamming bằng multi-index hashing: chia hash thành `max_distance + 1` đoạn bit;
+    2 hash khác nhau ≤ max_distance bit thì chắc chắn trùng khít ít nhất 1 đoạn, nên mỗi lần tra chỉ so với các mục
+    cùng đoạn thay vì toàn bộ (BK-tree gần như phải duyệt hết khi hash phân bố đều)."""
+    def __init__(self, max_distance: int):
+        self.max_distance = max(0, int(max_distance)); n = min(64, self.max_distance + 1); self.size = 0
+        edges = [64 * i // n for i in range(n + 1)]
+        self._parts = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]; self._tables = [{} for _ in self._parts]
+    def add(self, h: int, item):
+        entry = (h, item); self.size += 1
+        for (shift, mask), table in zip(self._parts, self._tables): table.setdefault((h >> shift) & mask, []).append(entry)
+    def find(self, h: int) -> list[tuple[int, object]]:
+        """[(khoảng cách, item)] của mọi hash cách `h` ≤ max_distance bit."""
+        out = []; seen = set()
+        for (shift, mask), table in zip(self._parts, self._tables):
+            for entry in table.get((h >> shift) & mask, ()):
+                if id(entry) in seen: continue
+                seen.add(id(entry)); d = (h ^ entry[0]).bit_count()
+                if d <= self.max_distance: out.append((d, entry[1]))
+        return out
+    def __len__(self): return self.size
+
+class NearDuplicateIndex:
+    """Lọc ảnh gần trùng (cùng ảnh nhưng khác cỡ / định dạng / mức nén): dHash từ bản thu nhỏ, tra các hash cách
+    ≤ `max_distance` bit bằng HammingIndex. Mỗi cụm chỉ giữ bản lớn nhất (nhiều pixel hơn, hòa thì nhiều byte hơn);
+    bản nhỏ hơn đã lưu trước đó bị xóa. Có ContentIndex thì dấu vân được lưu lại để so cả với file của các lần chạy trước.
+    Cần Pillow (ImportError khi khởi tạo nếu chưa cài)."""
+    def __init__(self, max_distance: int = 6, index: ContentIndex | None = None, on_remove=None):
+        import PIL.Image  # noqa: F401 — báo thiếu Pillow ngay từ đầu job
+        self.max_distance = max(0, int(max_distance)); self.index = index; self.on_remove = on_remove
+        self.tree = HammingIndex(self.max_distance); self._lock = Lock(); self._fresh = []; self.removed = 0
+    def load(self) -> int:
+        """Nạp dấu vân các file đã có trong chỉ mục (tính bù file chưa có); trả về số file vừa phải tính."""
+        if not self.index: return 0
+        computed = 0
+        for sha1, rel, size, phash, area in self.index.fingerprints():
+            path = os.path.join(self.index.out_dir, rel)
+            if phash is None:
+                fp = image_fingerprint(path); computed += 1; self._fresh.append((sha1, fp))
+            else: fp = (int(phash, 16), area or 0) if phash else None
+            if fp: self.tree.add(fp[0], [path, (fp[1], size or 0), sha1])
+        return computed
+    def keep(self, tmp: str, filename: str, sha1: str, size: int, place) -> tuple[str | None, str | None]:
+        """Thay cho `place()` trong StreamSaver.finish: (đường dẫn đã lưu, None), hoặc (None, lý do) nếu đã có bản lớn hơn."""
+        fp = image_fingerprint(tmp)
+        if not fp: return place(), None
+        rank = (fp[1], size)
+        with self._lock:
+            near = [e for _, e in self.tree.find(fp[0]) if e[0]]
+            bigger = next((e for e in near if e[1] >= rank), None)
+            if bigger: return None, f"Bỏ qua (gần trùng): {filename} (đã có {os.path.basename(bigger[0])})"
+            path = place(); self.tree.add(fp[0], [path, rank, sha1]); self._fresh.append((sha1, fp))
+            for e in near: self._drop(e)
+        return path, None
+    def _drop(self, entry: list):
+        path, entry[0] = entry[0], None  # chỉ đánh dấu đã bỏ, mục vẫn nằm trong HammingIndex
+        try: os.remove(path)
+        except OSError: return
+        self.removed += 1
+        if self.index: self.index.forget_file(entry[2])
+        if self.on_remove: self.on_remove(path)
+    def save(self):
+        """Ghi dấu vân mới tính vào chỉ mục (gọi trước khi đóng ContentIndex)."""
+        with self._lock: rows, self._fresh = self._fresh, []
+        if self.index and rows:
+            self.index.record_fingerprints([(h, f"{fp[0]:016x}" if fp else "", fp[1] if fp else 0) for h, fp in rows]); self.index.commit()
+
+# ====== Save/Download ======
+
+CHUNK_SIZE = 64 * 1024
+
+def _claim_hash(h: str, seen_hashes: set, lock: Lock | None = None) -> bool:
+    """Ghi nhận hash nội dung; False nếu đã có file trùng nội dung."""
+    if lock:
+        with lock:
+            if h in seen_hashes: return False
+            seen_hashes.add(h); return True
+    if h in seen_hashes: return False
+    seen_hashes.add(h); return True
+
+class ContentIndex:
+    """Chỉ mục SQLite nằm trong out_dir: URL -> ETag/Last-Modified/size/SHA-1 và SHA-1 -> file đã lưu.
+    `hashes` + `lock` dùng thay seen_hashes nên trùng nội dung được phát hiện cả với các lần chạy trước."""
+    FILENAME = ".tas_index.sqlite3"
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir; self.lock = Lock(); self._dirty = 0
+        self.db = sqlite3.connect(os.path.join(out_dir, self.FILENAME), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS urls(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, size INTEGER, sha1 TEXT);"
+            "CREATE TABLE IF NOT EXISTS files(sha1 TEXT PRIMARY KEY, path TEXT, size INTEGER, mtime REAL, phash TEXT, area INTEGER);")
+        try: self.db.execute("ALTER TABLE files ADD COLUMN phash TEXT"); self.db.execute("ALTER TABLE files ADD COLUMN area INTEGER")
+        except sqlite3.OperationalError: pass  # chỉ mục đã có cột dấu vân ảnh
+        self.hashes = {row[0] for row in self.db.execute("SELECT sha1 FROM files")}
+    def sync_dir(self) -> int:
+        """Bỏ các file đã bị xóa khỏi chỉ mục và băm các file có sẵn trong out_dir chưa được ghi nhận hoặc đã đổi
+        (khác dung lượng / mtime; nội dung cũ của file đó bị bỏ khỏi chỉ mục)."""
+        with self.lock:
+            known = {p: (sz, mt) for p, sz, mt in self.db.execute("SELECT path, size, mtime FROM files")}
+        for rel in known:
+            if not os.path.isfile(os.path.join(self.out_dir, rel)): self._forget_path(rel)
+        added = 0
+        for root, dirs, files in os.walk(self.out_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if name.startswith("."): continue
+                path = os.path.join(root, name); rel = os.path.relpath(path, self.out_dir)
+                try: st = os.stat(path)
+                except OSError: continue
+                if known.get(rel) == (st.st_size, st.st_mtime): continue
+                h = hashlib.sha1()
+                try:
+                    with open(path, "rb") as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b""): h.update(chunk)
+                except OSError: continue
+                sha1 = h.hexdigest()
+                if rel in known: self._forget_path(rel, keep=sha1)  # file bị sửa/ghi đè: nội dung cũ không còn trên đĩa
+                self.record_file(sha1, path, st.st_size); added += 1
+        self.commit(); return added
+    def _forget_path(self, rel: str, keep: str | None = None):
+        """Bỏ các dòng của `rel` (trừ SHA-1 `keep`) khỏi chỉ mục lẫn `hashes`: nội dung đó không còn bị coi là "đã có"."""
+        with self.lock:
+            for (h,) in self.db.execute("SELECT sha1 FROM files WHERE path=? AND sha1 IS NOT ?", (rel, keep)).fetchall():
+                self.hashes.discard(h)
+            self.db.execute("DELETE FROM files WHERE path=? AND sha1 IS NOT ?", (rel, keep))
+    def lookup(self, url: str) -> dict | None:
+        """Thông tin lần tải trước của URL, chỉ khi file tương ứng vẫn còn trên đĩa."""
+        with self.lock:
+            row = self.db.execute("SELECT u.etag, u.last_modified, u.size, u.sha1, f.path FROM urls u "
+                                  "JOIN files f ON f.sha1 = u.sha1 WHERE u.url=?", (url,)).fetchone()
+        if not row or not os.path.isfile(os.path.join(self.out_dir, row[4])): return None
+        return {"etag": row[0], "last_modified": row[1], "size": row[2], "sha1": row[3], "path": row[4]}
+    def record_file(self, sha1: str, path: str, size: int):
+        rel = os.path.relpath(path, self.out_dir)
+        try: mtime = os.stat(path).st_mtime
+        except OSError: mtime = 0.0
+        with self.lock:
+            self.hashes.add(sha1)
+            # dấu vân ảnh (phash) chỉ phụ thuộc nội dung nên giữ nguyên khi cùng SHA-1 được ghi lại
+            self.db.execute("INSERT INTO files(sha1, path, size, mtime) VALUES (?,?,?,?) ON CONFLICT(sha1) DO UPDATE SET "
+                            "path=excluded.path, size=excluded.size, mtime=excluded.mtime", (sha1, rel, size, mtime)); self._touch()
+    def forget_file(self, sha1: str):
+        """Bỏ file khỏi chỉ mục (đã bị xóa vì gần trùng); SHA-1 vẫn nằm trong `hashes` để lần này không tải lại đúng nội dung đó."""
+        with self.lock: self.db.execute("DELETE FROM files WHERE sha1=?", (sha1,)); self._touch()
+    def fingerprints(self) -> list[tuple]:
+        """(sha1, path, size, phash, area) của mọi file; phash None = chưa tính, "" = Pillow không đọc được."""
+        with self.lock: return self.db.execute("SELECT sha1, path, size, phash, area FROM files").fetchall()
+    def record_fingerprints(self, rows):
+        """rows: [(sha1, phash, area)] — ghi 1 lượt cuối job."""
+        with self.lock: self.db.executemany("UPDATE files SET phash=?, area=? WHERE sha1=?", [(ph, a, h) for h, ph, a in rows]); self._touch()
+    def record_url(self, url: str, etag: str | None, last_modified: str | None, size: int, sha1: str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO urls VALUES (?,?,?,?,?)", (url, etag, last_modified, size, sha1)); self._touch()
+    def _touch(self):
+        self._dirty += 1
+        if self._dirty >= 50: self.db.commit(); self._dirty = 0
+    def commit(self):
+        with self.lock: self.db.commit(); self._dirty = 0
+    def close(self):
+        with self.lock: self.db.commit(); self.db.close()
+
+def part_path_for(out_dir: str, url: str) -> str:
+    """File .part cố định theo URL để lần sau tải tiếp bằng Range thay vì tải lại từ đầu."""
+    return os.path.join(out_dir, f".tas_{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}.part")
+
+def discard_part(part_path: str):
+    for p in (part_path, part_path + ".meta"):
+        try: os.remove(p)
+        except OSError: pass
+
+class StreamSaver:
+    """Ghi 1 ảnh theo từng chunk vào file tạm trong out_dir và băm SHA-1 ngay khi nhận; chỉ đổi tên thành file thật
+    khi qua hết bộ lọc (kích thước, trùng nội dung), nếu không thì xóa file tạm. Bộ nhớ chỉ cỡ 1 chunk.
+    Dùng chung cho save_stream (đồng bộ) và engine asyncio (gọi từng bước qua thread pool).
+    `on_done(sha1, size, path)` được gọi khi nhận đủ nội dung hợp lệ (path=None nếu trùng).
+    `part_path`: file tạm cố định; nếu đã có thì các chunk là phần nối tiếp, và `keep = True` giữ lại file khi lỗi mạng.
+    `limits.max_bytes`: `write` báo loại ngay khi vượt, không chờ hết body.
+    `place(tmp, filename, sha1)`: đặt file vào chỗ cuối cùng (OutputLayout.placer); mặc định out_dir/filename, tự thêm _N nếu trùng tên.
+    `near`: NearDuplicateIndex — bước lọc cuối, bỏ ảnh nếu đã lưu bản gần trùng lớn hơn.
+    `metrics`: khi đóng ghi thời gian băm / ghi đĩa / finish, phần còn lại là chờ dữ liệu (transfer), và số byte nhận từ `host`."""
+    def __init__(self, out_dir: str, filename: str, min_bytes: int, allow_exts: set, seen_hashes: set, lock: Lock | None = None,
+                 on_done=None, part_path: str | None = None, limits: ImageLimits | None = None, place=None,
+                 near: NearDuplicateIndex | None = None, metrics: Metrics | None = None, host: str = ""):
+        self.out_dir = out_dir; self.filename = filename; self.min_bytes = min_bytes; self.allow_exts = allow_exts
+        self.seen_hashes = seen_hashes; self.lock = lock; self.on_done = on_done; self.part_path = part_path; self.limits = limits
+        self.near = near; self.metrics = metrics; self.host = host
+        self.place = place or (lambda tmp, filename, digest: _names.claim(tmp, os.path.join(out_dir, filename)))
+        self.h = hashlib.sha1(); self.size = 0; self.keep = False; self.f = None
+        self.tmp = part_path or os.path.join(out_dir, f".tas_{uuid.uuid4().hex[:12]}.part")
+        self._t0 = 0.0; self._resumed = 0; self._times = {"hash": 0.0, "write": 0.0, "finish": 0.0}
+    def begin(self) -> str | None:
+        """Mở file tạm (băm lại phần .part đã có); trả về thông báo bỏ qua nếu đuôi file không được phép."""
+        ext = os.path.splitext(self.filename)[1].lower()
+        if self.allow_exts and ext and ext[1:] not in self.allow_exts:
+            self.tmp = None; return f"Bỏ qua (không nằm trong allow): {self.filename}"
+        mode = "xb"; self._t0 = time.perf_counter()
+        if self.part_path and os.path.isfile(self.part_path):
+            with open(self.part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""): self.h.update(chunk); self.size += len(chunk)
+            mode = "ab"; self._resumed = self.size; self._times["hash"] += time.perf_counter() - self._t0
+        self.f = open(self.tmp, mode); return None
+    def write(self, chunk: bytes) -> str | None:
+        if chunk:
+            t0 = time.perf_counter(); self.f.write(chunk); t1 = time.perf_counter(); self.h.update(chunk)
+            self._times["write"] += t1 - t0; self._times["hash"] += time.perf_counter() - t1; self.size += len(chunk)
+        if self.limits and self.limits.max_bytes and self.size > self.limits.max_bytes: return self.limits.check_size(self.size, self.filename)
+        return None
+    def finish(self) -> tuple[bool, str]:
+        t0 = time.perf_counter()
+        try: return self._finish()
+        finally: self._times["finish"] += time.perf_counter() - t0
+    def _finish(self) -> tuple[bool, str]:
+        self.f.close()
+        if self.min_bytes and self.size < self.min_bytes: return False, f"Bỏ qua (nhỏ hơn {self.min_bytes}B): {self.filename}"
+        digest = self.h.hexdigest()
+        if not _claim_hash(digest, self.seen_hashes, self.lock):
+            if self.on_done: self.on_done(digest, self.size, None)
+            return False, f"Bỏ qua (trùng nội dung): {self.filename}"
+        place = lambda: self.place(self.tmp, self.filename, digest)
+        if self.near:
+            out_path, reason = self.near.keep(self.tmp, self.filename, digest, self.size, place)
+            if reason:
+                if self.on_done: self.on_done(digest, self.size, None)
+                return False, reason
+        else: out_path = place()
+        self.tmp = None
+        if self.part_path: discard_part(self.part_path)
+        if self.on_done: self.on_done(digest, self.size, out_path)
+        return True, f"Đã lưu: {out_path}"
+    def close(self):
+        """Luôn gọi sau cùng: dọn file tạm nếu chưa thành file thật (trừ khi `keep`)."""
+        if self.f:
+            self.f.close()
+            if self.metrics: self._report()
+        if self.tmp and not self.keep:
+            if self.part_path: discard_part(self.part_path)
+            else:
+                try: os.remove(self.tmp)
+                except OSError: pass
+    def _report(self):
+        m = self.metrics; busy = 0.0
+        for stage, t in self._times.items():
+            if t: m.observe(stage, t); busy += t
+        m.observe("transfer", max(0.0, time.perf_counter() - self._t0 - busy), self.host)
+        if self.size > self._resumed: m.count("bytes", self.size - self._resumed, host=self.host)
+
+def save_stream(chunks, out_dir: str, filename: str, min_bytes: int, allow_exts: set, seen_hashes: set, lock: Lock | None = None,
+                on_done=None, part_path: str | None = None, limits: ImageLimits | None = None, place=None,
+                near: NearDuplicateIndex | None = None, metrics: Metrics | None = None, host: str = ""):
+    """Ghi `chunks` qua StreamSaver; lỗi mạng giữa chừng (requests.RequestException) được ném lại, .part được giữ."""
+    saver = StreamSaver(out_dir, filename, min_bytes, allow_exts, seen_hashes, lock, on_done, part_path, limits, place, near, metrics, host)
+    try:
+        reason = saver.begin()
+        if reason: return False, reason
+        try:
+            for chunk in chunks:
+                reason = saver.write(chunk)
+                if reason: return False, reason
+        except requests.RequestException:
+            saver.keep = part_path is not None; raise
+        return saver.finish()
+    finally:
+        saver.close()
+
+def save_bytes(raw: bytes, out_dir: str, filename: str, min_bytes: int, allow_exts: set, seen_hashes: set, lock: Lock | None = None,
+               on_done=None, limits: ImageLimits | None = None, place=None, near: NearDuplicateIndex | None = None,
+               metrics: Metrics | None = None):
+    if limits:
+        reason = limits.check_size(len(raw), filename) or limits.check_dims(image_dimensions(raw[:SizeProber.HEAD_BYTES]), filename)
+        if reason: return False, reason
+    return save_stream((raw,), out_dir, filename, min_bytes, allow_exts, seen_hashes, lock, on_done, limits=limits, place=place, near=near,
+                       metrics=metrics)
+
+def _discard_response(r, drain_max: int = 16 * 1024):
+    """Bỏ qua body chưa đọc: body nhỏ (pixel theo dõi, trang lỗi ngắn) thì đọc nốt để giữ kết nối keep-alive,
+    còn lại đóng luôn — rẻ hơn tải hết một file sẽ bị loại."""
+    cl = r.headers.get("Content-Length", "")
+    if cl.isdigit() and int(cl) <= drain_max:
+        try:
+            for _ in r.iter_content(CHUNK_SIZE): pass
+        except requests.RequestException: pass
+    r.close()
+
+# Các bước dưới đây không phụ thuộc thư viện HTTP: download_http_image (requests) và engine asyncio (aiohttp) dùng chung.
+
+def image_filename(img_url: str) -> str:
+    return sanitize_filename(os.path.basename(urlparse(img_url).path) or "image")
+
+def image_request_headers(img_url: str, referer: str, index: ContentIndex | None, part_path: str | None) -> tuple[dict, int, str | None]:
+    """(header cho GET ảnh, offset tải tiếp, thông báo bỏ qua nếu không cần gửi request)."""
+    headers = {"Referer": referer} if referer else {}
+    known = index.lookup(img_url) if index else None
+    if known:
+        # Đã tải ở lần chạy trước: không có validator thì bỏ qua luôn, có thì hỏi lại server bằng conditional GET
+        if not (known["etag"] or known["last_modified"]): return headers, 0, f"Bỏ qua (đã tải lần trước): {image_filename(img_url)}"
+        if known["etag"]: headers["If-None-Match"] = known["etag"]
+        if known["last_modified"]: headers["If-Modified-Since"] = known["last_modified"]
+    offset = os.path.getsize(part_path) if part_path and os.path.isfile(part_path) else 0
+    if offset:
+        # Còn .part từ lần trước: xin phần còn lại; If-Range để server trả cả file nếu nội dung đã đổi
+        headers["Range"] = f"bytes={offset}-"
+        try:
+            with open(part_path + ".meta", "r", encoding="utf-8") as f: validator = f.read().strip()
+            if validator: headers["If-Range"] = validator
+        except OSError: pass
+    return headers, offset, None
+
+def range_resumed(status: int, headers, offset: int) -> bool:
+    """Server có trả đúng phần nối tiếp của .part không (206 + Content-Range bắt đầu từ offset)."""
+    return status == 206 and headers.get("Content-Range", "").startswith(f"bytes {offset}-")
+
+def screen_image_headers(img_url: str, filename: str, status: int, headers, offset: int, min_bytes: int, allow_exts: set,
+                         limits: ImageLimits | None = None) -> str | None:
+    """Lọc chỉ bằng status + header (chưa đọc body): lỗi HTTP, Content-Type không phải ảnh, Content-Length ngoài giới hạn,
+    đuôi không được phép. Trả về thông báo loại, None nếu nên đọc tiếp."""
+    if status >= 400: return f"Lỗi tải {img_url} -> HTTP {status}"
+    ct = headers.get("Content-Type", "").lower(); ct_main = ct.split(";")[0].strip()
+    # Content-Type rõ ràng không phải ảnh (text/html...) và tên file cũng không giống ảnh: loại ngay từ header
+    if not is_image_content_type(ct) and not IMG_NAME_RE.search(filename) and ct_main not in ("", "application/octet-stream", "binary/octet-stream"):
+        return f"Bỏ qua (không phải ảnh): {img_url} ({ct or 'no content-type'})"
+    # Content-Length chỉ đúng bằng số byte nhận được khi không nén
+    cl = headers.get("Content-Length", "")
+    total = offset + int(cl) if cl.isdigit() and headers.get("Content-Encoding", "identity") == "identity" else None
+    if total is not None and min_bytes and total < min_bytes: return f"Bỏ qua (nhỏ hơn {min_bytes}B): {filename}"
+    reason = limits.check_size(total, filename) if limits and total is not None else None
+    if not reason and allow_exts and is_image_content_type(ct) and choose_extension(filename, ct)[1:] not in allow_exts:
+        reason = f"Bỏ qua (không nằm trong allow): {os.path.splitext(filename)[0] + choose_extension(filename, ct)}"
+    return reason
+
+def head_bytes_wanted(limits: ImageLimits | None) -> int:
+    """Số byte đầu cần đọc trước khi quyết định: đủ cho magic bytes, hoặc đủ cho header kích thước nếu có giới hạn pixel."""
+    return SizeProber.HEAD_BYTES if limits and limits.wants_dims else 32
+
+def screen_image_head(img_url: str, filename: str, content_type: str, head: bytes, limits: ImageLimits | None = None) -> tuple[str, str | None]:
+    """Nhận dạng theo magic bytes (trang lỗi HTML đặt tên .jpg vẫn bị loại) và kiểm tra kích thước pixel.
+    Trả về (đuôi file theo nội dung hoặc "", thông báo loại hoặc None)."""
+    ct = content_type.lower(); kind = sniff_image_type(head)
+    if kind is None or (not kind and not is_image_content_type(ct) and not IMG_NAME_RE.search(filename)):
+        return "", f"Bỏ qua (không phải ảnh): {img_url} ({ct or 'no content-type'})"
+    return kind, limits.check_dims(image_dimensions(head), filename) if limits else None
+
+def strong_validator(headers) -> str:
+    """Giá trị dùng được cho If-Range: ETag mạnh, ETag yếu (W/"...") thì lùi về Last-Modified (RFC 9110 cấm ETag yếu)."""
+    etag = headers.get("ETag")
+    return (etag if etag and not etag.startswith("W/") else headers.get("Last-Modified")) or ""
+
+def remember_validator(part_path: str | None, headers):
+    """Ghi ETag mạnh / Last-Modified cạnh .part để lần tải tiếp gửi If-Range."""
+    validator = strong_validator(headers)
+    if part_path and validator:
+        try:
+            with open(part_path + ".meta", "w", encoding="utf-8") as f: f.write(validator)
+        except OSError: pass
+
+def until_cancelled(chunks, cancel: threading.Event | None):
+    """Bọc iter_content: giữa 2 chunk mà đã Hủy thì ném RequestException (save_stream giữ .part để lần sau tải tiếp)."""
+    if cancel is None: yield from chunks; return
+    for chunk in chunks:
+        if cancel.is_set(): raise requests.RequestException("Đã hủy")
+        yield chunk
+
+def index_recorder(index: ContentIndex | None, img_url: str, headers):
+    """Callback on_done ghi file + validator của URL vào chỉ mục (None nếu không có chỉ mục)."""
+    if not index: return None
+    etag, lm = headers.get("ETag"), headers.get("Last-Modified")
+    def on_done(sha1, size, path):
+        if path: index.record_file(sha1, path, size)
+        index.record_url(img_url, etag, lm, size, sha1)
+    return on_done
+
+def download_http_image(session, img_url, out_dir, referer, min_bytes, allow_exts, seen_hashes, lock: Lock | None = None,
+                        index: ContentIndex | None = None, part_path: str | None = None, limits: ImageLimits | None = None,
+                        place=None, near: NearDuplicateIndex | None = None, cancel: threading.Event | None = None,
+                        metrics: Metrics | None = None):
+    """Lọc theo header (mã lỗi, Content-Type, Content-Length) rồi theo vài KB đầu (magic bytes, kích thước pixel)
+    trước khi ghi phần còn lại; file bị loại chỉ tốn 1 lượt header (+ chunk đầu). `cancel`: dừng giữa 2 chunk khi Hủy.
+    `metrics`: bấm giờ các bước ghi file (StreamSaver); request do `session` (SessionPool) tự đếm."""
+    filename = image_filename(img_url)
+    headers, offset, skip = image_request_headers(img_url, referer, index, part_path)
+    if skip: return False, skip
+    try: r = session.get(img_url, stream=True, timeout=20, headers=headers, allow_redirects=True)
+    except requests.RequestException as e: return False, f"Lỗi tải {img_url} -> {e}"
+    with r:
+        if r.status_code == 304: return False, f"Bỏ qua (không đổi từ lần trước): {filename}"
+        if offset and not range_resumed(r.status_code, r.headers, offset):
+            discard_part(part_path)
+            if r.status_code == 416:  # .part hỏng/dài hơn file thật -> tải lại từ đầu
+                r.close()
+                return download_http_image(session, img_url, out_dir, referer, min_bytes, allow_exts, seen_hashes, lock, index, part_path,
+                                           limits, place, near, cancel, metrics)
+            offset = 0
+        reason = screen_image_headers(img_url, filename, r.status_code, r.headers, offset, min_bytes, allow_exts, limits)
+        if reason:
+            _discard_response(r); return False, reason
+        ct = r.headers.get("Content-Type", ""); chunks = until_cancelled(r.iter_content(CHUNK_SIZE), cancel); ext = ""
+        if not offset:
+            want = head_bytes_wanted(limits); head = b""
+            try:
+                for chunk in chunks:
+                    head += chunk
+                    if len(head) >= want or (want > 32 and image_dimensions(head)): break
+            except requests.RequestException as e: return False, f"Lỗi tải {img_url} -> {e}"
+            ext, reason = screen_image_head(img_url, filename, ct, head, limits)
+            if reason: return False, reason
+            chunks = itertools.chain((head,), chunks)
+        filename = os.path.splitext(filename)[0] + (ext or choose_extension(filename, ct.lower()))
+        if not offset: remember_validator(part_path, r.headers)
+        try: return save_stream(chunks, out_dir, filename, min_bytes, allow_exts, seen_hashes, lock,
+                                index_recorder(index, img_url, r.headers), part_path, limits, place, near, metrics,
+                                urlparse(img_url).netloc.lower())
+        except requests.RequestException as e: return False, f"Lỗi tải {img_url} -> {e}"
+
+# ====== Job ======
+
+SKIP_REASON_RE = re.compile(r"^Bỏ qua \(([^)]*)\)")
+
+def skip_reason(msg: str) -> str | None:
+    """Nhóm lý do bỏ qua của thông báo kết quả ("nhỏ hơn", "trùng nội dung"...); None nếu không phải thông báo bỏ qua."""
+    m = SKIP_REASON_RE.match(msg)
+    # gộp "nhỏ hơn 30000B" và các biến thể có số vào cùng một nhóm
+    return re.sub(r"\s*\d+B$", "", m.group(1)) if m else None
+
+class JobStats:
+    """Bộ đếm tổng hợp của 1 job (an toàn đa luồng): đã lưu, byte đã lưu, bỏ qua theo lý do, lỗi."""
+    def __init__(self):
+        self._lock = Lock(); self.t0 = time.monotonic()
+        self.saved = 0; self.bytes = 0; self.errors = 0; self.skipped = {}
+    def record(self, ok: bool, msg: str):
+        size = 0
+        if ok and msg.startswith("Đã lưu: "):
+            try: size = os.path.getsize(msg[len("Đã lưu: "):])
+            except OSError: pass
+        reason = None if ok else skip_reason(msg)
+        with self._lock:
+            if ok: self.saved += 1; self.bytes += size
+            elif reason is not None: self.skipped[reason] = self.skipped.get(reason, 0) + 1
+            else: self.errors += 1
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = max(1e-6, time.monotonic() - self.t0)
+            return {"saved": self.saved, "bytes": self.bytes, "bytes_per_s": round(self.bytes / elapsed),
+                    "skipped": dict(self.skipped), "errors": self.errors, "seconds": round(elapsed, 3)}
+
+def read_url_list(path: str) -> list[str]:
+    """Đọc file .txt danh sách URL (mỗi dòng 1 URL, bỏ dòng trống)."""
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return [u for u in (line.strip() for line in f) if u]
+
+class JobJournal:
+    """Nhật ký job dạng JSON lines trong out_dir, ghi dần trong lúc chạy để tiếp tục được sau khi Hủy/crash:
+    danh sách trang, URL đã gom biến thể của từng trang và trạng thái từng URL (saved/skipped/failed + lý do).
+    Cùng danh sách trang (và cùng `variant`, vd. "crawl") -> cùng file; job chạy xong trọn vẹn thì file bị xóa."""
+    FINAL_STATES = ("saved", "skipped")
+    def __init__(self, out_dir: str, pages: list[str], variant: str = ""):
+        key = hashlib.sha1("\n".join(pages + [variant] if variant else pages).encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(out_dir, f".tas_job_{key}.jsonl")
+        self.pages = {}; self.states = {}; self._lock = Lock()
+        self.resumed = self._load()
+        self._f = open(self.path, "a", encoding="utf-8")
+        if not self.resumed: self._write({"t": "job", "pages": pages})
+    def _load(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try: rec = json.loads(line)
+                    except ValueError: continue  # dòng cuối ghi dở khi crash
+                    if rec.get("t") == "page": self.pages[rec["page"]] = rec["urls"]
+                    elif rec.get("t") == "url": self.states[rec["url"]] = (rec["state"], rec.get("reason", ""))
+        except OSError: return False
+        return True
+    def _write(self, rec: dict):
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock: self._f.write(line); self._f.flush()
+    def page_resolved(self, page: str, urls: list[str]):
+        self.pages[page] = list(urls); self._write({"t": "page", "page": page, "urls": list(urls)})
+    def url_finished(self, url: str, state: str, reason: str = ""):
+        self.states[url] = (state, reason); self._write({"t": "url", "url": url, "state": state, "reason": reason})
+    def state(self, url: str) -> str:
+        return self.states.get(url, ("pending", ""))[0]
+    def all_done(self, pages: list[str]) -> bool:
+        return all(p in self.pages for p in pages) and \
+            all(self.state(u) in self.FINAL_STATES for urls in self.pages.values() for u in urls)
+    def close(self, completed: bool):
+        with self._lock: self._f.close()
+        if completed:
+            try: os.remove(self.path)
+            except OSError: pass
+
+class DownloadJob:
+    """Một lần tải ảnh từ danh sách trang, không phụ thuộc Qt (dùng cho cả GUI lẫn CLI).
+    Callback `on_log(msg)`, `on_progress(pct)`, `on_image(url, ok, msg)` có thể được gọi từ nhiều luồng.
+    `cache_dir`: bật cache trang HTML (None = tắt); `replay_cache`: chỉ lấy trang từ cache, không hỏi lại server.
+    `limits`: giới hạn dung lượng tối đa / kích thước pixel (ImageLimits), áp dụng trước và trong khi tải.
+    `layout`: cách xếp file trong out_dir — "flat", "host", "page" hoặc "hash" (xem OutputLayout).
+    `near_dups`: bật lọc ảnh gần trùng, ngưỡng khác biệt tối đa (bit dHash, thường 4–10); None = tắt. Cần Pillow.
+    `metrics`: Metrics nhận số liệu theo giai đoạn (kèm sink JSONL/Prometheus của người gọi, người gọi tự close);
+    mặc định job tạo Metrics riêng không sink, đọc qua `job.metrics.snapshot()`.
+    `host_profiles`: HostProfiles — header/cookie/timeout theo host và chính sách Referer cho ảnh của từng host.
+    `crawl`: CrawlOptions — coi `pages` là URL gốc và tự tìm thêm trang (trang kế tiếp, sitemap, RSS/Atom); None = chỉ tải `pages`.
+    Referer của mỗi ảnh tính theo trang chứa nó (không phải trang đầu danh sách), xem `_referer_for`."""
+    def __init__(self, pages: list[str], out_dir: str, allow_exts: set, min_bytes: int,
+                 accept_data: bool, auto_referer: bool, explicit_referer: str, max_workers: int, probe_pixels: bool = False,
+                 cache_dir: str | None = None, replay_cache: bool = False, limits: ImageLimits | None = None, layout: str = "flat",
+                 near_dups: int | None = None, metrics: Metrics | None = None, host_profiles: HostProfiles | None = None,
+                 crawl: CrawlOptions | None = None, on_log=None, on_progress=None, on_image=None):
+        self.on_log = on_log; self.on_progress = on_progress; self.on_image = on_image; self.stats = JobStats()
+        self.metrics = metrics or Metrics()
+        self.pages = pages; self.out_dir = out_dir; self.allow_exts = allow_exts; self.min_bytes = min_bytes
+        self.accept_data = accept_data; self.auto_referer = auto_referer; self.explicit_referer = explicit_referer
+        self.max_workers = max(1, int(max_workers)); self._stop = threading.Event(); self.hash_lock = Lock(); self.seen_hashes = set()
+        self.probe_pixels = probe_pixels; self.prober: SizeProber | None = None; self.hints = VariantHints()
+        self.pool: SessionPool | None = None; self.index: ContentIndex | None = None; self.journal: JobJournal | None = None
+        self.cache_dir = cache_dir or (default_cache_dir() if replay_cache else None); self.replay_cache = replay_cache
+        self.page_cache: HttpCache | None = None; self.limits = limits
+        self.layout = OutputLayout(out_dir, layout); self._page_of = {}
+        self.near_dups = near_dups; self.near: NearDuplicateIndex | None = None; self.profiles = host_profiles
+        self.crawl = crawl
+    def stop(self):
+        self._stop.set()
+        if self.pool: self.pool.abort()  # request đang treo chờ server không phải đợi hết timeout
+    @property
+    def stopped(self) -> bool: return self._stop.is_set()
+    def host_limits(self) -> dict:
+        """Giới hạn hiện tại theo host (luồng đồng thời, req/s) do HostLimiter tự điều chỉnh."""
+        return self.pool.limiter.snapshot() if self.pool else {}
+    def _log(self, msg: str):
+        if self.on_log: self.on_log(msg)
+    def _progress(self, pct: int):
+        if self.on_progress: self.on_progress(pct)
+    def _image(self, url: str, ok: bool, msg: str):
+        self.stats.record(ok, msg)
+        reason = None if ok else skip_reason(msg)
+        if ok: self.metrics.count("images", result="saved")
+        elif reason is not None: self.metrics.count("images", result="skipped", reason=reason)
+        else: self.metrics.count("images", result="error")
+        if self.on_image: self.on_image(url, ok, msg)
+        else: self._log(msg)
+    def _derive_referer(self, page_url: str) -> str:
+        if self.explicit_referer: return self.explicit_referer
+        if not self.auto_referer: return ""
+        try:
+            p = urlparse(page_url)
+            if p.scheme and p.netloc: return f"{p.scheme}://{p.netloc}/"
+        except Exception: return ""
+        return ""
+    def _referer_for(self, img_url: str) -> str:
+        """Referer gửi kèm ảnh: theo hồ sơ host của ảnh nếu có đặt "referer", không thì như cũ (Referer nhập tay,
+        gốc của trang chứa ảnh, hoặc chính URL ảnh). "" = không gửi Referer."""
+        page = self._page_of.get(img_url, "")
+        policy = self.profiles.for_host(urlparse(img_url).netloc).get("referer") if self.profiles else None
+        if policy is None: return self._derive_referer(page) or img_url
+        if policy == "none": return ""
+        if policy == "page": return page or img_url
+        if policy == "origin":
+            p = urlparse(page or img_url); return f"{p.scheme}://{p.netloc}/"
+        return policy
+    def _download_one(self, img_url: str, referer: str) -> tuple[bool, str | None]:
+        """(thành công, thông báo); thông báo None nếu không thử tải (đã Hủy / không nhận data: URL)."""
+        if self._stop.is_set(): return False, None
+        if img_url.startswith("data:"):
+            success, msg = self._save_data_url(img_url)
+            if msg is not None: self._image(img_url, success, msg)
+            return success, msg
+        msg = self._precheck(img_url)
+        if msg: self._image(img_url, False, msg); return False, msg
+        with self.metrics.timer("image", urlparse(img_url).netloc.lower(), url=img_url):
+            success, msg = download_http_image(self.pool, img_url, self.out_dir, referer, self.min_bytes, self.allow_exts,
+                                               self.seen_hashes, self.hash_lock, self.index, part_path_for(self.out_dir, img_url), self.limits,
+                                               self._place_for(img_url), self.near, self._stop, self.metrics)
+        if not success and self._stop.is_set(): return False, None  # bị Hủy giữa chừng: không tính lỗi, lần sau tải tiếp
+        self._image(img_url, success, msg); return success, msg
+    def _place_for(self, img_url: str):
+        return self.layout.placer(img_url, self._page_of.get(img_url, ""))
+    def _save_data_url(self, img_url: str) -> tuple[bool, str | None]:
+        if not self.accept_data: return False, None
+        try:
+            raw, ext = decode_data_url(img_url)
+            if raw is None: return False, None
+            fname = f"inline_{hashlib.sha1(raw).hexdigest()[:12]}{ext}"
+            on_done = (lambda h, size, path: path and self.index.record_file(h, path, size)) if self.index else None
+            return save_bytes(raw, self.out_dir, fname, self.min_bytes, self.allow_exts, self.seen_hashes, self.hash_lock, on_done, self.limits,
+                              self._place_for(img_url), self.near, self.metrics)
+        except Exception as e:
+            return False, f"Lỗi data URL -> {e}"
+    def _precheck(self, img_url: str) -> str | None:
+        """Loại sớm bằng dung lượng đã biết từ lúc gom biến thể (HEAD/Range), không cần gửi thêm request nào."""
+        known = self.prober.known(img_url) if self.prober else None
+        if not known or known[1] < 0: return None
+        name = image_filename(img_url)
+        if self.min_bytes and known[1] < self.min_bytes: return f"Bỏ qua (nhỏ hơn {self.min_bytes}B): {name}"
+        return self.limits.check_size(known[1], name) if self.limits else None
+    def _open_index(self):
+        try:
+            self.index = ContentIndex(self.out_dir); added = self.index.sync_dir()
+            self.seen_hashes = self.index.hashes; self.hash_lock = self.index.lock
+            if added: self._log(f"Đã lập chỉ mục {added} file có sẵn trong thư mục lưu.")
+        except (sqlite3.Error, OSError) as e:
+            self.index = None; self._log(f"Không mở được chỉ mục, chỉ lọc trùng trong lần chạy này: {e}")
+    def _open_near(self):
+        if self.near_dups is None: return
+        try: self.near = NearDuplicateIndex(self.near_dups, self.index, on_remove=lambda p: self._log(f"Đã xóa bản gần trùng nhỏ hơn: {p}"))
+        except ImportError:
+            self._log("Lọc ảnh gần trùng cần Pillow (pip install Pillow) — bỏ qua bước này."); return
+        computed = self.near.load()
+        if computed: self._log(f"Đã tính dấu vân ảnh cho {computed} file có sẵn (lọc gần trùng).")
+    def _open_cache(self):
+        if not self.cache_dir: return
+        try: self.page_cache = HttpCache(self.cache_dir, offline=self.replay_cache)
+        except (sqlite3.Error, OSError) as e:
+            self.page_cache = None; self._log(f"Không mở được cache trang, sẽ tải trực tiếp: {e}")
+    def _fetch_page(self, session, page_url: str) -> requests.Response:
+        with self.metrics.timer("page_fetch", urlparse(page_url).netloc.lower(), url=page_url):
+            if self.page_cache: return self.page_cache.get(session, page_url, timeout=25)
+            if self.replay_cache: raise CacheMiss(f"Không có cache trang: {page_url}")
+            return session.get(page_url, timeout=25)
+    def _open_journal(self):
+        try: self.journal = JobJournal(self.out_dir, self.pages, "crawl" if self.crawl else "")
+        except OSError as e:
+            self.journal = None; self._log(f"Không ghi được nhật ký job, sẽ không tiếp tục được nếu bị ngắt: {e}"); return
+        if self.journal.resumed:
+            states = [self.journal.state(u) for urls in self.journal.pages.values() for u in urls]
+            self._log(f"Tiếp tục job dở dang: {len(self.journal.pages)}/{len(self.pages)} trang đã xử lý, "
+                      f"{sum(st in JobJournal.FINAL_STATES for st in states)} ảnh đã xong, {states.count('failed')} lỗi sẽ thử lại.")
+    def run(self) -> tuple[int, int]:
+        """Chạy hết job trên luồng hiện tại; trả về (số ảnh lưu được, số URL cần tải)."""
+        self.stats.t0 = time.monotonic()
+        os.makedirs(self.out_dir, exist_ok=True); self._open_index(); self._open_near()
+        self.pool = session = SessionPool(self.max_workers, cancel=self._stop, metrics=self.metrics, profiles=self.profiles)
+        self.prober = SizeProber(session, min(8, self.max_workers), self.probe_pixels)
+        self._open_cache(); self._open_journal(); ok = total = 0
+        try: ok, total = self._run(session)
+        finally:
+            self.prober.close(); st = session.stats(); session.close()
+            if self.near:
+                self.near.save()
+                if self.near.removed: self._log(f"Lọc gần trùng: đã xóa {self.near.removed} bản nhỏ hơn.")
+            if self.index: self.index.close()
+            if self.page_cache:
+                c = self.page_cache.counts; self.page_cache.close()
+                self._log(f"Trang: {c['network']} tải mới, {c['revalidated']} dùng cache (304), {c['offline']} phát lại từ cache.")
+            # còn trang chưa xử lý / URL lỗi thì giữ nhật ký để lần chạy sau chỉ làm phần còn thiếu
+            if self.journal: self.journal.close(completed=not self._stop.is_set() and self.journal.all_done(self.pages))
+            self._log(f"Kết nối: {st['new']} mới, {st['reused']} tái sử dụng / {st['requests']} yêu cầu.")
+            for host, lim in self.host_limits().items():
+                if lim["throttled"]:
+                    self._log(f"Host {host} bị giới hạn {lim['throttled']} lần (429/503) -> còn {lim['limit']} luồng, "
+                              f"{lim['rate'] or 'không giới hạn'} req/s.")
+        return ok, total
+    def _put(self, q: queue.Queue, item) -> bool:
+        # put có backpressure nhưng vẫn thoát được khi người dùng bấm Hủy
+        while not self._stop.is_set():
+            try: q.put(item, timeout=0.2); return True
+            except queue.Full: continue
+        return False
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try: return q.get(timeout=0.2)
+            except queue.Empty: continue
+        return None
+    def _run(self, session):
+        """Pipeline: tải trang (nhiều luồng) -> parse + gom biến thể theo từng trang -> tải ảnh.
+        Các hàng đợi đều có giới hạn nên trang tải trước sẽ được tải ảnh ngay, bộ nhớ không phình theo số trang."""
+        journal = self.journal; resolved = journal.pages if journal else {}; done_before = set(resolved)
+        frontier = self._open_frontier()
+        n_pages = len(self.pages); n_fetch = max(1, min(8 if frontier else n_pages, 8, self.max_workers))
+        html_q = queue.Queue(maxsize=n_fetch * 2); url_q = queue.Queue(maxsize=self.max_workers * 4)
+        # crawl: cả trang đã xử lý ở lần trước cũng tải lại (thường từ cache) để lấy link sang trang tiếp theo
+        page_iter = iter([p for p in self.pages if frontier or p not in resolved]); iter_lock = Lock(); count_lock = Lock()
+        st = {"pages": 0, "known": 0, "done": 0, "ok": 0, "pct": 0}; variants = JobVariants(self.hints)
+        def emit_progress():
+            with count_lock:
+                if not st["known"]: return
+                # crawl: tổng số trang còn tăng dần nên giữ % không lùi
+                pct = st["pct"] = max(st["pct"], int(st["done"] * 100 / st["known"] * st["pages"] / (frontier.accepted if frontier else n_pages)))
+            self._progress(pct)
+        def next_page():
+            if frontier: return frontier.next(self._stop)
+            with iter_lock: return next(page_iter, None)
+        def fetcher():
+            while not self._stop.is_set():
+                page_url = next_page()
+                if page_url is None: return
+                try:
+                    page = self._fetch_page(session, page_url); page.raise_for_status()
+                except requests.RequestException as e:
+                    if self._stop.is_set(): return  # Hủy: trang chưa xử lý, lần sau chạy tiếp
+                    # sitemap/robots.txt/feed tự dò có thể không tồn tại: không báo lỗi
+                    if not frontier or frontier.meta(page_url)[1] == "page": self._log(f"Lỗi tải trang {page_url}: {e}")
+                    self._put(html_q, (page_url, None)); continue
+                self._put(html_q, (page_url, page_text(page) if frontier else page.text))
+        def parser():
+            seen_urls = set()
+            try:
+                # Trang đã gom biến thể ở lần chạy trước: chỉ đưa lại các URL chưa xong (chưa tải / lỗi)
+                for page_url, final in list(resolved.items()):
+                    seen_urls.update(final); self._page_of.update(dict.fromkeys(final, page_url))
+                    for u in final: variants.remember(u)
+                    with count_lock: st["known"] += len(final); st["pages"] += not frontier  # crawl: trang được đếm khi xử lý lại
+                    for u in final:
+                        state = journal.state(u)
+                        if state in JobJournal.FINAL_STATES:
+                            with count_lock: st["done"] += 1; st["ok"] += state == "saved"
+                        elif not self._put(url_q, u): return
+                while True:
+                    item = self._get(html_q)
+                    if item is None: return
+                    page_url, html = item
+                    try:
+                        if html is None: continue
+                        if frontier and self._discover(frontier, page_url, html): continue
+                        links = {} if frontier else None
+                        with self.metrics.timer("extract", url=page_url):
+                            urls = [u for u in dict.fromkeys(extract_image_urls(html, page_url, hints=self.hints, links=links)) if u not in seen_urls]
+                        if frontier:
+                            self._follow(frontier, page_url, links)
+                            if page_url in done_before: continue  # ảnh của trang này đã được đưa lại từ nhật ký ở trên
+                        if not urls:
+                            if journal: journal.page_resolved(page_url, [])
+                            self._log(f"Không tìm thấy ảnh ở: {page_url}"); continue
+                        seen_urls.update(urls)
+                        with self.metrics.timer("variants", url=page_url):
+                            final = [u for u in pick_largest_variants(session, urls, self.prober, self.hints)
+                                     if (u not in seen_urls or u in urls) and variants.admit(u)]
+                        seen_urls.update(final); self._page_of.update(dict.fromkeys(final, page_url))
+                        if journal: journal.page_resolved(page_url, final)
+                        with count_lock: st["known"] += len(final)
+                        for u in final:
+                            if not self._put(url_q, u): return
+                    except Exception as e:
+                        self._log(f"Lỗi xử lý trang {page_url}: {e}")
+                    finally:
+                        with count_lock: st["pages"] += 1
+                        if frontier: frontier.done()
+            finally:
+                for _ in range(self.max_workers): self._put(url_q, None)
+        def finished(u: str, success: bool, msg: str | None):
+            if journal and (msg is not None or not self._stop.is_set()):
+                state = "saved" if success else "skipped" if msg is None or SKIP_REASON_RE.match(msg) else "failed"
+                journal.url_finished(u, state, "" if success else msg or "")
+            with count_lock:
+                st["done"] += 1; st["ok"] += 1 if success else 0
+            emit_progress()
+        parse_t = threading.Thread(target=parser, name="page-parser", daemon=True); parse_t.start()
+        dl_t = threading.Thread(target=self._download_stage, args=(url_q, finished), name="downloads", daemon=True); dl_t.start()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_fetch, thread_name_prefix="page") as fetch_ex:
+            concurrent.futures.wait([fetch_ex.submit(fetcher) for _ in range(n_fetch)])
+        self._put(html_q, None); parse_t.join(); dl_t.join()
+        if frontier:
+            c = frontier.counts
+            self._log(f"Crawl: {c['page']} trang, {c['sitemap']} sitemap, {c['feed']} feed; bỏ {frontier.dropped} lượt link ngoài giới hạn"
+                      + (f" (đã đủ {self.crawl.max_pages} trang)." if frontier.full else "."))
+        if variants.suppressed: self._log(f"Bỏ {variants.suppressed} bản nhỏ hơn của ảnh đã lấy ở trang trước.")
+        if variants.upgraded:
+            self._log(f"⚠️ {variants.upgraded} ảnh có bản lớn hơn ở trang sau: tải thêm bản lớn, bản nhỏ đã tải/đang chờ ở trang trước vẫn giữ.")
+        self._log(f"Sau khi gom biến thể, có {st['known']} URL cần tải.")
+        return st["ok"], st["known"]
+    def _open_frontier(self) -> CrawlFrontier | None:
+        if not self.crawl: return None
+        frontier = CrawlFrontier(self.crawl, self.pages)
+        for p in self.pages: frontier.add(p, 0)
+        if self.crawl.sitemaps:
+            for origin in dict.fromkeys(f"{urlparse(p).scheme}://{urlparse(p).netloc}" for p in self.pages):
+                frontier.add(origin + "/robots.txt", 0, "robots"); frontier.add(origin + "/sitemap.xml", 0, "sitemap")
+        return frontier
+    def _discover(self, frontier: CrawlFrontier, url: str, text: str) -> bool:
+        """robots.txt / sitemap / feed: đưa link vào frontier, True = không lấy ảnh từ tài liệu này.
+        URL gốc cũng có thể là sitemap hoặc feed."""
+        depth, kind = frontier.meta(url)
+        if kind == "robots":
+            for sm in robots_sitemaps(text):
+                if self.crawl.sitemaps: frontier.add(sm, depth, "sitemap")
+            return True
+        doc, links = parse_sitemap_or_feed(text) if looks_like_xml(text) else (None, [])
+        if doc is None: return kind != "page"  # sitemap/feed hỏng hoặc là trang HTML báo lỗi: bỏ qua
+        for u in links:
+            # sitemap con cùng độ sâu với sitemap cha: độ sâu chỉ tính bước sang trang
+            if doc == "sitemapindex": frontier.add(u, depth, "sitemap")
+            else: frontier.add(u, depth + 1, from_sitemap=doc == "urlset")
+        return True
+    def _follow(self, frontier: CrawlFrontier, page_url: str, links: dict):
+        """Link tìm được trong trang: rel=next / "Trang sau" luôn theo; số trang chỉ theo nếu cùng danh sách với trang này."""
+        depth, _ = frontier.meta(page_url); key = listing_key(page_url)
+        for u, how in links.items():
+            if how == "feed":
+                if self.crawl.feeds: frontier.add(u, depth + 1, "feed")
+            elif how == "next" or listing_key(u) == key:
+                frontier.add(u, depth + 1)
+    def _download_stage(self, url_q: queue.Queue, finished):
+        """Tầng tải ảnh: lấy URL từ `url_q` tới khi gặp None, gọi `finished(url, ok, msg)` cho từng URL.
+        Mặc định `max_workers` luồng chạy requests; engine asyncio thay hàm này."""
+        def downloader():
+            while True:
+                u = self._get(url_q)
+                if u is None: return
+                try: success, msg = self._download_one(u, self._referer_for(u))
+                except Exception as e:
+                    success, msg = False, f"Lỗi worker: {e}"; self._log(msg)
+                finished(u, success, msg)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="img") as dl_ex:
+            concurrent.futures.wait([dl_ex.submit(downloader) for _ in range(self.max_workers)])
+
+ENGINES = ("threads", "async")
+
+def create_job(*args, engine: str = "threads", **kw) -> DownloadJob:
+    """DownloadJob theo engine: "threads" (requests, mỗi lượt tải 1 luồng) hoặc "async" (asyncio + aiohttp, hàng nghìn
+    lượt tải trên 1 luồng — ImportError nếu chưa cài aiohttp). Tham số còn lại như DownloadJob."""
+    if engine == "async":
+        from image_downloader_async import AsyncDownloadJob
+        return AsyncDownloadJob(*args, **kw)
+    if engine != "threads": raise ValueError(f"Engine không hợp lệ: {engine}")
+    return DownloadJob(*args, **kw)
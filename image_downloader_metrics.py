@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Đo đạc cho pipeline tải ảnh — không phụ thuộc Qt. Mỗi job có 1 `Metrics`: bộ đếm có nhãn (request theo host/status,
+lượt thử lại, ảnh đã lưu/bỏ qua theo lý do...) và bộ bấm giờ theo giai đoạn:
+    dns_tcp, tls      — mở kết nối mới (engine luồng); connect — cả DNS + TCP + TLS (engine asyncio)
+    host_wait         — chờ HostLimiter cho phép gửi request (giới hạn luồng / req/s theo host, sau 429/503)
+    headers           — gửi request tới khi có header phản hồi (gồm cả mở kết nối nếu có)
+    page_fetch, extract, variants — tải trang, parse HTML, gom biến thể (gồm HEAD dò kích thước)
+    transfer, hash, write, finish — chờ body, băm SHA-1, ghi đĩa, lọc trùng + đặt file
+    image             — trọn 1 ảnh từ lúc bắt đầu tới khi lưu/bỏ qua
+Số liệu được đẩy ra các sink cắm thêm: JsonlSink (mỗi lần bấm giờ 1 dòng), PrometheusFile / PrometheusServer
+(định dạng text của Prometheus), còn GUI đọc `snapshot()` theo timer. `start_profiler` bật cProfile hoặc lấy mẫu stack.
+
+Ví dụ:
+    metrics = Metrics([JsonlSink("trace.jsonl"), PrometheusServer(9464)])
+    job = create_job(..., metrics=metrics); job.run(); metrics.close()
+"""
+
+from __future__ import annotations
+
+import os, sys, json, time, pstats, cProfile, threading, contextlib, collections
+from threading import Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class Sink:
+    """Nơi nhận số liệu. `trace = True` thì `record(rec)` được gọi cho mỗi lần bấm giờ (từ nhiều luồng)."""
+    trace = False
+    def start(self, metrics: "Metrics"): self.metrics = metrics
+    def record(self, rec: dict): pass
+    def close(self): pass
+
+
+class Metrics:
+    """Bộ đếm + bộ bấm giờ của 1 job, an toàn đa luồng. Bấm giờ gộp theo (giai đoạn, host); các trường thêm của
+    `observe` (url...) chỉ đi vào sink trace, không thành nhãn nên không làm phình bộ nhớ."""
+    def __init__(self, sinks=()):
+        self._lock = Lock(); self._counters = {}; self._timers = {}; self.sinks = []; self._trace = []; self.t0 = time.monotonic()
+        for s in sinks: self.add_sink(s)
+    def add_sink(self, sink: Sink) -> Sink:
+        sink.start(self); self.sinks.append(sink)
+        if sink.trace: self._trace.append(sink)
+        return sink
+    def count(self, name: str, n: int = 1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + n
+    def observe(self, stage: str, seconds: float, host: str = "", **trace):
+        with self._lock:
+            t = self._timers.get((stage, host))
+            if t is None: t = self._timers[(stage, host)] = [0, 0.0, 0.0]
+            t[0] += 1; t[1] += seconds
+            if seconds > t[2]: t[2] = seconds
+        if self._trace:
+            rec = {"ts": round(time.time(), 6), "stage": stage, "s": round(seconds, 6)}
+            if host: rec["host"] = host
+            rec.update(trace)
+            for s in self._trace: s.record(rec)
+    @contextlib.contextmanager
+    def timer(self, stage: str, host: str = "", **trace):
+        t = time.perf_counter()
+        try: yield
+        finally: self.observe(stage, time.perf_counter() - t, host, **trace)
+
+    def snapshot(self) -> dict:
+        """{"seconds", "stages": {giai đoạn: {n, s, max}}, "hosts": {host: {giai đoạn: ...}}, "counters": {tên: {"k=v,...": n}}}."""
+        with self._lock: timers = {k: list(v) for k, v in self._timers.items()}; counters = dict(self._counters)
+        stages = {}; hosts = {}
+        for (stage, host), (n, s, mx) in sorted(timers.items()):
+            tot = stages.setdefault(stage, {"n": 0, "s": 0.0, "max": 0.0})
+            tot["n"] += n; tot["s"] = round(tot["s"] + s, 6); tot["max"] = round(max(tot["max"], mx), 6)
+            if host: hosts.setdefault(host, {})[stage] = {"n": n, "s": round(s, 6), "max": round(mx, 6)}
+        out = {}
+        for (name, labels), n in sorted(counters.items()):
+            out.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels)] = n
+        return {"seconds": round(time.monotonic() - self.t0, 3), "stages": stages, "hosts": hosts, "counters": out}
+
+    def prometheus_text(self, prefix: str = "tas") -> str:
+        """Định dạng text exposition của Prometheus (version 0.0.4)."""
+        with self._lock: timers = {k: list(v) for k, v in self._timers.items()}; counters = dict(self._counters)
+        lines = [f"# HELP {prefix}_stage_seconds Thời gian theo giai đoạn của pipeline tải ảnh",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        for (stage, host), (n, s, _) in sorted(timers.items()):
+            lab = _prom_labels((("stage", stage),) + ((("host", host),) if host else ()))
+            lines += [f"{prefix}_stage_seconds_count{lab} {n}", f"{prefix}_stage_seconds_sum{lab} {s:.6f}"]
+        lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+        for (stage, host), (_, _, mx) in sorted(timers.items()):
+            lines.append(f"{prefix}_stage_seconds_max{_prom_labels((('stage', stage),) + ((('host', host),) if host else ()))} {mx:.6f}")
+        by_name = collections.defaultdict(list)
+        for (name, labels), n in sorted(counters.items()): by_name[name].append((labels, n))
+        for name, rows in by_name.items():
+            metric = f"{prefix}_{''.join(c if c.isalnum() or c == '_' else '_' for c in name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines += [f"{metric}{_prom_labels(labels)} {n}" for labels, n in rows]
+        lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        lines.append(f"{prefix}_uptime_seconds {time.monotonic() - self.t0:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """Đóng mọi sink (ghi nốt số liệu cuối). Gọi sau khi job chạy xong."""
+        for s in self.sinks:
+            try: s.close()
+            except OSError: pass
+
+
+def _prom_labels(labels) -> str:
+    if not labels: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+def _parse_labels(labels: str) -> dict:
+    return dict(kv.split("=", 1) for kv in labels.split(",") if "=" in kv)
+
+RESULT_NAMES = {"saved": "Đã lưu", "skipped": "Bỏ qua", "error": "Lỗi"}
+
+def summary_lines(snap: dict, top_hosts: int = 8) -> list[str]:
+    """Bảng chữ cho bảng thống kê của GUI: thời gian theo giai đoạn, mã HTTP theo host, lượt thử lại, lý do bỏ qua."""
+    lines = [f"{'Giai đoạn':<11} {'lần':>7} {'tổng s':>9} {'TB ms':>8} {'max ms':>8}"]
+    for stage, t in sorted(snap["stages"].items(), key=lambda kv: -kv[1]["s"]):
+        lines.append(f"{stage:<11} {t['n']:>7} {t['s']:>9.2f} {t['s'] * 1000 / max(1, t['n']):>8.1f} {t['max'] * 1000:>8.1f}")
+    counters = snap["counters"]; per_host = collections.defaultdict(collections.Counter)
+    for labels, n in counters.get("responses", {}).items():
+        d = _parse_labels(labels)
+        per_host[d.get("host", "")][d.get("status", "?")] += n
+    if per_host:
+        lines.append("")
+        for host, codes in sorted(per_host.items(), key=lambda kv: -sum(kv[1].values()))[:top_hosts]:
+            lines.append(f"{host}: " + ", ".join(f"{code}×{n}" for code, n in sorted(codes.items())))
+    extra = []
+    retries = sum(counters.get("retries", {}).values())
+    if retries: extra.append(f"Thử lại: {retries}")
+    errors = sum(counters.get("request_errors", {}).values())
+    if errors: extra.append(f"Lỗi kết nối: {errors}")
+    for labels, n in sorted(counters.get("images", {}).items(), key=lambda kv: -kv[1]):
+        d = _parse_labels(labels); name = RESULT_NAMES.get(d.get("result", ""), d.get("result", "?"))
+        extra.append(f"{name} ({d['reason']}): {n}" if "reason" in d else f"{name}: {n}")
+    if extra: lines += [""] + extra
+    return lines
+
+
+# ====== Sinks ======
+
+class JsonlSink(Sink):
+    """Mỗi lần bấm giờ 1 dòng JSON {"ts", "stage", "s", "host", "url"...}; khi đóng thêm 1 dòng {"snapshot": ...}."""
+    trace = True
+    def __init__(self, path: str):
+        self.path = path; self._lock = Lock(); self._f = open(path, "a", encoding="utf-8", buffering=1024 * 1024)
+    def record(self, rec: dict):
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock: self._f.write(line)
+    def close(self):
+        line = json.dumps({"ts": round(time.time(), 6), "snapshot": self.metrics.snapshot()}, ensure_ascii=False) + "\n"
+        with self._lock: self._f.write(line); self._f.close()
+
+
+class PrometheusFile(Sink):
+    """Ghi file text Prometheus mỗi `interval` giây và khi đóng (ghi file tạm rồi đổi tên, người đọc không thấy file dở) —
+    dùng với textfile collector của node_exporter hoặc mở trực tiếp."""
+    def __init__(self, path: str, interval: float = 5.0):
+        self.path = path; self.interval = interval; self._stop = threading.Event(); self._t = None
+    def start(self, metrics: Metrics):
+        super().start(metrics)
+        self._t = threading.Thread(target=self._loop, name="metrics-prom", daemon=True); self._t.start()
+    def _loop(self):
+        while not self._stop.wait(self.interval): self.write()
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f: f.write(self.metrics.prometheus_text())
+        os.replace(tmp, self.path)
+    def close(self):
+        self._stop.set()
+        if self._t: self._t.join()
+        self.write()
+
+
+class PrometheusServer(Sink):
+    """Phục vụ GET /metrics (định dạng Prometheus) tại http://127.0.0.1:<port>/metrics trong lúc job chạy."""
+    def __init__(self, port: int = 9464, host: str = "127.0.0.1"):
+        self.port = port; self.host = host; self._srv = None
+    def start(self, metrics: Metrics):
+        super().start(metrics)
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_response(404); self.send_header("Content-Length", "0"); self.end_headers(); return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200); self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body)
+        self._srv = ThreadingHTTPServer((self.host, self.port), Handler); self._srv.daemon_threads = True
+        self.port = self._srv.server_address[1]  # port=0: lấy port trống
+        threading.Thread(target=self._srv.serve_forever, name="metrics-http", daemon=True).start()
+    @property
+    def url(self) -> str: return f"http://{self.host}:{self.port}/metrics"
+    def close(self):
+        if self._srv: self._srv.shutdown(); self._srv.server_close(); self._srv = None
+
+
+# ====== Profiler ======
+
+class ThreadProfiler:
+    """cProfile cho cả các luồng tạo ra sau `start()` (cProfile gốc chỉ đo luồng gọi enable): mỗi luồng 1 Profile riêng,
+    `stop()` gộp lại và ghi file .pstats (xem bằng `python -m pstats` hoặc snakeviz). Làm job chậm đi đáng kể."""
+    def __init__(self, path: str):
+        self.path = path; self._lock = Lock(); self._profiles = []; self._main = cProfile.Profile()
+    def _thread_start(self, frame, event, arg):
+        # chạy đúng 1 lần ở lệnh đầu tiên của luồng mới: thay hook này bằng cProfile riêng của luồng
+        sys.setprofile(None); p = cProfile.Profile()
+        with self._lock: self._profiles.append((threading.current_thread(), p))
+        p.enable()
+    def start(self) -> "ThreadProfiler":
+        threading.setprofile(self._thread_start); self._main.enable(); return self
+    def stop(self) -> str:
+        """Ghi file; trả về dòng tóm tắt. Luồng còn chạy (pool nền) bị bỏ qua vì không đọc an toàn được."""
+        self._main.disable(); threading.setprofile(None)
+        stats = pstats.Stats(self._main); skipped = 0
+        with self._lock: profiles = list(self._profiles)
+        for t, p in profiles:
+            if t.is_alive(): skipped += 1; continue
+            stats.add(p)
+        stats.dump_stats(self.path)
+        return f"cProfile: {len(profiles) + 1 - skipped} luồng -> {self.path}" + (f" (bỏ {skipped} luồng còn chạy)" if skipped else "")
+
+
+class SamplingProfiler:
+    """Lấy mẫu stack của mọi luồng mỗi `interval` giây bằng sys._current_frames(), ghi dạng folded
+    ("luồng;module:hàm;... số_mẫu" — mở bằng speedscope hoặc flamegraph.pl). Rất nhẹ, dùng được cho job dài."""
+    def __init__(self, path: str, interval: float = 0.005):
+        self.path = path; self.interval = interval; self.samples = collections.Counter(); self._stop = threading.Event(); self._t = None
+    def _loop(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name.rstrip("0123456789").rstrip("_-") or t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me: continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]}:{frame.f_code.co_name}"); frame = frame.f_back
+                stack.append(names.get(tid, "?")); self.samples[";".join(reversed(stack))] += 1
+    def start(self) -> "SamplingProfiler":
+        self._t = threading.Thread(target=self._loop, name="sampler", daemon=True); self._t.start(); return self
+    def stop(self) -> str:
+        self._stop.set(); self._t.join()
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, n in self.samples.most_common(): f.write(f"{stack} {n}\n")
+        return f"Lấy mẫu: {sum(self.samples.values())} mẫu, {len(self.samples)} stack -> {self.path}"
+
+
+PROFILERS = ("cprofile", "sample")
+
+def start_profiler(path: str, mode: str = "cprofile"):
+    """Bật profiler cho toàn tiến trình; gọi `.stop()` để ghi file (trả về dòng tóm tắt)."""
+    if mode == "sample": return SamplingProfiler(path).start()
+    if mode != "cprofile": raise ValueError(f"Profiler không hợp lệ: {mode}")
+    return ThreadProfiler(path).start()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Tải gói tự cập nhật cho GUI (file .exe vài chục MB) — không phụ thuộc Qt, thử được với server HTTP cục bộ hỗ trợ Range.
+File được chia thành vài đoạn tải song song bằng Range vào chung 1 file .part; tiến độ từng đoạn lưu ở <.part>.json
+nên lỗi mạng chỉ tải lại phần còn thiếu (kể cả khi tắt app rồi mở lại). SHA-256 được băm dần theo phần đầu liền mạch
+đã tải trong lúc các đoạn khác còn chạy, không phải đọc lại cả file sau khi xong.
+
+Ví dụ:
+    sha = UpdateDownload(url, "TaiAnhSieuToc_1.0.4.exe", on_progress=lambda done, total: ...).run(expected_sha256)
+"""
+
+from __future__ import annotations
+
+import os, json, time, hashlib, threading, concurrent.futures
+
+import requests
+
+from image_downloader_engine import build_session, strong_validator
+
+
+class ChecksumMismatch(ValueError):
+    """SHA-256 của file tải về khác giá trị trong manifest (file .part đã bị xóa)."""
+    def __init__(self, expected: str, actual: str):
+        super().__init__(f"Sai checksum: manifest {expected}, tải được {actual}"); self.expected = expected; self.actual = actual
+
+
+class UpdateDownload:
+    """Tải `url` về `dest` bằng tối đa `segments` kết nối Range song song.
+    Server không hỗ trợ Range thì tải 1 luồng như cũ (lỗi giữa chừng phải tải lại từ đầu).
+    Mỗi đoạn tự thử lại `retries` lần (chờ tăng dần) từ byte đang dở; hết lượt thì dừng cả lượt tải, giữ .part + .json
+    để lần gọi `run()` sau tải tiếp. `on_progress(đã tải, tổng)` được gọi từ các luồng tải (tổng None nếu không rõ).
+    `cancel`: Event để dừng giữa chừng (ném requests.RequestException("Đã hủy"), tiến độ vẫn được giữ)."""
+    CHUNK = 64 * 1024
+    HASH_READ = 1024 * 1024
+
+    def __init__(self, url: str, dest: str, segments: int = 4, min_segment: int = 2 * 1024 * 1024, retries: int = 5,
+                 session: requests.Session | None = None, on_progress=None, cancel: threading.Event | None = None):
+        self.url = url; self.dest = dest; self.segments = max(1, int(segments)); self.min_segment = max(1, int(min_segment))
+        self.retries = max(0, int(retries)); self.session = session; self.on_progress = on_progress
+        self.cancel = cancel or threading.Event(); self._abort = threading.Event()
+        self.part = dest + ".part"; self.state_path = self.part + ".json"
+        self._cond = threading.Condition(); self._segs = []; self._done = 0; self._saved_at = 0.0
+        self.size: int | None = None; self.validator = ""; self.ranged = False
+
+    # ----- Chuẩn bị -----
+    def _probe(self, session):
+        """Hỏi 1 byte đầu: 206 + Content-Range thì biết tổng dung lượng và server hỗ trợ Range."""
+        with session.get(self.url, headers={"Range": "bytes=0-0"}, stream=True, timeout=20) as r:
+            r.raise_for_status()
+            self.validator = strong_validator(r.headers)
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            if r.status_code == 206 and total.isdigit():
+                self.size = int(total); self.ranged = True
+            else:
+                cl = r.headers.get("Content-Length", ""); self.size = int(cl) if cl.isdigit() else None; self.ranged = False
+
+    def _plan(self) -> list[dict]:
+        if not self.ranged or not self.size: return [{"start": 0, "end": None if self.size is None else self.size - 1, "done": 0}]
+        n = max(1, min(self.segments, self.size // self.min_segment)); step = -(-self.size // n)
+        return [{"start": s, "end": min(s + step, self.size) - 1, "done": 0} for s in range(0, self.size, step)]
+
+    def _load_state(self) -> list[dict] | None:
+        """Tiến độ lần trước nếu vẫn đúng file đó (cùng URL, dung lượng, ETag/Last-Modified) và .part còn nguyên."""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f: st = json.load(f)
+            if (st.get("url"), st.get("size"), st.get("validator")) != (self.url, self.size, self.validator): return None
+            if os.path.getsize(self.part) != self.size: return None
+            return [{"start": int(s["start"]), "end": int(s["end"]), "done": int(s["done"])} for s in st["segments"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_state(self):
+        if not self.ranged: return
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url, "size": self.size, "validator": self.validator, "segments": self._segs}, f)
+        os.replace(tmp, self.state_path)
+
+    # ----- Tải từng đoạn -----
+    def _stopped(self) -> bool:
+        return self.cancel.is_set() or self._abort.is_set()
+
+    def _advance(self, seg: dict, n: int):
+        with self._cond:
+            seg["done"] += n; self._done += n; self._cond.notify_all()
+            now = time.monotonic()
+            if now - self._saved_at >= 1.0: self._save_state(); self._saved_at = now
+            done = self._done
+        if self.on_progress: self.on_progress(done, self.size)
+
+    def _fetch(self, session, seg: dict):
+        attempt = 0
+        while True:
+            with self._cond: start = seg["start"] + seg["done"]
+            if seg["end"] is not None and start > seg["end"]: return
+            headers = {}
+            if self.ranged:
+                headers["Range"] = f"bytes={start}-{seg['end']}"
+                if self.validator: headers["If-Range"] = self.validator
+            try:
+                with session.get(self.url, headers=headers, stream=True, timeout=20) as r:
+                    r.raise_for_status()
+                    if self.ranged and r.status_code != 206:
+                        # If-Range không khớp: gói trên server đã đổi -> không ghép tiếp được, bỏ tiến độ cũ
+                        self._abort.set(); self._discard(); raise requests.RequestException(f"Gói cập nhật trên server đã thay đổi (HTTP {r.status_code})")
+                    with open(self.part, "r+b") as f:
+                        f.seek(start)
+                        for chunk in r.iter_content(self.CHUNK):
+                            if self._stopped(): raise requests.RequestException("Đã hủy")
+                            f.write(chunk); f.flush(); self._advance(seg, len(chunk))
+                if seg["end"] is None or seg["start"] + seg["done"] > seg["end"]: return
+                raise requests.RequestException("Kết nối đóng trước khi nhận đủ dữ liệu")
+            except requests.RequestException:
+                # server không hỗ trợ Range: không tải tiếp được, để lần gọi sau tải lại từ đầu
+                if self._stopped() or not self.ranged or attempt >= self.retries: raise
+                attempt += 1
+                if self.cancel.wait(min(30.0, 2.0 ** attempt)): raise requests.RequestException("Đã hủy")
+
+    def _contiguous(self, pos: int) -> int:
+        """Byte cuối (không tính) của phần liền mạch đã tải, tính từ `pos`."""
+        for seg in self._segs:
+            end = seg["start"] + seg["done"]
+            if pos < seg["start"]: break
+            if pos <= end: pos = end
+            if seg["end"] is None or end <= seg["end"]: break
+        return pos
+
+    def _discard(self):
+        for p in (self.part, self.state_path):
+            try: os.remove(p)
+            except OSError: pass
+
+    # ----- Chạy -----
+    def run(self, expected_sha256: str = "") -> str:
+        """Tải xong thì đổi tên .part -> dest và trả về SHA-256 (hex). Lỗi mạng: requests.RequestException (giữ tiến độ);
+        sai checksum: ChecksumMismatch (đã xóa .part)."""
+        own = self.session is None; session = self.session or build_session()
+        try:
+            self._probe(session)
+            segs = self._load_state() if self.ranged else None
+            if segs is None:
+                segs = self._plan()
+                with open(self.part, "wb") as f:
+                    if self.size: f.truncate(self.size)  # cấp sẵn dung lượng, mỗi đoạn ghi đúng vị trí của nó
+            self._segs = segs; self._done = sum(s["done"] for s in segs); self._abort.clear()
+            with self._cond: self._save_state()
+            h = hashlib.sha256(); pos = 0
+            try:
+                with concurrent.futures.ThreadPoolExecutor(len(segs), thread_name_prefix="update") as ex, open(self.part, "rb", buffering=0) as rf:
+                    futs = [ex.submit(self._fetch, session, seg) for seg in segs]
+                    for fut in futs: fut.add_done_callback(self._segment_done)
+                    while True:
+                        # băm phần liền mạch vừa có (còn nằm trong page cache) song song với các đoạn đang tải;
+                        # đọc không qua buffer để không giữ lại các byte chưa được ghi phía sau `avail`
+                        with self._cond:
+                            avail = self._contiguous(pos)
+                            if avail == pos and not all(f.done() for f in futs): self._cond.wait(0.5); continue
+                        if avail == pos: break
+                        rf.seek(pos)
+                        while pos < avail:
+                            buf = rf.read(min(self.HASH_READ, avail - pos))
+                            if not buf: break
+                            h.update(buf); pos += len(buf)
+                    for fut in futs: fut.result()
+            finally:
+                with self._cond: self._save_state()  # lỗi/Hủy giữa chừng: lần sau tải tiếp đúng chỗ đang dở
+            if self.size is not None and pos != self.size:
+                raise requests.RequestException(f"Gói cập nhật thiếu dữ liệu ({pos}/{self.size} byte)")
+            digest = h.hexdigest()
+            if expected_sha256 and digest != expected_sha256.lower():
+                self._discard(); raise ChecksumMismatch(expected_sha256.lower(), digest)
+            os.replace(self.part, self.dest)
+            try: os.remove(self.state_path)
+            except OSError: pass
+            return digest
+        finally:
+            if own: session.close()
+
+    def _segment_done(self, fut: concurrent.futures.Future):
+        if fut.exception(): self._abort.set()  # 1 đoạn hỏng hẳn thì các đoạn khác dừng luôn, lần sau tải tiếp
+        with self._cond: self._cond.notify_all()
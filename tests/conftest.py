@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""Cấu hình chung cho pytest: các module của app nằm ở thư mục gốc repo (không đóng gói), server giả lập ở bench/."""
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for p in (ROOT, os.path.join(ROOT, "bench")):
+    if p not in sys.path: sys.path.insert(0, p)
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""Server giả lập cho benchmark: nội dung ảnh phải giống hệt nhau giữa các lần chạy (so sánh kết quả giữa các phiên bản)."""
+
+import os, sys, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIGEST = ("import hashlib; from bench_server import GalleryConfig; c = GalleryConfig(); "
+          "print(hashlib.sha1(b''.join(c.image_body(i) + c.image_body(i, 400, 300) for i in range(5))).hexdigest())")
+
+
+def test_image_body_stable_across_processes():
+    run = lambda: subprocess.run([sys.executable, "-c", DIGEST], cwd=os.path.join(ROOT, "bench"), capture_output=True,
+                                 text=True, check=True).stdout.strip()
+    assert run() == run()
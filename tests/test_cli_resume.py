@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""End-to-end: chạy CLI với server giả lập, Ctrl+C giữa chừng rồi chạy lại -> chỉ tải phần còn thiếu, đủ ảnh, đúng nội dung."""
+
+import os, sys, json, signal, hashlib, subprocess
+
+import pytest
+
+from bench_server import GalleryConfig, GalleryServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cli(srv: GalleryServer, tmp_path, engine: str) -> subprocess.Popen:
+    lst = tmp_path / "pages.txt"; lst.write_text("\n".join(srv.page_urls()), encoding="utf-8")
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "image_downloader_cli.py"), "-l", str(lst), "-o", str(tmp_path / "out"),
+                             "--min-bytes", "0", "-w", "2", "--engine", engine, "--cache-dir", str(tmp_path / "cache")],
+                            cwd=ROOT, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+
+
+@pytest.mark.skipif(os.name != "posix", reason="cần gửi SIGINT cho tiến trình con")
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_cli_interrupt_and_resume(tmp_path, engine):
+    if engine == "async": pytest.importorskip("aiohttp")
+    cfg = GalleryConfig(pages=2, images_per_page=8, image_bytes=60_000, variants=False, bandwidth_kbps=120)
+    srv = GalleryServer(cfg).start()
+    try:
+        proc = cli(srv, tmp_path, engine); saved = 0
+        for line in proc.stdout:
+            ev = json.loads(line)
+            if ev["event"] == "image" and ev["ok"]: saved += 1
+            if saved == 3: proc.send_signal(signal.SIGINT); break
+        proc.stdout.read(); assert proc.wait(60) == 130
+        first = srv.counters["images"]
+        assert [n for n in os.listdir(tmp_path / "out") if n.startswith(".tas_job_")]  # nhật ký còn để tải tiếp
+
+        cfg.bandwidth_kbps = 0
+        proc = cli(srv, tmp_path, engine); events = [json.loads(line) for line in proc.stdout]
+        assert proc.wait(60) == 0
+        done = events[-1]
+        assert done["event"] == "finished" and done["ok"] == done["total"] == cfg.total_images
+        # lượt 2 chỉ xin các ảnh chưa lưu xong ở lượt 1
+        assert srv.counters["images"] - first <= cfg.total_images - saved
+    finally:
+        srv.shutdown(); srv.server_close()
+    out = tmp_path / "out"
+    assert sorted(n for n in os.listdir(out) if not n.startswith(".")) == sorted(f"{i}.jpg" for i in range(cfg.total_images))
+    for i in range(cfg.total_images):
+        assert hashlib.sha1((out / f"{i}.jpg").read_bytes()).digest() == hashlib.sha1(cfg.image_body(i)).digest()
+    assert not [n for n in os.listdir(out) if n.startswith(".tas_job_") or n.endswith(".part")]
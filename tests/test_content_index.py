@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""ContentIndex: đồng bộ chỉ mục với out_dir khi file bị xóa / sửa ngoài app."""
+
+import hashlib, os
+
+from bench_server import GalleryConfig, GalleryServer
+from image_downloader_engine import ContentIndex, DownloadJob
+
+
+def sha1(data: bytes) -> str: return hashlib.sha1(data).hexdigest()
+
+
+def write(path, data: bytes, mtime: float):
+    with open(path, "wb") as f: f.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def rows(index: ContentIndex) -> list[tuple]:
+    return index.db.execute("SELECT path, sha1 FROM files ORDER BY path").fetchall()
+
+
+def test_sync_dir_replaces_rows_of_modified_file(tmp_path):
+    write(tmp_path / "a.jpg", b"cu" * 100, 1_000_000); write(tmp_path / "b.jpg", b"b" * 50, 1_000_000)
+    index = ContentIndex(str(tmp_path))
+    assert index.sync_dir() == 2 and index.hashes == {sha1(b"cu" * 100), sha1(b"b" * 50)}
+    assert index.sync_dir() == 0  # không đổi gì: không băm lại
+
+    write(tmp_path / "a.jpg", b"moi" * 10, 1_000_100)
+    assert index.sync_dir() == 1
+    assert index.hashes == {sha1(b"moi" * 10), sha1(b"b" * 50)}  # nội dung cũ của a.jpg không còn bị coi là trùng
+    assert rows(index) == [("a.jpg", sha1(b"moi" * 10)), ("b.jpg", sha1(b"b" * 50))]
+
+    os.utime(tmp_path / "b.jpg", (1_000_200, 1_000_200))  # chỉ đổi mtime: giữ nguyên dòng cũ
+    os.remove(tmp_path / "a.jpg")
+    assert index.sync_dir() == 1 and rows(index) == [("b.jpg", sha1(b"b" * 50))] and index.hashes == {sha1(b"b" * 50)}
+    index.close()
+
+    index = ContentIndex(str(tmp_path))
+    assert index.hashes == {sha1(b"b" * 50)}
+    index.close()
+
+
+def test_job_downloads_content_that_was_overwritten_on_disk(tmp_path):
+    srv = GalleryServer(GalleryConfig(pages=1, images_per_page=1, image_bytes=20_000, size_jitter=0.0, variants=False)).start()
+    try:
+        write(tmp_path / "cu.jpg", srv.cfg.image_body(0), 1_000_000)
+        index = ContentIndex(str(tmp_path)); index.sync_dir(); index.close()
+        write(tmp_path / "cu.jpg", b"da sua", 1_000_100)  # người dùng ghi đè file: ảnh gốc không còn trên đĩa
+        job = DownloadJob(srv.page_urls(), str(tmp_path), {"jpg"}, 0, False, True, "", 1)
+        assert job.run() == (1, 1)
+        with open(tmp_path / "0.jpg", "rb") as f: assert f.read() == srv.cfg.image_body(0)
+    finally:
+        srv.shutdown(); srv.server_close()
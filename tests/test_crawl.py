@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Chế độ crawl: nhận diện phân trang, khóa danh sách, hàng đợi trang (CrawlFrontier), sitemap / RSS / Atom."""
+
+import threading
+
+from image_downloader_engine import (
+    CrawlFrontier, CrawlOptions, DownloadJob, extract_page_sources, listing_key, looks_like_xml, normalize_page_url,
+    parse_sitemap_or_feed, robots_sitemaps,
+)
+
+BLOG = "https://blog.example"
+
+
+def test_page_numbers_share_listing_key():
+    assert listing_key(f"{BLOG}/gallery?page=2") == listing_key(f"{BLOG}/gallery?page=7") == listing_key(f"{BLOG}/gallery")
+    assert listing_key(f"{BLOG}/tag/cats/page/3/") == listing_key(f"{BLOG}/tag/cats/")
+    assert listing_key(f"{BLOG}/album-p4.html") == listing_key(f"{BLOG}/album-p9.html")
+    assert listing_key(f"{BLOG}/gallery?page=2") != listing_key(f"{BLOG}/other?page=2")
+
+
+def test_wordpress_post_permalinks_are_not_pagination():
+    assert listing_key(f"{BLOG}/?p=123") != listing_key(f"{BLOG}/?p=456")
+    html = '<a href="/?p=123">Bài 1</a><a href="/?p=456">Bài 2</a><a href="/?paged=2">2</a>'
+    _, _, links = extract_page_sources(html, f"{BLOG}/")
+    assert links == {f"{BLOG}/?paged=2": "page"}
+
+
+def test_crawl_follows_pagination_but_not_posts():
+    job = DownloadJob([f"{BLOG}/"], "out", {"jpg"}, 0, False, True, "", 1, crawl=CrawlOptions(sitemaps=False))
+    frontier = CrawlFrontier(job.crawl, [f"{BLOG}/"]); frontier.add(f"{BLOG}/", 0)
+    html = '<a href="/?p=1">a</a><a href="/?p=2">b</a><a href="/?paged=2">2</a><a rel="next" href="/?paged=3">»</a>'
+    _, _, links = extract_page_sources(html, f"{BLOG}/")
+    job._follow(frontier, f"{BLOG}/", links)
+    assert frontier.accepted == 3 and [frontier.next(job._stop) for _ in range(3)] == [f"{BLOG}/", f"{BLOG}/?paged=2", f"{BLOG}/?paged=3"]
+
+
+def test_normalize_page_url():
+    assert normalize_page_url("HTTPS://Blog.Example:443/a?b=2&a=1#top") == normalize_page_url("https://blog.example/a?a=1&b=2")
+    assert normalize_page_url("https://blog.example/a?a=1&utm_source=x&fbclid=y") == "https://blog.example/a?a=1"
+    assert normalize_page_url("http://blog.example:8080") == "http://blog.example:8080/"
+    assert normalize_page_url("https://blog.example/a?a=1") != normalize_page_url("https://blog.example/a?a=2")
+
+
+def frontier(max_depth=20, max_pages=200, same_host=True, seeds=(f"{BLOG}/gallery/cats",)) -> CrawlFrontier:
+    f = CrawlFrontier(CrawlOptions(max_depth, max_pages, same_host), list(seeds))
+    for s in seeds: f.add(s, 0)
+    return f
+
+
+def test_frontier_dedup():
+    f = frontier()
+    assert f.add(f"{BLOG}/gallery/cats?page=2&sort=new", 1)
+    assert not f.add(f"{BLOG}/gallery/cats?sort=new&page=2#x", 1)  # cùng trang, khác thứ tự tham số / fragment
+    assert not f.add("HTTPS://BLOG.EXAMPLE/gallery/cats?page=2&sort=new&utm_medium=rss", 2)
+    assert f.accepted == 2 and f.dropped == 0
+
+
+def test_frontier_scope_depth_and_max_pages():
+    f = frontier(max_depth=2, max_pages=4)
+    assert not f.add("https://other.example/gallery/cats?page=2", 1)  # host khác
+    assert not f.add(f"{BLOG}/gallery/cats?page=9", 3)  # quá sâu
+    assert not f.add("ftp://blog.example/x", 1) and not f.add("mailto:a@b.c", 1)
+    assert not f.add(f"{BLOG}/shop/item-1", 1, from_sitemap=True)  # sitemap: ngoài thư mục của URL gốc
+    assert f.add(f"{BLOG}/gallery/dogs", 1, from_sitemap=True)
+    assert f.add(f"{BLOG}/shop/item-1", 1)  # link trực tiếp trong trang thì không giới hạn thư mục
+    assert f.add(f"{BLOG}/sitemap.xml", 0, "sitemap") and f.full
+    assert not f.add(f"{BLOG}/gallery/cats?page=3", 1)  # đã đủ max_pages
+    assert f.accepted == 4 and f.counts == {"page": 3, "sitemap": 1, "feed": 0, "robots": 0} and f.dropped == 4
+    assert f.meta(f"{BLOG}/sitemap.xml") == (0, "sitemap")
+    assert frontier(same_host=False).add("https://other.example/x", 1)
+
+
+def test_frontier_next_waits_for_active_pages():
+    f = frontier(); stop = threading.Event()
+    assert f.next(stop) == f"{BLOG}/gallery/cats"
+    # trang đang xử lý có thể đẻ thêm link: next() chờ thay vì trả None ngay
+    t = threading.Timer(0.3, lambda: (f.add(f"{BLOG}/gallery/cats?page=2", 1), f.done())); t.start()
+    assert f.next(stop) == f"{BLOG}/gallery/cats?page=2"
+    f.done(); assert f.next(stop) is None
+
+
+SITEMAP_INDEX = """<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc> https://blog.example/sitemap-posts.xml </loc><lastmod>2026-10-01</lastmod></sitemap>
+  <sitemap><loc>https://blog.example/sitemap-pages.xml.gz</loc></sitemap>
+</sitemapindex>"""
+URLSET = """<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+  <url><loc>https://blog.example/gallery/1</loc><image:image><image:loc>https://blog.example/a.jpg</image:loc></image:image></url>
+  <url><loc>https://blog.example/gallery/2</loc></url>
+</urlset>"""
+RSS = """﻿<?xml version="1.0"?><rss version="2.0"><channel><title>Blog</title><link>https://blog.example/</link>
+  <item><title>A</title><link>https://blog.example/a</link></item><item><title>B</title><link>https://blog.example/b</link></item>
+</channel></rss>"""
+ATOM = """<feed xmlns="http://www.w3.org/2005/Atom"><title>Blog</title><link href="https://blog.example/"/>
+  <entry><title>A</title><link rel="edit" href="https://blog.example/edit/a"/><link href="https://blog.example/a"/></entry>
+  <entry><title>B</title><link rel="alternate" type="text/html" href="https://blog.example/b"/></entry>
+</feed>"""
+
+
+def test_parse_sitemap_or_feed():
+    assert parse_sitemap_or_feed(SITEMAP_INDEX) == ("sitemapindex", ["https://blog.example/sitemap-posts.xml", "https://blog.example/sitemap-pages.xml.gz"])
+    assert parse_sitemap_or_feed(URLSET) == ("urlset", ["https://blog.example/gallery/1", "https://blog.example/gallery/2"])
+    assert parse_sitemap_or_feed(RSS) == ("rss", ["https://blog.example/a", "https://blog.example/b"])
+    assert parse_sitemap_or_feed(ATOM) == ("atom", ["https://blog.example/a", "https://blog.example/b"])
+    assert all(looks_like_xml(t) for t in (SITEMAP_INDEX, URLSET, RSS, ATOM))
+    assert parse_sitemap_or_feed('<html xmlns="http://www.w3.org/1999/xhtml"><body/></html>') == (None, [])
+    assert parse_sitemap_or_feed("<urlset><url><loc>https://x") == (None, [])
+    assert robots_sitemaps("User-agent: *\nDisallow: /admin\nSitemap: https://blog.example/s.xml\nsitemap:https://blog.example/t.xml") == \
+        ["https://blog.example/s.xml", "https://blog.example/t.xml"]
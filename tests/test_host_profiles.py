@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""HostProfiles: thứ tự gộp (default < *.domain < host cụ thể), chính sách Referer, header/cookie tới SessionPool, file JSON sai."""
+
+import json, threading
+
+import pytest
+
+from bench_server import GalleryConfig, GalleryServer, _Handler
+from image_downloader_engine import DownloadJob, HostProfiles, SessionPool
+
+PROFILES = {
+    "default": {"headers": {"User-Agent": "tas/1", "Accept": "image/*"}, "timeout": 20},
+    "hosts": {
+        "*.example.com": {"headers": {"Accept": "image/webp"}, "cookies": {"a": "1"}, "referer": "none"},
+        "*.cdn.example.com": {"headers": {"X-Cdn": "1"}, "cookies": {"b": "2"}},
+        "IMG.cdn.example.com": {"headers": {"User-Agent": "tas/img"}, "timeout": 5, "referer": "https://ref.example/"},
+    },
+}
+
+
+def test_merge_order_exact_host_over_wildcards():
+    p = HostProfiles(PROFILES["hosts"], PROFILES["default"])
+    assert p.for_host("img.cdn.example.com:8443") == {
+        "headers": {"User-Agent": "tas/img", "Accept": "image/webp", "X-Cdn": "1"}, "cookies": {"a": "1", "b": "2"},
+        "timeout": 5, "referer": "https://ref.example/"}
+    other = p.for_host("static.cdn.example.com")
+    assert other["headers"] == {"User-Agent": "tas/1", "Accept": "image/webp", "X-Cdn": "1"} and other["referer"] == "none"
+    assert other["timeout"] == 20
+    assert p.for_host("example.com")["cookies"] == {"a": "1"}  # *.example.com khớp cả example.com
+    assert p.for_host("user:pw@notexample.com") == PROFILES["default"]  # không khớp hậu tố chữ: chỉ default
+    assert HostProfiles().for_host("x.org") == {} and not HostProfiles() and p
+
+
+def test_request_kw_explicit_values_win():
+    p = HostProfiles(PROFILES["hosts"], PROFILES["default"])
+    kw = p.request_kw("img.cdn.example.com", {"headers": {"Referer": "https://blog/"}, "cookies": {"b": "x"}, "timeout": 25})
+    assert kw == {"headers": {"User-Agent": "tas/img", "Accept": "image/webp", "X-Cdn": "1", "Referer": "https://blog/"},
+                  "cookies": {"a": "1", "b": "x"}, "timeout": 5}
+    original = {"timeout": 25}
+    assert HostProfiles().request_kw("x.org", original) is original
+
+
+@pytest.mark.parametrize("content, message", [
+    ("{khong phai json", "Expecting"),
+    ("[]", "object JSON"),
+    ('{"hosts": []}', "'hosts'"),
+    ('{"hosts": {"a.com": []}}', "'a.com' phải là object"),
+    ('{"default": {"headers": ["x"]}}', "'headers'"),
+    ('{"hosts": {"a.com": {"headers": {"X-Num": 1}}}}', "'headers'"),
+    ('{"hosts": {"a.com": {"cookies": {"sid": null}}}}', "'cookies'"),
+    ('{"hosts": {"a.com": {"timeout": 0}}}', "'timeout'"),
+    ('{"hosts": {"a.com": {"timeout": "5"}}}', "'timeout'"),
+    ('{"hosts": {"a.com": {"referer": "ftp://x"}}}', "'referer'"),
+    ('{"hosts": {"a.com": {"user_agent": "x"}}}', "user_agent"),
+])
+def test_invalid_file(tmp_path, content, message):
+    path = tmp_path / "profiles.json"; path.write_text(content, encoding="utf-8")
+    with pytest.raises(ValueError, match=message): HostProfiles.load(str(path))
+
+
+def test_load_file_with_bom(tmp_path):
+    path = tmp_path / "profiles.json"; path.write_text(json.dumps(PROFILES), encoding="utf-8-sig")
+    assert HostProfiles.load(str(path)).for_host("img.cdn.example.com")["timeout"] == 5
+    with pytest.raises(OSError): HostProfiles.load(str(tmp_path / "khong-co.json"))
+
+
+# ====== Qua server giả lập ======
+
+class RecordingHandler(_Handler):
+    def _serve(self, body: bool):
+        with self.server.seen_lock: self.server.seen.append((self.path, dict(self.headers)))
+        super()._serve(body)
+
+
+@pytest.fixture
+def gallery():
+    srv = GalleryServer(GalleryConfig(pages=1, images_per_page=2, image_bytes=3_000, variants=False))
+    srv.RequestHandlerClass = RecordingHandler; srv.seen = []; srv.seen_lock = threading.Lock(); srv.start()
+    yield srv
+    srv.shutdown(); srv.server_close()
+
+
+def test_session_pool_sends_profile_headers(gallery):
+    profiles = HostProfiles({"127.0.0.1": {"headers": {"X-Token": "abc", "User-Agent": "tas/test"}, "cookies": {"sid": "42"}}})
+    pool = SessionPool(2, profiles=profiles)
+    try:
+        r = pool.get(gallery.page_urls()[0], timeout=5, headers={"X-Token": "rieng"}); r.close()
+        pool.head(f"{gallery.base_url}/img/0.jpg", timeout=5).close()
+    finally: pool.close()
+    (_, get), (_, head) = gallery.seen
+    assert get["X-Token"] == "rieng" and get["User-Agent"] == "tas/test" and get["Cookie"] == "sid=42"  # header truyền vào thắng
+    assert head["X-Token"] == "abc" and head["Cookie"] == "sid=42"
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+@pytest.mark.parametrize("policy", ["origin", "page", "none", "https://ref.example/gallery", None])
+def test_job_referer_policy(gallery, tmp_path, engine, policy):
+    if engine == "async": job_cls = pytest.importorskip("image_downloader_async").AsyncDownloadJob
+    else: job_cls = DownloadJob
+    prof = {"headers": {"X-Profile": "1"}} | ({"referer": policy} if policy else {})
+    job = job_cls(gallery.page_urls(), str(tmp_path), {"jpg"}, 0, False, True, "", 2, host_profiles=HostProfiles({"127.0.0.1": prof}))
+    assert job.run() == (2, 2)
+    images = [h for path, h in gallery.seen if path.startswith("/img/")]
+    assert len(images) == 2 and all(h["X-Profile"] == "1" for _, h in gallery.seen)
+    expected = {"origin": f"{gallery.base_url}/", "page": gallery.page_urls()[0], "none": None,
+                "https://ref.example/gallery": "https://ref.example/gallery", None: f"{gallery.base_url}/"}[policy]
+    assert all(h.get("Referer") == expected for h in images)
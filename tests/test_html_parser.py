@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""_ImageSourceParser: srcset (w / x), <picture><source>, ảnh lazy-load trong data-*, <base href>, style="url(...)"."""
+
+from image_downloader_engine import VariantHints, extract_image_sources, extract_image_urls
+
+PAGE = "https://blog.example/album/cats.html"
+
+
+def test_srcset_width_descriptors():
+    urls, hints = extract_image_sources(
+        '<img src="a-300.jpg" width="300" height="200" srcset="a-300.jpg 300w, /img/a-900.jpg 900w,a-1200.jpg 1200w">', PAGE)
+    assert urls == ["https://blog.example/album/a-300.jpg", "https://blog.example/img/a-900.jpg", "https://blog.example/album/a-1200.jpg"]
+    assert hints == {urls[0]: (300, 200), urls[1]: (900, 600), urls[2]: (1200, 800)}
+    _, hints = extract_image_sources('<img srcset="b-640.jpg 640w">', PAGE)  # thẻ không có width/height: chưa biết chiều cao
+    assert hints == {"https://blog.example/album/b-640.jpg": (640, 0)}
+
+
+def test_srcset_density_descriptors():
+    urls, hints = extract_image_sources('<img src="c.jpg" width="400" height="300" srcset="c@2x.jpg 2x, c@1.5x.jpg 1.5x">', PAGE)
+    assert hints == {"https://blog.example/album/c@2x.jpg": (800, 600), "https://blog.example/album/c@1.5x.jpg": (600, 450),
+                     "https://blog.example/album/c.jpg": (400, 300)}  # src là ứng viên 1x
+    urls, hints = extract_image_sources('<img src="d.jpg" width="50%" srcset="d@2x.jpg 2x, e.jpg, f.jpg 3q">', PAGE)
+    assert len(urls) == 4 and hints == {}  # không quy đổi được mật độ x, mô tả hỏng thì bỏ qua
+
+
+def test_picture_sources_take_size_from_inner_img():
+    html = """<picture>
+      <source type="image/avif" srcset="p.avif 1x, p@2x.avif 2x">
+      <source media="(min-width: 800px)" srcset="p-1600.webp 1600w" width="1600" height="900">
+      <img src="p.jpg" width="800" height="450" alt="">
+    </picture><img src="q.jpg" srcset="q@2x.jpg 2x">"""
+    urls, hints = extract_image_sources(html, PAGE)
+    full = lambda n: f"https://blog.example/album/{n}"
+    assert urls == [full(n) for n in ("p.avif", "p@2x.avif", "p-1600.webp", "p.jpg", "q.jpg", "q@2x.jpg")]
+    assert hints == {full("p.avif"): (800, 450), full("p@2x.avif"): (1600, 900), full("p-1600.webp"): (1600, 900)}
+
+
+def test_lazy_data_attributes():
+    html = """<img src="data:image/gif;base64,R0lGODlhAQABAAAAACw=" data-src="lazy.jpg" data-srcset="lazy-1024.jpg 1024w">
+      <img data-original="orig.png"><img data-lazy="l.webp"><img data-lazy-src="wp.jpg" data-lazy-srcset="wp-2x.jpg 2x" width="10">
+      <picture><source data-srcset="pic.webp 2x"><img data-src="pic.jpg" width="120" height="80"></picture>
+      <div style="background-image: url('bg.jpg')"></div><a href="/full/orig.JPEG?v=2">xem ảnh gốc</a><a href="/ve-toi">trang</a>"""
+    urls, hints = extract_image_sources(html, PAGE)
+    full = lambda n: f"https://blog.example/album/{n}"
+    assert urls == ["data:image/gif;base64,R0lGODlhAQABAAAAACw=", full("lazy.jpg"), full("lazy-1024.jpg"), full("orig.png"), full("l.webp"),
+                    full("wp.jpg"), full("wp-2x.jpg"), full("pic.webp"), full("pic.jpg"), full("bg.jpg"), "https://blog.example/full/orig.JPEG?v=2"]
+    assert hints == {full("lazy-1024.jpg"): (1024, 0), full("wp-2x.jpg"): (20, 0), full("wp.jpg"): (10, 0), full("pic.webp"): (240, 160)}
+
+
+def test_base_href():
+    html = """<head><base href="https://cdn.example/media/2026/"><base href="https://khac.example/"></head>
+      <img src="a.jpg" srcset="a-2x.jpg 2x" width="10" height="10"><img src="/root.png"><a href="../b.png">b</a>
+      <img src="//img.example/c.jpg"><img src="data:image/png;base64,iVBORw0KGgo=">"""
+    urls, hints = extract_image_sources(html, PAGE)
+    assert urls == ["https://cdn.example/media/2026/a.jpg", "https://cdn.example/media/2026/a-2x.jpg", "https://cdn.example/root.png",
+                    "https://cdn.example/media/b.png", "https://img.example/c.jpg", "data:image/png;base64,iVBORw0KGgo="]
+    assert hints["https://cdn.example/media/2026/a-2x.jpg"] == (20, 20)
+    # <base> tương đối tính theo URL trang
+    assert extract_image_sources('<base href="/static/"><img src="x.jpg">', PAGE)[0] == ["https://blog.example/static/x.jpg"]
+
+
+def test_extract_image_urls_fills_hints_and_links():
+    hints = VariantHints(); links = {}
+    urls = extract_image_urls('<img srcset="a-800.jpg 800w"><a rel="next" href="?page=2">»</a>', PAGE, hints=hints, links=links)
+    assert urls == ["https://blog.example/album/a-800.jpg"] and hints.get(urls[0]) == (800, 0)
+    assert links == {"https://blog.example/album/cats.html?page=2": "next"}
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""HttpCache: conditional GET (304 -> bản trong cache), giới hạn dung lượng LRU, body hỏng/mất thì tải lại đầy đủ."""
+
+import os
+
+import pytest
+import requests
+
+from bench_server import GalleryConfig, GalleryServer
+from image_downloader_engine import DownloadJob, HttpCache
+
+
+@pytest.fixture
+def gallery():
+    srv = GalleryServer(GalleryConfig(pages=6, images_per_page=20, image_bytes=5_000, size_jitter=0.0, variants=False)).start()
+    yield srv
+    srv.shutdown(); srv.server_close()
+
+
+@pytest.fixture
+def session():
+    s = requests.Session(); yield s; s.close()
+
+
+def bodies(cache: HttpCache) -> list[str]:
+    return sorted(n for n in os.listdir(cache.dir) if n.endswith(".body"))
+
+
+def test_304_serves_cached_body(gallery, session, tmp_path):
+    cache = HttpCache(str(tmp_path)); url = gallery.page_urls()[0]; html = gallery.cfg.page_html(0)
+    r = cache.get(session, url, timeout=5)
+    assert r.status_code == 200 and not r.from_cache and r.content == html
+    r = cache.get(session, url, timeout=5)
+    assert r.status_code == 200 and r.from_cache and r.content == html and "charset=utf-8" in r.headers["Content-Type"]
+    assert cache.counts == {"network": 1, "revalidated": 1, "offline": 0}
+    assert gallery.counters["not_modified"] == 1 and gallery.counters["bytes"] == len(html)  # lần 2 không nhận lại body
+    cache.close()
+
+    replay = HttpCache(str(tmp_path), offline=True); requests_before = gallery.counters["requests"]
+    assert replay.get(session, url).content == html and gallery.counters["requests"] == requests_before
+    replay.close()
+
+
+def test_job_rerun_revalidates_pages_and_images(gallery, tmp_path):
+    out, cache = str(tmp_path / "out"), str(tmp_path / "cache"); os.makedirs(out)
+    pages = gallery.page_urls()[:1]
+    assert DownloadJob(pages, out, {"jpg"}, 0, False, True, "", 1, cache_dir=cache).run() == (20, 20)
+    logs = []; sent = gallery.counters["bytes"]
+    assert DownloadJob(pages, out, {"jpg"}, 0, False, True, "", 1, cache_dir=cache, on_log=logs.append).run() == (0, 20)
+    assert gallery.counters["bytes"] == sent and gallery.counters["not_modified"] == 21  # 1 trang + 20 ảnh: chỉ 304
+    assert sum("không đổi từ lần trước" in m for m in logs) == 20
+    assert any("Trang: 0 tải mới, 1 dùng cache (304)" in m for m in logs)
+
+
+def test_lru_eviction_stays_under_max_bytes(gallery, session, tmp_path):
+    urls = gallery.page_urls(); size = len(gallery.cfg.page_html(5))
+    cache = HttpCache(str(tmp_path), max_bytes=size * 4 + 50)
+    for i in (0, 1, 2, 3): cache.get(session, urls[i], timeout=5)
+    cache.get(session, urls[0], timeout=5)  # trang 0 vừa dùng lại -> trang 1 là mục cũ nhất
+    cache.get(session, urls[4], timeout=5); cache.get(session, urls[5], timeout=5)
+    stored = {row[0] for row in cache.db.execute("SELECT url FROM entries")}
+    assert cache.total <= cache.max_bytes and cache.total == sum(os.path.getsize(os.path.join(cache.dir, n)) for n in bodies(cache))
+    assert urls[0] in stored and urls[5] in stored and urls[1] not in stored
+    assert len(bodies(cache)) == len(stored)
+    cache.close()
+
+
+def test_oversize_body_is_not_stored(gallery, session, tmp_path):
+    cache = HttpCache(str(tmp_path), max_bytes=len(gallery.cfg.page_html(0)) * 4 - 1); url = gallery.page_urls()[0]
+    assert not cache.get(session, url, timeout=5).from_cache
+    assert not cache.get(session, url, timeout=5).from_cache  # không có validator để gửi: tải lại đầy đủ
+    assert cache.total == 0 and not bodies(cache) and gallery.counters.get("not_modified", 0) == 0
+    cache.close()
+
+
+@pytest.mark.parametrize("damage", ["missing", "truncated", "bad_headers"])
+def test_damaged_entry_falls_back_to_full_get(gallery, session, tmp_path, damage):
+    cache = HttpCache(str(tmp_path)); url = gallery.page_urls()[0]; html = gallery.cfg.page_html(0)
+    cache.get(session, url, timeout=5); path = cache._body_path(url)
+    if damage == "missing": os.remove(path)
+    elif damage == "truncated":
+        with open(path, "r+b") as f: f.truncate(len(html) // 2)
+    else: cache.db.execute("UPDATE entries SET headers='{' WHERE url=?", (url,)); cache.db.commit()
+    r = cache.get(session, url, timeout=5)
+    assert not r.from_cache and r.content == html and gallery.counters.get("not_modified", 0) == 0
+    assert cache.counts["network"] == 2 and cache.total == len(html)  # mục hỏng bị thay bằng bản mới
+    assert cache.get(session, url, timeout=5).from_cache
+    cache.close()
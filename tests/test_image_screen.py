@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Lọc ảnh trước khi ghi: magic bytes (sniff_image_type), kích thước pixel từ header (image_dimensions),
+lọc theo status/header (screen_image_headers) và theo vài KB đầu (screen_image_head)."""
+
+import dataclasses, io, os, struct, zlib
+
+import pytest
+
+from bench_server import GalleryConfig, GalleryServer
+from image_downloader_engine import DownloadJob, ImageLimits, image_dimensions, screen_image_head, screen_image_headers, sniff_image_type
+
+
+def png(w: int, h: int) -> bytes:
+    ihdr = struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+
+
+def gif(w: int, h: int) -> bytes:
+    return b"GIF89a" + struct.pack("<HH", w, h) + b"\x00\x00\x00"
+
+
+def jpeg(w: int, h: int, sof: int = 0xC0, exif: int = 0) -> bytes:
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    app1 = b"\xff\xe1" + struct.pack(">H", exif + 2) + b"\x00" * exif if exif else b""
+    dqt = b"\xff\xdb" + struct.pack(">H", 67) + b"\x00" + bytes(64)
+    frame = b"\xff" + bytes([sof]) + struct.pack(">HBHHB", 17, 8, h, w, 3) + b"\x01\x22\x00\x02\x11\x01\x03\x11\x01"
+    return b"\xff\xd8" + app0 + app1 + dqt + b"\xff\xff" + frame + b"\xff\xda"  # \xff\xff: byte đệm hợp lệ trước marker
+
+
+def webp(w: int, h: int, kind: str) -> bytes:
+    if kind == "VP8 ": payload = b"\x00\x00\x00\x9d\x01\x2a" + struct.pack("<HH", w, h)
+    elif kind == "VP8L": payload = b"\x2f" + struct.pack("<I", (w - 1) | ((h - 1) << 14)) + bytes(5)
+    else: payload = b"\x00\x00\x00\x00" + (w - 1).to_bytes(3, "little") + (h - 1).to_bytes(3, "little")
+    chunk = kind.encode() + struct.pack("<I", len(payload)) + payload
+    return b"RIFF" + struct.pack("<I", 4 + len(chunk)) + b"WEBP" + chunk
+
+
+SAMPLES = [
+    (png(640, 480), ".png", (640, 480)), (gif(120, 90), ".gif", (120, 90)),
+    (jpeg(1920, 1080), ".jpg", (1920, 1080)), (jpeg(800, 1200, sof=0xC2), ".jpg", (800, 1200)),  # progressive
+    (jpeg(300, 200, exif=5000), ".jpg", (300, 200)),  # EXIF dài trước SOF
+    (webp(1024, 768, "VP8 "), ".webp", (1024, 768)), (webp(16383, 2, "VP8L"), ".webp", (16383, 2)),
+    (webp(20000, 10000, "VP8X"), ".webp", (20000, 10000)),
+]
+
+
+@pytest.mark.parametrize("data, ext, dims", SAMPLES)
+def test_sniff_and_dimensions(data, ext, dims):
+    assert sniff_image_type(data) == ext and image_dimensions(data) == dims
+    assert image_dimensions(data + os.urandom(1000)) == dims
+
+
+@pytest.mark.parametrize("data, ext, dims", SAMPLES)
+def test_truncated_header_gives_no_dimensions(data, ext, dims):
+    for n in range(len(data)):
+        got = image_dimensions(data[:n])
+        assert got is None or got == dims, n  # thiếu byte: không đoán bừa, không ném lỗi
+    assert image_dimensions(data[:len(data) // 2 if ext != ".jpg" else 20]) is None
+
+
+def test_jpeg_without_sof_and_other_formats():
+    assert image_dimensions(b"\xff\xd8\xff\xe0\x00\x10JFIF" + bytes(200)) is None
+    assert image_dimensions(b"RIFF\x00\x00\x00\x00WEBPVP8A" + bytes(30)) is None  # chunk WebP lạ
+    assert image_dimensions(b"BM" + bytes(40)) is None and sniff_image_type(b"BM" + bytes(40)) == ".bmp"
+    assert image_dimensions(b"") is None and sniff_image_type(b"") == ""
+
+
+@pytest.mark.parametrize("head, expected", [
+    (b"\xef\xbb\xbf\r\n  <!DOCTYPE html><html><body>404</body></html>", None),
+    (b"<HTML><HEAD><TITLE>Access Denied</TITLE>", None),
+    (b'{"error": "not found"}', None), (b"[]", None),
+    (b"<?xml version='1.0'?><html xmlns='http://www.w3.org/1999/xhtml'>", None),
+    (b'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg"/>', ".svg"), (b"<svg width='1'/>", ".svg"),
+    (b"\x00\x00\x00\x1cftypavif\x00\x00\x00\x00", ".avif"), (b"\x00\x00\x00\x1cftypheic", ""),
+    (b"II*\x00\x08\x00", ".tif"), (b"MM\x00*", ".tif"), (b"GIF87a\x01\x00\x01\x00", ".gif"),
+    (b"\xff\xd8", ""), (b"\x89PNG", ""), (b"RIFF\x10\x00\x00\x00WEB", ""),  # quá ngắn: chưa nhận ra, nhưng không phải HTML
+])
+def test_sniff_image_type(head, expected):
+    assert sniff_image_type(head) == expected
+
+
+def test_screen_image_head_rejects_html_served_as_image():
+    url = "https://cdn.example/a.jpg"
+    ext, reason = screen_image_head(url, "a.jpg", "image/jpeg", "<!doctype html><title>Hotlink bị chặn</title>".encode())
+    assert ext == "" and reason.startswith("Bỏ qua (không phải ảnh)")
+    assert screen_image_head(url, "a.jpg", "image/jpeg", png(10, 10)) == (".png", None)  # đuôi theo nội dung
+    assert screen_image_head(url, "a.jpg", "image/jpeg", b"\x00\x01??") == ("", None)  # không nhận ra: tin Content-Type
+    assert screen_image_head(url, "tai-ve", "text/plain", b"\x00\x01")[1].startswith("Bỏ qua (không phải ảnh)")
+
+
+def test_screen_image_head_pixel_limits():
+    limits = ImageLimits(min_width=500, min_height=400, max_width=4000)
+    assert screen_image_head("u", "a.png", "image/png", png(640, 480), limits) == (".png", None)
+    assert screen_image_head("u", "a.png", "image/png", png(400, 480), limits)[1] == "Bỏ qua (kích thước ngoài giới hạn): a.png (400x480)"
+    assert "(640x300)" in screen_image_head("u", "a.gif", "image/gif", gif(640, 300), limits)[1]
+    assert "(5000x3000)" in screen_image_head("u", "a.webp", "image/webp", webp(5000, 3000, "VP8X"), limits)[1]
+    assert screen_image_head("u", "a.jpg", "image/jpeg", jpeg(300, 200)[:20], limits) == (".jpg", None)  # chưa đọc được cỡ: không loại
+
+
+@pytest.mark.parametrize("status, headers, offset, min_bytes, limits, expected", [
+    (404, {"Content-Type": "text/html"}, 0, 0, None, "Lỗi tải"),
+    (200, {"Content-Type": "image/jpeg", "Content-Length": "999"}, 0, 1000, None, "Bỏ qua (nhỏ hơn 1000B)"),
+    (200, {"Content-Type": "image/jpeg", "Content-Length": "999"}, 1, 1000, None, None),  # tải tiếp: tính cả phần đã có
+    (200, {"Content-Type": "image/jpeg", "Content-Length": "999", "Content-Encoding": "gzip"}, 0, 1000, None, None),
+    (200, {"Content-Type": "image/jpeg", "Content-Length": "5001"}, 0, 0, ImageLimits(max_bytes=5000), "Bỏ qua (lớn hơn 5000B)"),
+    (200, {"Content-Type": "image/jpeg", "Content-Length": "5000"}, 0, 0, ImageLimits(max_bytes=5000), None),
+    (200, {"Content-Type": "image/jpeg"}, 0, 1000, ImageLimits(max_bytes=5000), None),  # không có Content-Length: lọc khi ghi
+    (200, {"Content-Type": "image/png"}, 0, 0, None, "Bỏ qua (không nằm trong allow): a.png"),
+])
+def test_screen_image_headers(status, headers, offset, min_bytes, limits, expected):
+    reason = screen_image_headers("https://cdn.example/a.jpg", "a.jpg", status, headers, offset, min_bytes, {"jpg"}, limits)
+    assert reason == expected if expected is None else reason.startswith(expected)
+
+
+def test_html_error_page_named_jpg_passes_header_screen():
+    # Content-Type sai nhưng tên file giống ảnh: để screen_image_head quyết định theo nội dung
+    assert screen_image_headers("u", "a.jpg", 200, {"Content-Type": "text/html"}, 0, 0, {"jpg"}) is None
+    assert screen_image_headers("u", "a.php", 200, {"Content-Type": "application/octet-stream"}, 0, 0, {"jpg"}) is None
+    assert screen_image_headers("u", "a.php", 200, {"Content-Type": "text/html; charset=utf-8"}, 0, 0, {"jpg"}).startswith("Bỏ qua (không phải ảnh)")
+
+
+# ====== Cả job qua server giả lập ======
+
+@dataclasses.dataclass
+class MixedGallery(GalleryConfig):
+    """Server luôn trả image/jpeg: ảnh 0 là trang lỗi HTML, 1 là PNG nhỏ, 2 là PNG lớn, 3 là JPEG quá nặng."""
+    def image_body(self, img_id: int, w=None, h=None) -> bytes:
+        if img_id == 0: return "<!DOCTYPE html><html><body>Ảnh đã bị xóa</body></html>".encode().ljust(3000)
+        if img_id == 1: return png(200, 150).ljust(3000, b"\x00")
+        if img_id == 2: return png(1600, 1200).ljust(3000, b"\x00")
+        return jpeg(1600, 1200).ljust(60_000, b"\x00")
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_job_filters_by_content_pixels_and_bytes(tmp_path, engine):
+    if engine == "async": job_cls = pytest.importorskip("image_downloader_async").AsyncDownloadJob
+    else: job_cls = DownloadJob
+    srv = GalleryServer(MixedGallery(pages=1, images_per_page=4, variants=False)).start(); logs = []
+    try:
+        job = job_cls(srv.page_urls(), str(tmp_path), {"jpg", "png"}, 0, False, True, "", 2,
+                      limits=ImageLimits(max_bytes=50_000, min_width=500), on_log=logs.append)
+        assert job.run() == (1, 4)
+    finally:
+        srv.shutdown(); srv.server_close()
+    assert [n for n in os.listdir(tmp_path) if not n.startswith(".")] == ["2.png"]  # đuôi theo nội dung, không theo URL
+    text = "\n".join(logs)
+    assert "không phải ảnh" in text and "(200x150)" in text and "lớn hơn 50000B" in text
+
+
+def test_image_dimensions_match_pillow():
+    Image = pytest.importorskip("PIL.Image")
+    for fmt, size, kw in [("JPEG", (333, 222), {"progressive": True}), ("PNG", (64, 48), {}), ("GIF", (5, 7), {}),
+                          ("WEBP", (321, 123), {"lossless": False}), ("WEBP", (99, 77), {"lossless": True})]:
+        buf = io.BytesIO(); Image.new("RGB", size, (10, 200, 30)).save(buf, fmt, **kw)
+        assert image_dimensions(buf.getvalue()[:1024]) == size, fmt
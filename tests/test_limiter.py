@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""HostLimiter: 429/503 lẻ tẻ không hạ tốc cả host, quá tải thật thì giảm + chặn theo Retry-After, sau đó hồi phục."""
+
+import pytest
+
+import image_downloader_engine as engine
+from image_downloader_engine import HostLimiter
+
+HOST = "img.example.com"
+
+
+class Clock:
+    def __init__(self): self.now = 1000.0
+    def __call__(self): return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock(); monkeypatch.setattr(engine.time, "monotonic", c); return c
+
+
+def ok(lim: HostLimiter, n: int = 1, latency: float = 0.05):
+    for _ in range(n):
+        lim.try_acquire(HOST); lim.release(HOST, 200, latency)
+
+
+def overload(lim: HostLimiter, retry_after: float | None = 1.0) -> bool:
+    """Toàn 429 cho tới khi limiter coi host là quá tải; trả về kết quả của lần release cuối."""
+    for _ in range(HostLimiter.MIN_SAMPLE):
+        lim.try_acquire(HOST)
+        if lim.release(HOST, 429, 0.05, retry_after): return True
+    return False
+
+
+def test_isolated_throttle_does_not_slow_host(clock):
+    lim = HostLimiter(16); ok(lim, 30)
+    assert lim.release(HOST, 429, 0.05, 1.0) is False  # người gọi tự chờ Retry-After
+    st = lim._hosts[HOST]
+    assert st["limit"] == 16 and st["blocked_until"] == 0.0 and st["rate"] == 0.0
+    assert lim.try_acquire(HOST) == 0.0
+
+
+def test_overload_cuts_and_clamps_retry_after(clock):
+    lim = HostLimiter(16)
+    assert overload(lim, retry_after=3600) is True
+    st = lim._hosts[HOST]
+    assert st["limit"] == 8 and st["rate"] > 0
+    assert st["blocked_until"] - clock.now == HostLimiter.MAX_RETRY_AFTER
+    assert lim.try_acquire(HOST) > 0  # cả host đang bị chặn
+
+
+def test_rate_recovers_multiplicatively_then_cap_dropped(clock):
+    lim = HostLimiter(16); ok(lim, 5, latency=1.0); overload(lim)
+    st = lim._hosts[HOST]; rate0 = st["rate"]
+    assert 0 < rate0 < 10  # ước lượng theo độ trễ 1 s rồi giảm một nửa
+    for _ in range(3):
+        clock.now += 1.0; ok(lim, latency=1.0)
+    assert st["rate"] == pytest.approx(rate0 * HostLimiter.RATE_GROWTH ** 3)
+    ok(lim, 5, latency=1.0)  # nhiều phản hồi trong cùng 1 giây chỉ tăng 1 lần
+    assert st["rate"] == pytest.approx(rate0 * HostLimiter.RATE_GROWTH ** 3)
+    clock.now += HostLimiter.RECOVER_AFTER; ok(lim, latency=1.0)
+    assert lim.snapshot()[HOST] == {"limit": 16, "inflight": 0, "rate": None, "throttled": st["throttled"]}
+
+
+def test_second_cut_needs_new_evidence(clock):
+    lim = HostLimiter(16); overload(lim)
+    clock.now += 2.0; ok(lim, 40); limit = lim._hosts[HOST]["limit"]
+    # sau lần giảm, các 429 cũ không còn tính: 1 cái 429 mới chưa phải quá tải
+    assert lim.release(HOST, 503, 0.05, 1.0) is False
+    assert lim._hosts[HOST]["limit"] == limit
+
+
+def test_throttle_wait():
+    lim = HostLimiter(4)
+    assert lim.throttle_wait(2.0, 0) == 2.0
+    assert lim.throttle_wait(3600, 0) == HostLimiter.MAX_RETRY_AFTER
+    assert [lim.throttle_wait(None, a) for a in range(3)] == [0.5, 1.0, 2.0]
+
+
+def test_steady_high_latency_does_not_collapse_host(clock):
+    # 1 phản hồi rất nhanh (HEAD/304) rồi GET đều đặn 1.5 s, không có 429/503: không phải quá tải
+    lim = HostLimiter(16); ok(lim, latency=0.05)
+    for _ in range(600):
+        clock.now += 0.1; ok(lim, latency=1.5)
+    assert lim.snapshot()[HOST] == {"limit": 16, "inflight": 0, "rate": None, "throttled": 0}
+
+
+def test_latency_spike_cuts_down_to_floor_only(clock):
+    lim = HostLimiter(16)
+    for _ in range(50):
+        clock.now += 0.1; ok(lim, latency=0.2)
+    st = lim._hosts[HOST]; lowest = (st["limit"], st["rate"] or float("inf"))
+    for _ in range(100):
+        clock.now += 0.1; ok(lim, latency=5.0)
+        lowest = min(lowest[0], st["limit"]), min(lowest[1], st["rate"] or float("inf"))
+    assert lowest[0] < 16  # độ trễ tăng vọt thật vẫn làm giảm
+    assert lowest[0] >= 16 * HostLimiter.LATENCY_MIN_LIMIT and lowest[1] >= HostLimiter.LATENCY_MIN_RATE
+    for _ in range(200):
+        clock.now += 0.1; ok(lim, latency=5.0)  # độ trễ cao kéo dài thành mức nền mới -> hồi phục
+    assert lim.snapshot()[HOST]["limit"] == 16 and lim.snapshot()[HOST]["rate"] is None
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Lọc gần trùng: HammingIndex (multi-index hashing) so với duyệt vét cạn, NearDuplicateIndex giữ bản lớn nhất của cụm."""
+
+import os, random, shutil
+
+import pytest
+
+from image_downloader_engine import ContentIndex, HammingIndex, NearDuplicateIndex, image_fingerprint
+
+
+def flip(h: int, rnd: random.Random, k: int) -> int:
+    for b in rnd.sample(range(64), k): h ^= 1 << b
+    return h
+
+
+@pytest.mark.parametrize("max_distance", [0, 1, 3, 6, 10])
+def test_hamming_index_matches_brute_force(max_distance):
+    rnd = random.Random(max_distance); base = [rnd.getrandbits(64) for _ in range(300)]
+    # cụm quanh mỗi hash gốc ở đủ mọi khoảng cách, cả vừa trong lẫn vừa ngoài ngưỡng
+    hashes = base + [flip(h, rnd, rnd.randint(1, max_distance + 3)) for h in base for _ in range(3)]
+    index = HammingIndex(max_distance)
+    for i, h in enumerate(hashes): index.add(h, i)
+    assert len(index) == len(hashes)
+    for q in base[:100] + [flip(h, rnd, max_distance) for h in base[100:150]] + [rnd.getrandbits(64) for _ in range(50)]:
+        expected = sorted(((q ^ h).bit_count(), i) for i, h in enumerate(hashes) if (q ^ h).bit_count() <= max_distance)
+        assert sorted(index.find(q)) == expected
+
+
+def test_hamming_index_duplicate_hashes_and_edges():
+    index = HammingIndex(2)
+    index.add(0, "a"); index.add(0, "b"); index.add((1 << 64) - 1, "c"); index.add(0b11, "d"); index.add(0b111, "e")
+    assert sorted(index.find(0)) == [(0, "a"), (0, "b"), (2, "d")]
+    assert index.find((1 << 64) - 1) == [(0, "c")]
+    assert HammingIndex(100).max_distance == 100 and len(HammingIndex(100)._parts) == 64
+
+
+# ====== NearDuplicateIndex (cần Pillow) ======
+
+@pytest.fixture
+def Image():
+    return pytest.importorskip("PIL.Image")
+
+
+def make_image(Image, path, size, seed: int = 1, fmt: str = "JPEG"):
+    """Ảnh mịn từ lưới 9x8 ngẫu nhiên phóng to: dHash ổn định khi đổi cỡ / định dạng."""
+    rnd = random.Random(seed); small = Image.new("L", (9, 8)); small.putdata([rnd.randrange(256) for _ in range(72)])
+    small.resize(size, Image.Resampling.BICUBIC).convert("RGB").save(path, fmt, quality=90)
+    return str(path)
+
+
+def placer(out_dir):
+    def keep(near: NearDuplicateIndex, src: str, name: str):
+        tmp = os.path.join(out_dir, f".tmp_{name}"); shutil.copy(src, tmp); dst = os.path.join(out_dir, name)
+        path, reason = near.keep(tmp, name, name, os.path.getsize(tmp), lambda: (os.replace(tmp, dst), dst)[1])
+        if reason: os.remove(tmp)
+        return path, reason
+    return keep
+
+
+def test_largest_copy_survives(Image, tmp_path):
+    src = tmp_path / "src"; out = tmp_path / "out"; src.mkdir(); out.mkdir(); keep = placer(str(out))
+    mid, small, big = (make_image(Image, src / f"{w}.jpg", (w, w * 3 // 4)) for w in (400, 200, 1200))
+    png = make_image(Image, src / "400.png", (400, 300), fmt="PNG"); other = make_image(Image, src / "khac.jpg", (300, 225), seed=2)
+    fps = [image_fingerprint(p) for p in (mid, small, big, png)]
+    assert max((a[0] ^ b[0]).bit_count() for a in fps for b in fps) <= 6 and (fps[0][0] ^ image_fingerprint(other)[0]).bit_count() > 6
+
+    removed = []; near = NearDuplicateIndex(6, on_remove=removed.append)
+    assert keep(near, mid, "mid.jpg")[0] == str(out / "mid.jpg")
+    path, reason = keep(near, small, "small.jpg")
+    assert path is None and "gần trùng" in reason and "mid.jpg" in reason
+    assert keep(near, big, "big.jpg")[0] == str(out / "big.jpg")  # lớn hơn: giữ, xóa bản vừa
+    assert removed == [str(out / "mid.jpg")] and near.removed == 1
+    assert keep(near, png, "mid.png")[0] is None  # cùng ảnh, khác định dạng, nhỏ hơn bản đang giữ
+    assert keep(near, other, "khac.jpg")[0] == str(out / "khac.jpg")
+    assert sorted(os.listdir(out)) == ["big.jpg", "khac.jpg"]
+
+
+def test_fingerprints_persist_across_runs(Image, tmp_path):
+    src = tmp_path / "src"; out = tmp_path / "out"; src.mkdir(); out.mkdir(); keep = placer(str(out))
+    small, big = (make_image(Image, src / f"{w}.jpg", (w, w * 3 // 4)) for w in (300, 900))
+    index = ContentIndex(str(out)); near = NearDuplicateIndex(6, index)
+    path, _ = keep(near, small, "small.jpg"); index.record_file("small.jpg", path, os.path.getsize(path))
+    near.save(); index.close()
+
+    index = ContentIndex(str(out)); near = NearDuplicateIndex(6, index)
+    assert near.load() == 0 and len(near.tree) == 1  # dấu vân đã lưu: không tính lại
+    assert keep(near, big, "big.jpg")[0] == str(out / "big.jpg")
+    assert not os.path.exists(out / "small.jpg") and [r[1] for r in index.fingerprints()] == []  # bản nhỏ của lần trước bị xóa
+    index.close()
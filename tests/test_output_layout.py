@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""NameAllocator (tên không trùng khi nhiều luồng cùng ghi, tìm số trống bằng nhảy mũ 2 + chia đôi) và OutputLayout."""
+
+import os, threading
+
+import pytest
+
+from image_downloader_engine import LAYOUTS, NameAllocator, OutputLayout, page_dir_name
+
+DIGEST = "abcdef0123456789abcdef0123456789abcdef01"
+
+
+def tmp_file(d, data: bytes) -> str:
+    path = os.path.join(d, f".tmp_{threading.get_ident()}_{len(os.listdir(d))}_{data.hex()}")
+    with open(path, "wb") as f: f.write(data)
+    return path
+
+
+def test_concurrent_claims_get_unique_names(tmp_path):
+    # 2 allocator = 2 tiến trình không chung bộ đếm: chỉ O_EXCL giữ cho không ghi đè nhau
+    allocators = [NameAllocator(), NameAllocator()]; results = []; lock = threading.Lock(); barrier = threading.Barrier(8)
+    src = tmp_path / "src"; src.mkdir(); out = str(tmp_path / "out")
+    def worker(w: int):
+        barrier.wait()
+        for i in range(25):
+            data = f"{w}-{i}".encode(); path = allocators[w % 2].claim(tmp_file(str(src), data), os.path.join(out, "anh.jpg"))
+            with lock: results.append((path, data))
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len({p for p, _ in results}) == 200 and len(os.listdir(out)) == 200 and not os.listdir(src)
+    for path, data in results:
+        with open(path, "rb") as f: assert f.read() == data
+    assert {os.path.basename(p) for p, _ in results} == {"anh.jpg"} | {f"anh_{n}.jpg" for n in range(1, 200)}
+
+
+def test_claim_skips_existing_files_with_few_syscalls(tmp_path, monkeypatch):
+    for name in ["a.jpg"] + [f"a_{n}.jpg" for n in range(1, 1000)]: (tmp_path / name).write_bytes(b"")
+    calls = []; exists = os.path.exists
+    monkeypatch.setattr(os.path, "exists", lambda p: calls.append(p) or exists(p))
+    names = NameAllocator()
+    assert names.claim(tmp_file(tmp_path, b"1"), str(tmp_path / "a.jpg")) == str(tmp_path / "a_1000.jpg")
+    assert len(calls) <= 2 * 10 + 2  # nhảy mũ 2 + chia đôi: O(log N), không dò 1000 tên
+    calls.clear()
+    assert names.claim(tmp_file(tmp_path, b"2"), str(tmp_path / "a.jpg")) == str(tmp_path / "a_1001.jpg")
+    assert not calls  # bộ đếm trong bộ nhớ: không dò lại
+
+
+def test_claim_with_gaps_never_overwrites(tmp_path):
+    for name in ["b.png", "b_1.png", "b_2.png", "b_3.png", "b_5.png"]: (tmp_path / name).write_bytes(b"")
+    names = NameAllocator()
+    got = [os.path.basename(names.claim(tmp_file(tmp_path, bytes([i])), str(tmp_path / "b.png"))) for i in range(3)]
+    # chia đôi giả định dãy số liền nhau: lỗ hổng b_4 nằm dưới bước nhảy bị bỏ qua, nhưng không bao giờ ghi đè b_5
+    assert got == ["b_6.png", "b_7.png", "b_8.png"]
+    with open(tmp_path / "b_5.png", "rb") as f: assert f.read() == b""
+    # khác hoa thường vẫn là cùng tên (Windows/macOS): dùng chung bộ đếm
+    assert os.path.basename(names.claim(tmp_file(tmp_path, b"x"), str(tmp_path / "B.PNG"))) == "B_9.PNG"
+
+
+@pytest.mark.parametrize("mode, img_url, page_url, expected", [
+    ("flat", "https://img.example.com/x.jpg", "https://blog.example/a/b", "x.jpg"),
+    ("host", "https://img.example.com:8080/x.jpg", "", os.path.join("img.example.com_8080", "x.jpg")),
+    ("host", "data:image/png;base64,iVBORw0KGgo=", "", os.path.join("data", "x.jpg")),
+    ("page", "https://img.example.com/x.jpg", "https://blog.example/a/b/", os.path.join("blog.example_a_b", "x.jpg")),
+    ("page", "https://img.example.com/x.jpg", "", os.path.join("khac", "x.jpg")),
+    ("hash", "https://img.example.com/x.jpg", "", os.path.join("ab", "cd", "x.jpg")),
+])
+def test_layout_paths(tmp_path, mode, img_url, page_url, expected):
+    layout = OutputLayout(str(tmp_path), mode)
+    path = layout.placer(img_url, page_url)(tmp_file(tmp_path, b"img"), "x.jpg", DIGEST)
+    assert path == os.path.join(str(tmp_path), expected) and os.path.isfile(path)
+
+
+def test_page_dir_name_and_invalid_layout():
+    long_url = "https://blog.example/" + "/".join(["thu-muc-rat-dai"] * 6)
+    name = page_dir_name(long_url)
+    assert len(name) == 59 and name.startswith("blog.example_thu-muc") and name != page_dir_name(long_url + "x")
+    assert page_dir_name("https://blog.example/") == "blog.example"
+    assert "flat" in LAYOUTS
+    with pytest.raises(ValueError): OutputLayout("out", "date")
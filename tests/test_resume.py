@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Tải tiếp sau khi Hủy/crash: nhật ký job (JobJournal) và file .part tải tiếp bằng Range + If-Range."""
+
+import os, hashlib
+
+import pytest
+
+from bench_server import GalleryConfig, GalleryServer
+from image_downloader_engine import DownloadJob, JobJournal, part_path_for, remember_validator
+
+PAGES = ["https://a.example/1", "https://a.example/2"]
+
+
+def test_journal_roundtrip(tmp_path):
+    j = JobJournal(str(tmp_path), PAGES)
+    assert not j.resumed
+    j.page_resolved(PAGES[0], ["u1", "u2", "u3"])
+    j.url_finished("u1", "saved"); j.url_finished("u2", "failed", "HTTP 500"); j.url_finished("u3", "skipped", "nhỏ")
+    j.close(completed=False)
+
+    j = JobJournal(str(tmp_path), PAGES)
+    assert j.resumed and j.pages == {PAGES[0]: ["u1", "u2", "u3"]}
+    assert [j.state(u) for u in ("u1", "u2", "u3", "u4")] == ["saved", "failed", "skipped", "pending"]
+    assert not j.all_done(PAGES)  # trang 2 chưa gom, u2 lỗi
+    j.url_finished("u2", "saved"); j.page_resolved(PAGES[1], [])
+    assert j.all_done(PAGES)
+    path = j.path; j.close(completed=True)
+    assert not os.path.exists(path)
+
+
+def test_journal_tolerates_torn_line_and_separates_jobs(tmp_path):
+    j = JobJournal(str(tmp_path), PAGES); j.url_finished("u1", "saved"); j.close(completed=False)
+    with open(j.path, "a", encoding="utf-8") as f: f.write('{"t": "url", "url": "u2", "sta')  # crash giữa dòng
+    again = JobJournal(str(tmp_path), PAGES)
+    assert again.state("u1") == "saved" and again.state("u2") == "pending"
+    again.close(completed=False)
+    other = JobJournal(str(tmp_path), PAGES[:1]); crawl = JobJournal(str(tmp_path), PAGES, variant="crawl")
+    assert len({j.path, other.path, crawl.path}) == 3 and not other.resumed and not crawl.resumed
+    other.close(completed=False); crawl.close(completed=False)
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"ETag": '"abc"', "Last-Modified": "Sun, 18 Oct 2026 08:00:00 GMT"}, '"abc"'),
+    ({"ETag": 'W/"abc"', "Last-Modified": "Sun, 18 Oct 2026 08:00:00 GMT"}, "Sun, 18 Oct 2026 08:00:00 GMT"),
+    ({"ETag": 'W/"abc"'}, None),
+])
+def test_remember_validator_skips_weak_etag(tmp_path, headers, expected):
+    part = str(tmp_path / "x.part"); remember_validator(part, headers)
+    # ETag yếu không dùng được cho If-Range: lùi về Last-Modified, không có thì không ghi .meta
+    if expected is None: assert not os.path.exists(part + ".meta")
+    else:
+        with open(part + ".meta", encoding="utf-8") as f: assert f.read() == expected
+
+
+@pytest.fixture
+def gallery():
+    srv = GalleryServer(GalleryConfig(pages=1, images_per_page=1, image_bytes=300_000, size_jitter=0.0, variants=False)).start()
+    yield srv
+    srv.shutdown(); srv.server_close()
+
+
+def run_job(srv: GalleryServer, out_dir: str) -> tuple[int, int]:
+    job = DownloadJob(srv.page_urls(), out_dir, {"jpg"}, 0, False, True, "", 2)
+    return job.run()
+
+
+@pytest.mark.parametrize("validator_ok", [True, False])
+def test_part_resumes_with_range(gallery, tmp_path, validator_ok):
+    cfg = gallery.cfg; body = cfg.image_body(0); img_url = f"{gallery.base_url}/img/0.jpg"; half = len(body) // 2
+    part = part_path_for(str(tmp_path), img_url)
+    with open(part, "wb") as f: f.write(body[:half])
+    with open(part + ".meta", "w", encoding="utf-8") as f: f.write(f'"{cfg.seed}-0-NonexNone"' if validator_ok else '"cu"')
+
+    assert run_job(gallery, str(tmp_path)) == (1, 1)
+    with open(tmp_path / "0.jpg", "rb") as f: assert hashlib.sha256(f.read()).digest() == hashlib.sha256(body).digest()
+    assert not os.path.exists(part) and not os.path.exists(part + ".meta")
+    page = len(cfg.page_html(0)); sent = gallery.counters["bytes"] - page
+    # If-Range khớp: chỉ nhận nửa còn lại; ETag đã đổi: server trả cả file (200), .part cũ bị bỏ
+    assert sent == (len(body) - half if validator_ok else len(body))
+
+
+def test_job_journal_skips_saved_urls(gallery, tmp_path):
+    assert run_job(gallery, str(tmp_path)) == (1, 1)
+    assert not [n for n in os.listdir(tmp_path) if n.startswith(".tas_job_")]  # xong trọn vẹn -> xóa nhật ký
+    # nhật ký của 1 lượt dở dang: ảnh đã lưu thì lần chạy sau không tải lại
+    j = JobJournal(str(tmp_path), gallery.page_urls()); url = f"{gallery.base_url}/img/0.jpg"
+    j.page_resolved(gallery.page_urls()[0], [url]); j.url_finished(url, "saved"); j.close(completed=False)
+    images = gallery.counters["images"]
+    assert run_job(gallery, str(tmp_path)) == (1, 1)
+    assert gallery.counters["images"] == images and not os.path.exists(j.path)
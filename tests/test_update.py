@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""UpdateDownload với server Range thật (http.server chạy trong thread): tải song song, tải tiếp từ .part, sai SHA-256."""
+
+import os, time, hashlib, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from image_downloader_update import UpdateDownload, ChecksumMismatch
+
+PAYLOAD = os.urandom(1024 * 1024 + 123)
+LAST_MODIFIED = "Sun, 18 Oct 2026 08:00:00 GMT"
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Phục vụ PAYLOAD, hỗ trợ Range + If-Range (chỉ so với Last-Modified vì ETag là ETag yếu)."""
+    protocol_version = "HTTP/1.1"
+    def log_message(self, *a): pass
+    def do_GET(self):
+        srv = self.server; rng = self.headers.get("Range", ""); if_range = self.headers.get("If-Range")
+        with srv.lock: srv.if_ranges.append(if_range)
+        start, end = 0, len(PAYLOAD) - 1; partial = rng.startswith("bytes=") and (if_range is None or if_range == LAST_MODIFIED)
+        if partial:
+            a, _, b = rng[len("bytes="):].partition("-"); start = int(a); end = min(end, int(b)) if b else end
+            with srv.lock: srv.ranges.append((start, end))
+        self.send_response(206 if partial else 200)
+        self.send_header("ETag", 'W/"v1"'); self.send_header("Last-Modified", LAST_MODIFIED)
+        if partial: self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.send_header("Content-Length", str(end - start + 1)); self.end_headers()
+        try:
+            for pos in range(start, end + 1, 16 * 1024):
+                chunk = PAYLOAD[pos:min(pos + 16 * 1024, end + 1)]; self.wfile.write(chunk)
+                with srv.lock: srv.sent += len(chunk)
+                if srv.delay: time.sleep(srv.delay)
+        except (BrokenPipeError, ConnectionResetError): pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler); srv.daemon_threads = True
+    srv.lock = threading.Lock(); srv.if_ranges = []; srv.ranges = []; srv.sent = 0; srv.delay = 0.0
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}/TaiAnhSieuToc.exe"
+    yield srv
+    srv.shutdown(); srv.server_close()
+
+
+def test_parallel_segments(server, tmp_path):
+    dest = str(tmp_path / "app.exe"); expected = hashlib.sha256(PAYLOAD).hexdigest()
+    digest = UpdateDownload(server.url, dest, segments=4, min_segment=128 * 1024).run(expected)
+    assert digest == expected
+    with open(dest, "rb") as f: assert f.read() == PAYLOAD
+    assert len([r for r in server.ranges if r != (0, 0)]) == 4  # 4 đoạn song song ngoài lượt hỏi 1 byte đầu
+    # ETag yếu không dùng được cho If-Range: phải lùi về Last-Modified
+    assert set(server.if_ranges) == {None, LAST_MODIFIED}
+    assert not os.path.exists(dest + ".part") and not os.path.exists(dest + ".part.json")
+
+
+def test_resume_from_part(server, tmp_path):
+    dest = str(tmp_path / "app.exe"); expected = hashlib.sha256(PAYLOAD).hexdigest(); cancel = threading.Event()
+    server.delay = 0.005  # đủ chậm để Hủy giữa chừng
+    def progress(done, total):
+        if done >= len(PAYLOAD) // 3: cancel.set()
+    with pytest.raises(requests.RequestException):
+        UpdateDownload(server.url, dest, segments=4, min_segment=128 * 1024, on_progress=progress, cancel=cancel).run(expected)
+    assert os.path.exists(dest + ".part") and os.path.exists(dest + ".part.json") and not os.path.exists(dest)
+    first = server.sent
+    assert first < len(PAYLOAD)
+
+    server.delay = 0.0
+    digest = UpdateDownload(server.url, dest, segments=4, min_segment=128 * 1024).run(expected)
+    assert digest == expected
+    with open(dest, "rb") as f: assert f.read() == PAYLOAD
+    # lượt 2 chỉ tải phần còn thiếu (+ vài byte hỏi đầu), không tải lại từ đầu
+    assert server.sent - first < len(PAYLOAD) - len(PAYLOAD) // 4
+
+
+def test_checksum_mismatch(server, tmp_path):
+    dest = str(tmp_path / "app.exe")
+    with pytest.raises(ChecksumMismatch) as ei:
+        UpdateDownload(server.url, dest, segments=4, min_segment=128 * 1024).run("0" * 64)
+    assert ei.value.actual == hashlib.sha256(PAYLOAD).hexdigest()
+    assert not os.path.exists(dest) and not os.path.exists(dest + ".part") and not os.path.exists(dest + ".part.json")
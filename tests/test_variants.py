@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Gom biến thể trong cả job: bản nhỏ hơn ở trang sau không tải lại ảnh đã lấy ở trang trước; cỡ biết từ srcset / <picture>."""
+
+import dataclasses, os
+
+import pytest
+
+from bench_server import GalleryConfig, GalleryServer
+from image_downloader_engine import DownloadJob, JobVariants, VariantHints, extract_image_urls, pick_largest_variants
+
+
+def test_smaller_later_variant_is_suppressed():
+    v = JobVariants()
+    assert v.admit("https://cdn.example/wp/2024/05/anh.jpg")
+    assert not v.admit("https://cdn.example/wp/2024/05/anh-300x200.jpg")
+    assert v.admit("https://cdn.example/wp/2024/05/khac-300x200.jpg")
+    assert not v.admit("https://cdn.example/wp/2024/05/khac-150x100.jpg")
+    assert (v.suppressed, v.upgraded) == (2, 0)
+
+
+def test_larger_later_variant_is_kept_and_counted():
+    hints = VariantHints(); hints.update({"https://cdn.example/a/anh.webp?w=1200": (1200, 0)})
+    v = JobVariants(hints)
+    assert v.admit("https://cdn.example/a/anh-300x200.webp")
+    assert v.admit("https://cdn.example/a/anh.webp?w=1200")
+    assert not v.admit("https://cdn.example/a/anh.webp?w=600")
+    assert (v.suppressed, v.upgraded) == (1, 1)
+
+
+def test_same_name_in_other_album_or_host_is_not_merged():
+    v = JobVariants()
+    assert v.admit("https://cdn.example/album-a/01.jpg")
+    assert v.admit("https://cdn.example/album-b/01-300x200.jpg")
+    assert v.admit("https://img2.example/album-a/01-300x200.jpg")
+    assert v.admit("data:image/png;base64,AAAA") and v.admit("data:image/png;base64,AAAA")
+    assert v.suppressed == 0
+
+
+def test_unknown_sizes_keep_both():
+    v = JobVariants()
+    assert v.admit("https://cdn.example/a/anh.jpg?v=1")
+    assert v.admit("https://cdn.example/a/anh.jpg?v=2")  # không biết bên nào lớn hơn: không đoán
+
+
+def test_remember_from_journal():
+    v = JobVariants(); v.remember("https://cdn.example/a/anh.jpg")
+    assert not v.admit("https://cdn.example/a/anh-640x480.jpg")
+
+
+@dataclasses.dataclass
+class SplitGallery(GalleryConfig):
+    """Trang 0 chỉ có thumbnail, trang 1 có bản gốc của cùng ảnh (hoặc ngược lại)."""
+    thumb_first: bool = True
+    def page_html(self, page: int) -> bytes:
+        thumb = page == 0 if self.thumb_first else page == 1
+        return f'<html><body><img src="/img/0{"-400x300" if thumb else ""}.jpg"></body></html>'.encode()
+
+
+@pytest.mark.parametrize("thumb_first", [True, False])
+def test_job_downloads_each_image_once_across_pages(tmp_path, thumb_first):
+    srv = GalleryServer(SplitGallery(pages=2, images_per_page=1, thumb_first=thumb_first)).start(); logs = []
+    try:
+        job = DownloadJob(srv.page_urls(), str(tmp_path), {"jpg"}, 0, False, True, "", 1, on_log=logs.append)
+        ok, total = job.run()
+    finally:
+        srv.shutdown(); srv.server_close()
+    if thumb_first:
+        # bản lớn đến sau: tải thêm và báo rõ trong log
+        assert (ok, total) == (2, 2) and srv.counters["images"] == 2
+        assert any("bản lớn hơn ở trang sau" in m for m in logs)
+    else:
+        assert (ok, total) == (1, 1) and srv.counters["images"] == 1
+        assert any("Bỏ 1 bản nhỏ hơn" in m for m in logs)
+
+
+# ====== Gợi ý kích thước từ srcset / <picture> ======
+
+CDN = "https://cdn.example/p"
+
+
+def hints_from(html: str) -> VariantHints:
+    hints = VariantHints(); extract_image_urls(html, f"{CDN}/bai-viet", hints=hints); return hints
+
+
+def test_hints_from_srcset_width_pick_largest_without_probing():
+    html = f'<img src="{CDN}/s/anh.jpg" srcset="{CDN}/s/anh.jpg 480w, {CDN}/l/anh.jpg 1600w, {CDN}/m/anh.jpg 960w">'
+    hints = hints_from(html)
+    assert hints.get(f"{CDN}/l/anh.jpg") == (1600, 0) and hints.get(f"{CDN}/s/anh.jpg") == (480, 0)
+    urls = [f"{CDN}/s/anh.jpg", f"{CDN}/m/anh.jpg", f"{CDN}/l/anh.jpg"]
+    assert pick_largest_variants(None, urls, hints=hints) == [f"{CDN}/l/anh.jpg"]  # session None: không dò mạng
+
+
+def test_hints_from_picture_rank_job_variants():
+    html = f"""<picture><source srcset="{CDN}/a/anh.webp?q=lo 1x, {CDN}/a/anh.webp?q=hi 2x">
+        <img src="{CDN}/a/anh.webp?q=lo" width="800" height="600"></picture>"""
+    hints = hints_from(html)
+    assert hints.get(f"{CDN}/a/anh.webp?q=hi") == (1600, 1200) and hints.get(f"{CDN}/a/anh.webp?q=lo") == (800, 600)
+    v = JobVariants(hints)
+    assert v.admit(f"{CDN}/a/anh.webp?q=lo") and v.admit(f"{CDN}/a/anh.webp?q=hi")
+    assert not v.admit(f"{CDN}/a/anh.webp?q=lo") and (v.suppressed, v.upgraded) == (1, 1)
+    # không có gợi ý: không biết bên nào lớn hơn -> giữ cả 2
+    v = JobVariants(VariantHints())
+    assert v.admit(f"{CDN}/a/anh.webp?q=hi") and v.admit(f"{CDN}/a/anh.webp?q=lo")
+
+
+def test_hints_keep_newest_entries():
+    hints = VariantHints(max_entries=3)
+    hints.update({"a": (1, 0), "b": (2, 0), "c": (3, 0)}); hints.update({"a": (10, 0)}); hints.update({"d": (4, 0)})
+    assert len(hints) == 3 and hints.get("b") is None and hints.get("a") == (10, 0) and hints.get("d") == (4, 0)
+
+
+@dataclasses.dataclass
+class PictureGallery(GalleryConfig):
+    """1 ảnh trong <picture> với 2 bản chỉ khác tham số (server trả cùng nội dung): cỡ chỉ biết qua mật độ x."""
+    def page_html(self, page: int) -> bytes:
+        return (b'<html><body><picture><source srcset="/img/0.jpg?q=lo 1x, /img/0.jpg?q=hi 2x">'
+                b'<img src="/img/0.jpg?q=lo" width="400" height="300"></picture></body></html>')
+
+
+def test_job_uses_picture_hints_instead_of_probing(tmp_path):
+    srv = GalleryServer(PictureGallery(pages=1, images_per_page=1, image_bytes=5_000)).start()
+    try:
+        assert DownloadJob(srv.page_urls(), str(tmp_path), {"jpg"}, 0, False, True, "", 1).run() == (1, 1)
+    finally:
+        srv.shutdown(); srv.server_close()
+    assert srv.counters["requests"] == 2  # trang + bản 2x; không HEAD dò 2 ứng viên
+    assert [n for n in os.listdir(tmp_path) if not n.startswith(".")] == ["0.jpg"]